@@ -2,18 +2,125 @@ import streamlit as st
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import os
 import re
-from utils import parser, features, scorer
-from sklearn.metrics.pairwise import cosine_similarity
+from utils import parser, features, scorer, index, metrics, boilerplate, service
+from utils.cache import PageCache
 
 # --------------------------------------------------------------------
 # setup
 BASE_DIR = Path(__file__).parent
-MODEL_PATH = BASE_DIR / "models" / "quality_model.pkl"
+MODELS_DIR = BASE_DIR / "models"
+# the .npz is exported with `python -m utils.inference models/quality_model.pkl models/quality_model.npz`
+MODEL_PATH = MODELS_DIR / "quality_model.pkl"
 DATA_PATH = BASE_DIR.parent / "data" / "data.csv"
-model = scorer.load_model(MODEL_PATH)
+INDEX_DIR = MODELS_DIR / "index"
+PAGE_CACHE_PATH = MODELS_DIR / "page_cache.sqlite"
+# e.g. http://127.0.0.1:8765 to analyze through `python -m utils.service`, whose workers
+# are shared by every session, instead of inline in this process
+SERVICE_URL = os.environ.get("SEO_SERVICE_URL", "")
+
+def file_stamp(path: Path):
+    # (mtime, size) changes whenever the file is replaced; cache keys built from it
+    # make Streamlit drop the old entry instead of serving a stale model or index
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+def data_stamp():
+    # the dataset and the published index generation: `python -m utils.index --update`
+    # replaces the manifest without touching data.csv, and prunes older generations
+    return (file_stamp(DATA_PATH), file_stamp(INDEX_DIR / index.MANIFEST))
+
+def get_model_path(bulk=False):
+    # the artifact for one-page scoring, the pickle when a whole corpus is labeled
+    return scorer.default_model_path(MODELS_DIR, bulk=bulk) or MODEL_PATH
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_model(path, stamp):
+    return scorer.load_model(path)
+
+def get_model():
+    path = get_model_path()
+    return load_model(path, file_stamp(path))
+
+@st.cache_resource(show_spinner=False)
+def get_page_cache():
+    return PageCache(PAGE_CACHE_PATH)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_corpus_index(source_stamp, model_stamp, manifest_stamp):
+    # labels depend on the model, so a new model file rebuilds the index too; a generation
+    # published by another process is picked up through the manifest stamp
+    path = get_model_path(bulk=True)
+    return index.load_or_build_index(DATA_PATH, INDEX_DIR, model=scorer.load_model(path), model_path=path)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_high_quality_index(_corpus, index_key):
+    # only the High partition and the columns shown in the results are read from disk;
+    # the lookup runs on the dense embedding store when one was built (utils.embeddings)
+    return _corpus.similarity_index("High", columns=["url", "word_count", "flesch_reading_ease"])
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def get_boilerplate_table(_corpus, index_key):
+    # per-domain block frequencies of the corpus; strips known site templates from fetched pages
+    return boilerplate.BlockTable.load(_corpus.index_dir / index.BOILERPLATE)
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_prebuilt_index(manifest_stamp):
+    # no CSV to rebuild from: serve the index as built, reloading when a build publishes a new manifest
+    return index.load_index(INDEX_DIR)
+
+def get_corpus_index():
+    if DATA_PATH.exists():
+        return load_corpus_index(file_stamp(DATA_PATH), file_stamp(get_model_path(bulk=True)), file_stamp(INDEX_DIR / index.MANIFEST))
+    return load_prebuilt_index(file_stamp(INDEX_DIR / index.MANIFEST))
+
+def index_key(corpus):
+    # the generation changes with every build and update, even when n_docs does not
+    return (corpus.source_hash, corpus.manifest.get("model_hash", ""), corpus.manifest.get("data"))
+
+@st.cache_data(show_spinner=False, max_entries=512, ttl=3600)
+def analyze(url, model_stamp, data_stamp):
+    """
+    Fetch -> features -> score -> similar high-quality pages for one URL. Cached per
+    URL and keyed by the model stamp and data_stamp(), so a repeat request is a dictionary lookup.
+    """
+    if SERVICE_URL:
+        return service.request_analysis(SERVICE_URL, url)
+    corpus = get_corpus_index()
+    table = get_boilerplate_table(corpus, index_key(corpus)) if corpus is not None else None
+    df = parser.analyze_url(url, cache=get_page_cache(), boilerplate=table)
+    # transform-only against the corpus vocabulary
+    feat_df, _, X_query = features.compute_features(df, vectorizer=corpus.vectorizer if corpus is not None else None)
+    result = scorer.score_dataframe(feat_df, model=get_model()).iloc[0].to_dict()
+    analysis = {"result": result, "has_corpus": corpus is not None, "n_high": 0, "similar": pd.DataFrame()}
+    if corpus is not None:
+        high_df, sim_index = get_high_quality_index(corpus, index_key(corpus))
+        analysis["n_high"] = len(high_df)
+        if not high_df.empty:
+            top_idx, sim_scores = sim_index.query(X_query, k=3)
+            analysis["similar"] = high_df.iloc[top_idx].assign(similarity=sim_scores)
+    return analysis
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def warm_up(model_stamp, data_stamp):
+    """
+    Loads the model and index and pushes one tiny document through features and scoring,
+    once per process and again after either file changes, so the first click is not cold.
+    With a service configured its workers hold the model and index instead.
+    """
+    if SERVICE_URL:
+        return True
+    corpus = get_corpus_index()
+    if corpus is not None:
+        get_high_quality_index(corpus, index_key(corpus))
+    scorer.warm_up(get_model(), vectorizer=corpus.vectorizer if corpus is not None else None)
+    return True
 
 st.set_page_config(page_title="SEO Content Quality Detector", layout="centered", initial_sidebar_state="collapsed")
+warm_up(file_stamp(get_model_path()), data_stamp())
 
 # --- Enhanced Minimalist Styling ---
 st.markdown("""
@@ -266,6 +373,7 @@ url = st.text_input("", placeholder="https://example.com/article", label_visibil
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
     analyze_button = st.button("🚀 Analyze Content")
+    show_timings = st.toggle("⏱ Show timing breakdown", value=False)
 
 if analyze_button:
     if not url.strip():
@@ -273,15 +381,10 @@ if analyze_button:
     else:
         with st.spinner("Fetching and analyzing webpage..."):
             try:
-                # 1️⃣ Fetch + Parse
-                df = parser.analyze_url(url)
-
-                # 2️⃣ Compute NLP Features
-                feat_df, vec, X_query = features.compute_features(df)
-
-                # 3️⃣ Score content
-                scored_df = scorer.score_dataframe(feat_df, model=model)
-                result = scored_df.iloc[0].to_dict()
+                # Fetch, parse, featurize, score and match (cached per URL)
+                with metrics.collect() as spans:
+                    analysis = analyze(url.strip(), file_stamp(get_model_path()), data_stamp())
+                result = analysis["result"]
 
                 text = result.get("body_text", "")
                 word_count = int(result.get("word_count", 0))
@@ -339,21 +442,9 @@ if analyze_button:
                 # Find similar high-quality pages
                 st.markdown('<div class="section-header">✨ Similar High-Quality Pages</div>', unsafe_allow_html=True)
 
-                if DATA_PATH.exists():
-                    data_df = pd.read_csv(DATA_PATH)
-                    data_df = parser.parse_dataframe(data_df)
-                    feat_data, vec_data, X_data = features.compute_features(data_df)
-                    scored_data = scorer.score_dataframe(feat_data, model=model)
-
-                    # filter high-quality pages
-                    high_df = scored_data[scored_data["quality_label"] == "High"]
-
-                    if not high_df.empty:
-                        X_high = vec.transform(high_df["body_text"].fillna(""))
-                        sim_scores = cosine_similarity(X_query, X_high)[0]
-                        high_df = high_df.copy()
-                        high_df["similarity"] = sim_scores
-                        top_similar = high_df.sort_values("similarity", ascending=False).head(3)
+                if analysis["has_corpus"]:
+                    if analysis["n_high"]:
+                        top_similar = analysis["similar"]
 
                         if not top_similar.empty:
                             for i, row in top_similar.iterrows():
@@ -381,7 +472,21 @@ if analyze_button:
                     else:
                         st.markdown('<div class="info-box">ℹNo high-quality pages found in dataset for comparison.</div>', unsafe_allow_html=True)
                 else:
-                    st.warning("Dataset not found (data/data.csv missing).")
+                    st.warning("Dataset not found (data/data.csv missing and no prebuilt index).")
+
+                # --------------------------------------------------------------------
+                # Optional per-stage timings of this request
+                if show_timings:
+                    with st.expander("⏱ Timing breakdown", expanded=True):
+                        if spans:
+                            timing_df = pd.DataFrame(spans).sort_values("ts")
+                            timing_df["stage"] = ["· " * d + s for d, s in zip(timing_df["depth"], timing_df["span"])]
+                            timing_df["ms"] = (timing_df["seconds"] * 1000).round(1)
+                            st.dataframe(timing_df[["stage", "ms"]], hide_index=True)
+                        else:
+                            st.caption("Served from the per-URL analysis cache; no stage ran.")
+                        if not SERVICE_URL:
+                            st.caption(f"Page cache hit rate: {get_page_cache().stats()['hit_rate']:.0%}")
 
                 # --------------------------------------------------------------------
                 # Download button
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the app imports its helpers as `utils.*` from the streamlit_app directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """
+    Local HTTP server for fetcher tests. routes maps a path to a callable taking the
+    number of earlier requests to that path and returning (status, headers, body), sent
+    chunked if headers say "Transfer-Encoding: chunked"; every request's path and
+    arrival time is kept in `requests`.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stub.lock:
+                    n = stub.counts[self.path]
+                    stub.counts[self.path] += 1
+                    stub.requests.append((self.path, time.monotonic()))
+                route = stub.routes.get(self.path)
+                status, headers, body = route(n) if route else (404, {}, b"")
+                self.send_response(status)
+                chunked = headers.get("Transfer-Encoding") == "chunked"
+                if not chunked:
+                    self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if not chunked:
+                    self.wfile.write(body)
+                    return
+                # no Content-Length up front: only the bytes read tell the size
+                for start in range(0, len(body), 1024):
+                    piece = body[start:start + 1024]
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def times(self, path: str):
+        return [t for p, t in self.requests if p == path]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,66 @@
+import pandas as pd
+
+from utils import boilerplate, parser
+
+URL = "https://example.com/news/1"
+NAV = ["Share", "Home"]
+
+
+def _table():
+    table = boilerplate.BlockTable(min_share=0.5, min_pages=3)
+    for k in range(4):
+        table.add(f"https://example.com/page/{k}", NAV + [f"story {k}"])
+    return table
+
+
+def test_nav_token_inside_a_word_is_kept():
+    blocks = ["Shareholders voted at the Homecoming meeting.", "Share", "Home"]
+    assert _table().strip(URL, blocks) == ["Shareholders voted at the Homecoming meeting."]
+
+
+def test_nested_nav_is_cut_from_its_container_only():
+    html = ("<main><div><div>Home</div><p>Shareholders voted at the Homecoming meeting.</p>"
+            "<div>Share</div></div><p>Go Home now</p></main>")
+    _, blocks, parents = parser.extract_block_tree(html)
+    assert parents == [-1, 0, 0, 0, -1]
+    assert _table().strip(URL, blocks, parents) == [
+        "Shareholders voted at the Homecoming meeting.",
+        "Shareholders voted at the Homecoming meeting.",
+        "Go Home now",
+    ]
+
+
+def test_strip_frame_uses_block_parents():
+    html = "<main><div><p>Home</p><p>Homecoming is on Friday.</p></div></main>"
+    df = parser.parse_dataframe(pd.DataFrame({"url": [URL], "html_content": [html]}), blocks=True)
+    out = _table().strip_frame(df)
+    assert out.loc[0, "body_text"] == "Homecoming is on Friday. Homecoming is on Friday."
+    assert "blocks" not in out.columns and "block_parents" not in out.columns
+
+
+def test_same_site_duplicates_survive(tmp_path):
+    article = "<html><body><main><p>" + "A long article about quarterly results. " * 20 + "</p></main></body></html>"
+    pages = pd.DataFrame({"url": [f"https://small.example/a{k}" for k in range(3)],
+                          "html_content": [article, article, "<p>Contact us</p>"]})
+    out = boilerplate.strip_boilerplate(parser.parse_dataframe(pages, blocks=True))
+    assert (out["word_count"].iloc[:2] > 100).all()
+    # even a cluster larger than the page floor keeps its main block
+    many = pd.DataFrame({"url": [f"https://big.example/a{k}" for k in range(boilerplate.MIN_PAGES + 10)],
+                         "html_content": article})
+    out = boilerplate.strip_boilerplate(parser.parse_dataframe(many, blocks=True))
+    assert (out["word_count"] > 100).all()
+
+
+def test_changed_and_removed_pages_stop_counting(tmp_path):
+    table = _table()
+    assert table.is_boilerplate("example.com", boilerplate.block_hash("Share"))
+    for k in range(2):
+        assert table.add(f"https://example.com/page/{k}", [f"new story {k}"])
+    assert not table.add("https://example.com/page/0", ["new story 0"])
+    assert table.pages["example.com"] == 4
+    assert table.counts["example.com", boilerplate.block_hash("Share")] == 2
+    assert table.retain(["https://example.com/page/0"]) == 3
+    table.save(tmp_path / "table")
+    loaded = boilerplate.BlockTable.load(tmp_path / "table", min_share=0.5, min_pages=3)
+    assert loaded.pages["example.com"] == 1 and loaded.seen == table.seen
+    assert ("example.com", boilerplate.block_hash("Share")) not in loaded.counts
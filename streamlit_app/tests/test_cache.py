@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import parser
+from utils.cache import PageCache
+from stub_http import StubServer
+
+PAGE = b"<html><title>T</title><body><p>cached page</p></body></html>"
+
+
+def page(n):
+    return 200, {"ETag": '"v1"', "Content-Type": "text/html; charset=utf-8"}, PAGE
+
+
+def test_counters_under_concurrent_lookups(tmp_path):
+    cache = PageCache(tmp_path / "pages.sqlite")
+    with StubServer({f"/p{k}": page for k in range(4)}) as srv:
+        urls = [srv.url(f"/p{k % 4}") for k in range(200)]
+        for url in urls[:4]:
+            parser.analyze_url(url, cache=cache)
+        with ThreadPoolExecutor(8) as pool:
+            bodies = list(pool.map(lambda u: parser.analyze_url(u, cache=cache)["body_text"][0], urls[4:]))
+    stats = cache.stats()
+    assert set(bodies) == {"cached page"}
+    assert (stats["hits"], stats["misses"]) == (196, 4)
+
+
+def test_stale_entry_is_revalidated(tmp_path):
+    cache = PageCache(tmp_path / "pages.sqlite", ttl=0)
+    with StubServer({"/p": lambda n: page(n) if n == 0 else (304, {}, b"")}) as srv:
+        first = parser.analyze_url(srv.url("/p"), cache=cache)
+        second = parser.analyze_url(srv.url("/p"), cache=cache)
+    assert first.equals(second)
+    assert cache.stats()["revalidated"] == 1 and cache.stats()["misses"] == 1
+    assert cache.lookup(srv.url("/p"))["title"] == "T"
+    assert cache.html(srv.url("/p")) == PAGE.decode()
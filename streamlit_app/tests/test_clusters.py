@@ -0,0 +1,23 @@
+import numpy as np
+
+from utils.clusters import DuplicateClusters
+
+
+def test_streamed_batches_match_one_pass_build():
+    rng = np.random.RandomState(0)
+    n = 2000
+    rows, cols = rng.randint(0, n, 1500), rng.randint(0, n, 1500)
+    streamed = DuplicateClusters(n)
+    merges = sum(streamed.add_pairs(rows[k:k + 7], cols[k:k + 7]) for k in range(0, len(rows), 7))
+    batch = DuplicateClusters.from_pairs(rows, cols, n)
+    assert np.array_equal(streamed.labels, batch.labels)
+    assert merges == n - len(np.unique(batch.labels))
+
+
+def test_labels_are_smallest_member_and_grow_with_new_docs():
+    clusters = DuplicateClusters(3)
+    clusters.add_pairs([5], [2])
+    clusters.add_pairs([4], [5])
+    clusters.add_pairs([0], [4])
+    assert clusters.labels.tolist() == [0, 1, 0, 3, 0, 0]
+    assert clusters.sizes().tolist() == [4, 1, 4, 1, 4, 4]
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from utils import features
+
+TEXTS = ["", "  \t\n", "The cake is made. Is it? Yes!", "she the be bbe bbbe able made",
+         "a\x85b\xa0c　d e é naïve", "nul\x00inside text", "　word　", "x" * 5]
+
+
+def test_counts_match_split_and_punctuation():
+    stats = features.text_stats(pd.Series(TEXTS))
+    assert stats["word_count"].tolist() == [len(t.split()) for t in TEXTS]
+    assert stats["sentence_count"].tolist() == [max(1, sum(t.count(c) for c in ".!?")) for t in TEXTS]
+
+
+def test_chunks_and_scalar_fallback_agree(monkeypatch):
+    monkeypatch.setattr(features, "TEXTSTAT", None)
+    whole = features.text_stats(pd.Series(TEXTS))
+    chunked = features.text_stats(pd.Series(TEXTS), chunksize=3)
+    pd.testing.assert_frame_equal(whole, chunked)
+    assert [features.flesch_reading_ease(t) for t in TEXTS] == pytest.approx(whole["flesch_reading_ease"].tolist())
+    # one syllable per word at least, and a silent final "e" only after a consonant in a longer word
+    assert whole["syllable_count"].tolist()[3] == 8
+
+
+def test_similarity_query_prunes_without_losing_matches():
+    rng = np.random.RandomState(0)
+    X = sparse.random(300, 500, density=0.03, random_state=rng, format="csr")
+    X.data = rng.exponential(size=X.nnz)
+    index = features.SimilarityIndex(X)
+    full = (normalize(X) @ normalize(X).T).toarray()
+    for q in range(0, 300, 7):
+        docs, sims = index.query(X[q], k=5)
+        assert sims == pytest.approx(np.sort(full[q])[::-1][:5])
+        assert full[q, docs] == pytest.approx(sims)
+
+
+def test_similarity_query_without_shared_terms_still_returns_k():
+    X = sparse.csr_matrix(np.eye(6)[:, :4])
+    index = features.SimilarityIndex(X)
+    docs, sims = index.query(sparse.csr_matrix(np.eye(4)[[2]]), k=3)
+    assert docs.tolist()[0] == 2 and len(docs) == 3 and sims.tolist()[1:] == [0.0, 0.0]
+    docs, sims = index.query(sparse.csr_matrix((1, 4)), k=3)
+    assert sims.tolist() == [0.0, 0.0, 0.0]
+    assert len(index.query(sparse.csr_matrix((1, 4)), k=3, fill=False)[0]) == 0
+    assert [len(d) for d, _ in index.query_many(sparse.csr_matrix(np.eye(4)[[0, 1]]), k=3)] == [3, 3]
+
+
+@pytest.mark.parametrize("threshold", [0.9, 0.5, 0.3, 0.0])
+def test_blocked_join_matches_full_matrix(threshold):
+    rng = np.random.RandomState(1)
+    X = sparse.random(60, 40, density=0.1, random_state=rng, format="lil")
+    X[7] = X[3] * 2.0
+    X = X.tocsr()
+    full = (normalize(X) @ normalize(X).T).toarray()
+    i, j = np.triu_indices(60, k=1)
+    keep = full[i, j] >= threshold
+    for block_size in (1, 7, 60):
+        rows, cols, sims = features.similarity_join(X, sim_threshold=threshold, block_size=block_size)
+        assert rows.tolist() == i[keep].tolist() and cols.tolist() == j[keep].tolist()
+        assert sims == pytest.approx(full[i, j][keep])
+    a, b, sims = features.cross_similarity(X[:25], X[25:], sim_threshold=max(threshold, 1e-9), block_size=4)
+    cross = full[:25, 25:]
+    assert sorted(zip(a.tolist(), b.tolist())) == sorted(zip(*np.nonzero(cross >= max(threshold, 1e-9))))
+
+
+def test_top_keywords_match_a_full_sort():
+    rng = np.random.RandomState(2)
+    # weights rounded to one decimal, so many rows hold ties across the top 5
+    X = sparse.random(200, 30, density=0.15, random_state=rng, format="csr")
+    X.data = np.round(X.data, 1)
+    X = sparse.vstack([X, sparse.csr_matrix((1, 30)), sparse.csr_matrix(np.eye(30)[[4]])]).tocsr()
+    names = np.array([f"t{c:02d}" for c in range(30)], dtype=object)
+    got = features.top_keywords_from_matrix(X, names, top_n=5)
+    chunked = [kw for part in features.iter_top_keywords(X, names, top_n=5, chunk_size=17) for kw in part]
+    assert chunked == got
+    for row, keywords in zip(X.toarray(), got):
+        # heaviest first, equal weights by column: what the old argsort gave up to tie order
+        order = np.lexsort((np.arange(30), -row))[:5]
+        assert keywords == [names[c] for c in order if row[c] > 0]
+        old = row.argsort()[::-1][:5]
+        assert sorted(row[[int(k[1:]) for k in keywords]]) == sorted(row[old][row[old] > 0])
@@ -0,0 +1,85 @@
+import time
+
+from utils import parser
+from stub_http import StubServer
+
+PAGE = b"<html><title>T</title><body><p>hello</p></body></html>"
+
+
+def ok(n):
+    return 200, {"Content-Type": "text/html; charset=utf-8"}, PAGE
+
+
+def fetch(urls, **kwargs):
+    kwargs = {"per_host": 0, "backoff": 0.01, "timeout": 5, **kwargs}
+    return {r["url"]: r for r in parser.fetch_many(urls, **kwargs)}
+
+
+def test_per_host_throttling():
+    with StubServer({f"/p{k}": ok for k in range(5)}) as srv:
+        results = fetch([srv.url(f"/p{k}") for k in range(5)], per_host=10, burst=1, concurrency=5)
+        assert all(r["status"] == 200 for r in results.values())
+        times = sorted(t for _, t in srv.requests)
+    # one token every 0.1 s after the first
+    assert times[-1] - times[0] >= 0.35
+
+
+def test_retries_server_errors_then_succeeds():
+    def flaky(n):
+        return (503, {}, b"") if n < 2 else ok(n)
+
+    with StubServer({"/flaky": flaky}) as srv:
+        result = fetch([srv.url("/flaky")], retries=3)[srv.url("/flaky")]
+    assert result["status"] == 200 and result["error"] is None and result["attempts"] == 3
+
+
+def test_gives_up_after_retries():
+    with StubServer({"/down": lambda n: (500, {}, b"")}) as srv:
+        result = fetch([srv.url("/down")], retries=2)[srv.url("/down")]
+    assert result["error"] == "HTTP 500" and result["attempts"] == 3
+
+
+def test_size_cap():
+    big = b"<p>" + b"x" * 5000 + b"</p>"
+    with StubServer({"/declared": lambda n: (200, {}, big),
+                     "/streamed": lambda n: (200, {"Transfer-Encoding": "chunked"}, big),
+                     "/small": ok}) as srv:
+        results = fetch([srv.url("/declared"), srv.url("/streamed"), srv.url("/small")], max_bytes=1000)
+    assert results[srv.url("/declared")]["error"].startswith("too large: 5007 bytes")
+    assert results[srv.url("/streamed")]["error"] == "too large: more than 1000 bytes"
+    assert results[srv.url("/declared")]["attempts"] == 1
+    assert results[srv.url("/small")]["error"] is None
+
+
+def test_429_honours_retry_after():
+    def limited(n):
+        return (429, {"Retry-After": "1"}, b"") if n == 0 else ok(n)
+
+    with StubServer({"/limited": limited}) as srv:
+        result = fetch([srv.url("/limited")])[srv.url("/limited")]
+        first, second = srv.times("/limited")
+    assert result["status"] == 200 and result["attempts"] == 2
+    assert second - first >= 0.9
+
+
+def test_retry_after_is_capped():
+    def limited(n):
+        return (429, {"Retry-After": "86400"}, b"") if n == 0 else ok(n)
+
+    with StubServer({"/limited": limited}) as srv:
+        start = time.monotonic()
+        result = fetch([srv.url("/limited")], max_retry_after=0.2)[srv.url("/limited")]
+    assert result["status"] == 200 and time.monotonic() - start < 5
+
+
+def test_retry_after_http_date():
+    assert parser._retry_delay(0, 0.5, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0
+    assert parser._retry_delay(0, 0.5, {"Retry-After": "soon"}) == 0.5
+
+
+def test_one_bad_url_does_not_fail_the_batch():
+    bogus = lambda n: (200, {"Content-Type": "text/html; charset=no-such-codec"}, PAGE)
+    with StubServer({"/bogus": bogus, "/ok": ok}) as srv:
+        results = fetch([srv.url("/bogus"), srv.url("/ok")])
+    assert results[srv.url("/bogus")]["error"].startswith("LookupError")
+    assert results[srv.url("/ok")]["html"] == PAGE.decode()
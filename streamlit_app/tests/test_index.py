@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from utils import embeddings, features, index
+
+
+def _pages(n, words=40):
+    return [{"url": f"https://site{k}.example/p", "html_content": f"<html><title>p{k}</title><body><p>"
+             + " ".join(f"word{k}_{j}" for j in range(words)) + "</p></body></html>"} for k in range(n)]
+
+
+def test_corpus_without_high_pages_finds_no_similar_pages(tmp_path):
+    csv = tmp_path / "data.csv"
+    pd.DataFrame(_pages(4)).to_csv(csv, index=False)
+    corpus = index.build_index(csv, tmp_path / "index")
+    high, sim = corpus.similarity_index("High", columns=["url"])
+    assert high.empty
+    docs, sims = sim.query(corpus.X[0], k=3)
+    assert len(docs) == 0 and len(sims) == 0
+    assert [len(d) for d, _ in sim.query_many(corpus.X[:2], k=3)] == [0, 0]
+
+
+def test_empty_reference_sets_build():
+    X = sparse.csr_matrix((0, 5))
+    assert len(features.SimilarityIndex(X).query(sparse.csr_matrix(np.ones((1, 5))), k=3)[0]) == 0
+    store = embeddings.EmbeddingStore.fit(sparse.random(20, 5, density=0.5, random_state=0, format="csr"), 2)
+    empty = store.subset([]).with_exact(X)
+    assert len(empty.query(sparse.csr_matrix(np.ones((1, 5))), k=3)[0]) == 0
+
+
+def test_reranked_subset_reads_rows_of_the_shared_matrix():
+    X = sparse.random(40, 30, density=0.3, random_state=1, format="csr")
+    rows = np.arange(3, 40, 2)
+    store = embeddings.EmbeddingStore.fit(X, 8).with_exact(X).subset(rows)
+    assert np.shares_memory(store.exact.data, X.data)
+    exact = (normalize(X[rows]) @ normalize(X[5]).T).toarray().ravel()
+    docs, sims = store.query(X[5], k=3)
+    assert docs[0] == 1 and sims == pytest.approx(exact[docs])
+
+
+def test_update_keeps_the_pairs_of_a_full_join(tmp_path):
+    pages = _pages(8)
+    # 0-1 and 2-3 start out as duplicate pairs
+    pages[1]["html_content"] = pages[0]["html_content"].replace("<title>p0", "<title>p1")
+    pages[3]["html_content"] = pages[2]["html_content"]
+    csv = tmp_path / "data.csv"
+    pd.DataFrame(pages).to_csv(csv, index=False)
+    index.build_index(csv, tmp_path / "index")
+    delta = _pages(10)[8:]
+    delta.append(dict(pages[4], html_content=pages[5]["html_content"]))  # 4 becomes a copy of 5
+    delta.append(dict(pages[3], html_content=pages[6]["html_content"]))  # 3 leaves 2 for 6
+    delta.append(dict(_pages(10)[9], url="https://copy.example/p", html_content=pages[0]["html_content"]))
+    corpus = index.update_index(tmp_path / "index", pd.DataFrame(delta))
+    rows, cols, sims = features.similarity_join(corpus.X, sim_threshold=corpus.manifest.get("sim_threshold", 0.9))
+    dups = index.load_duplicates(corpus.index_dir)
+    assert list(zip(dups["i"], dups["j"])) == list(zip(rows.tolist(), cols.tolist()))
+    assert dups["similarity"].tolist() == pytest.approx(np.round(sims, 4).tolist())
+    urls = corpus.pages["url"]
+    assert (dups["url_i"].tolist(), dups["url_j"].tolist()) == (urls[rows].tolist(), urls[cols].tolist())
+    assert len(dups) == 5
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from utils import inference, scorer
+
+
+def test_artifact_matches_sklearn_on_uneven_trees(tmp_path):
+    rng = np.random.RandomState(0)
+    X = rng.rand(300, 4)
+    y = np.where(X[:, 0] > 0.7, "high", np.where(X[:, 1] > 0.5, "medium", "low"))
+    model = RandomForestClassifier(n_estimators=20, max_depth=None, min_samples_leaf=5, random_state=0).fit(X, y)
+    inference.export_model(model, tmp_path / "m.npz", feature_columns=["a", "b", "c", "d"])
+    predictor = inference.load_artifact(tmp_path / "m.npz")
+    Q = rng.rand(700, 4).astype(np.float32)
+    assert predictor.predict_proba(Q, batch_size=64) == pytest.approx(model.predict_proba(Q))
+    assert predictor.predict(Q[:1]).tolist() == model.predict(Q[:1]).tolist()
+
+
+def test_bulk_scoring_prefers_the_pickle(tmp_path):
+    assert scorer.default_model_path(tmp_path) is None
+    (tmp_path / "quality_model.npz").touch()
+    assert scorer.default_model_path(tmp_path, bulk=True).name == "quality_model.npz"
+    (tmp_path / "quality_model.pkl").touch()
+    assert scorer.default_model_path(tmp_path).name == "quality_model.npz"
+    assert scorer.default_model_path(tmp_path, bulk=True).name == "quality_model.pkl"
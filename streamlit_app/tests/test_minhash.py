@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from utils import minhash
+
+
+def test_needs_a_matrix_or_texts():
+    with pytest.raises(ValueError, match="tfidf_matrix or texts"):
+        minhash.find_duplicates_minhash(None, [], texts=None)
+
+
+def test_large_exact_clusters_are_kept():
+    n = 150
+    texts = ["one two three four five six seven"] * n
+    found = minhash.find_duplicates_minhash(None, [str(k) for k in range(n)], texts=texts, verify=False)
+    assert len(found) == n * (n - 1) // 2
+    # capped buckets fall back to a star around their first member, never to nothing
+    sigs = np.zeros((n, 128), dtype=np.uint32)
+    assert minhash.lsh_candidates(sigs, max_bucket=100).tolist() == [[0, k] for k in range(1, n)]
+    found = minhash.find_duplicates_minhash(None, ["a", "b", "c"], verify=False,
+                                            texts=["one two three four five six", "one two three four five six", "x"])
+    assert [(d["url1"], d["url2"]) for d in found] == [("a", "b")]
+
+
+def test_signatures_are_exact_universal_hashes():
+    toks = np.array([0, 1, (1 << 32) - 1, (1 << 40) + 7], dtype=np.uint64)
+    a, b = minhash._permutations(8, seed=3)
+    p, m = (1 << 61) - 1, (1 << 32) - 1
+    expected = [min((int(x) * (int(t) & m) + int(y)) % p & m for t in toks) for x, y in zip(a, b)]
+    assert minhash.minhash_signatures([toks], num_perm=8, seed=3)[0].tolist() == expected
@@ -0,0 +1,22 @@
+import inspect
+
+import pytest
+
+from utils import parser, pipeline
+
+WELL_FORMED = "<html><title>T</title><body><h1>Head</h1><p>one <b>two</b></p><ul><li>three</li></ul></body></html>"
+
+
+def test_batch_parsing_defaults_to_the_baseline_backend():
+    for fn in (parser.iter_parsed_batches, parser.parse_dataframe, pipeline.run):
+        assert inspect.signature(fn).parameters["backend"].default == "html.parser"
+
+
+@pytest.mark.parametrize("backend", [b for b, ok in (("lxml", parser.LXML), ("selectolax", parser.SELECTOLAX)) if ok])
+def test_backends_agree_on_well_formed_pages_only(backend):
+    assert parser.extract_title_and_body_from_html(WELL_FORMED, backend) == \
+        parser.extract_title_and_body_from_html(WELL_FORMED)
+    # unclosed tags are repaired differently (see the note above best_backend)
+    malformed = "<html><body><p>unclosed <p>second</body></html>"
+    assert parser.extract_title_and_body_from_html(malformed)[1] == "unclosed second second"
+    assert parser.extract_title_and_body_from_html(malformed, backend)[1] == "unclosed second"
@@ -0,0 +1,24 @@
+import pandas as pd
+
+from utils import index, service
+from test_index import _pages
+
+
+def test_worker_follows_new_generations(tmp_path):
+    csv = tmp_path / "data.csv"
+    pd.DataFrame(_pages(6)).to_csv(csv, index=False)
+    root = tmp_path / "index"
+    index.build_index(csv, root)
+    service._init_worker(str(root), None, str(tmp_path / "pages.sqlite"), 3)
+    try:
+        first = service._state["corpus"]
+        for k in range(3):
+            index.update_index(root, pd.DataFrame(_pages(7 + k)[-1:]))
+            service._refresh()
+            # the generation loaded before the update may already be pruned
+            assert service._state["corpus"].index_dir.exists()
+            assert service._state["corpus"].manifest["data"] == index.load_index(root).manifest["data"]
+        assert service._state["corpus"].manifest["n_docs"] == first.manifest["n_docs"] + 3
+    finally:
+        service._state["fetcher"].shutdown()
+        service._state["cache"].close()
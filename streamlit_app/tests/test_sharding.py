@@ -0,0 +1,63 @@
+import os
+import socket
+from pathlib import Path
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from utils import features, sharding
+
+
+def _corpus(n=40, seed=3):
+    rng = np.random.RandomState(seed)
+    X = sparse.random(n, 60, density=0.2, random_state=rng, format="lil")
+    # near-copies across and within shards, well clear of the threshold
+    for a, b in ((0, 1), (2, 15), (5, 33), (20, 39), (33, 38)):
+        X[b] = X[a] * 1.5
+    X[11] = X[10] + sparse.random(1, 60, density=0.02, random_state=rng) * 0.01
+    return X.tocsr(), [f"https://example.com/{k}" for k in range(n)]
+
+
+@pytest.mark.parametrize("shard_rows", [7, 40])
+def test_sharded_pairs_match_find_duplicates(tmp_path, shard_rows):
+    X, urls = _corpus()
+    exact = features.find_duplicates(X, urls, sim_threshold=0.9)
+    got = features.find_duplicates(X, urls, sim_threshold=0.9, method="sharded", shard_rows=shard_rows,
+                                   job_dir=tmp_path / "job")
+    key = lambda d: (d["url1"], d["url2"])
+    assert sorted(map(key, got)) == sorted(map(key, exact)) and len(exact) >= 7
+    sims = {key(d): d["similarity"] for d in exact}
+    assert [d["similarity"] for d in got] == pytest.approx([sims[key(d)] for d in got], abs=1e-4)
+    # the merged table carries the job's ids and urls, ordered by (i, j)
+    dups = sharding.merge(tmp_path / "job")
+    assert list(zip(dups["url_i"], dups["url_j"])) == [(urls[i], urls[j]) for i, j in zip(dups["i"], dups["j"])]
+    assert list(zip(dups["i"], dups["j"])) == sorted(zip(dups["i"], dups["j"]))
+
+
+def test_fresh_claim_of_an_old_task_is_not_requeued(tmp_path, monkeypatch):
+    X, urls = _corpus()
+    job = tmp_path / "job"
+    sharding.partition(X, urls, job, shard_rows=20)
+    todo, running = job / "tasks" / "todo", job / "tasks" / "running"
+    # a task planned long ago, whose last owner died on this host
+    task = sorted(todo.iterdir())[0]
+    os.rename(task, running / task.name)
+    (running / task.name).write_text(f"{socket.gethostname()}:{2 ** 22 - 1}:dead")
+    os.utime(running / task.name, (0, 0))
+    assert sharding.requeue_stale(job, lease=60) == 1
+    for path in todo.iterdir():
+        os.utime(path, (0, 0))
+    # another node checks for stale claims right after our rename, before the owner is written
+    rename, requeued = os.rename, []
+
+    def rename_and_requeue(src, dst):
+        rename(src, dst)
+        if Path(dst).parent == running and not requeued:
+            requeued.append(sharding.requeue_stale(job, lease=60))
+
+    monkeypatch.setattr(sharding.os, "rename", rename_and_requeue)
+    worker = sharding._worker_id()
+    name = sharding._claim(job, worker)
+    assert requeued == [0]
+    assert (running / name).read_text() == worker
@@ -0,0 +1,241 @@
+from pathlib import Path
+import gc
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+from utils import parser, features, scorer
+
+# Offline benchmark harness: a synthetic HTML corpus with known near-duplicates, and
+# per-stage wall time / peak traced memory for parse -> features -> score -> duplicates
+# at several corpus sizes, written as JSON so two runs can be compared.
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "ta", "shi", "po", "ve", "da", "ri", "mo", "sa", "te", "zu",
+             "ber", "lin", "tor", "gen", "fal", "cor", "ent", "ist", "ure", "ion", "al", "pro", "con")
+PAGE_TEMPLATE = ("<html><head><title>{title}</title></head><body>"
+                 "<nav><a href='/'>Home</a> <a href='/blog'>Blog</a> <a href='/about'>About</a></nav>"
+                 "<main><article><h1>{title}</h1>{paragraphs}</article></main>"
+                 "<footer><p>Copyright Example Corp. All rights reserved.</p></footer></body></html>")
+DUPLICATE_METHODS = ("exact", "blocked", "minhash")
+
+
+def _vocabulary(size: int, seed: int) -> np.ndarray:
+    """Made-up words of 1-4 syllables, so the corpus needs no dictionary or network."""
+    rng = np.random.default_rng(seed)
+    syllables = np.array(("",) + SYLLABLES, dtype=object)
+    words = {}
+    while len(words) < size:
+        # 1-4 syllables per word; index 0 is the empty syllable
+        picks = rng.integers(1, len(syllables), size=(size, 4))
+        picks[:, 1:] *= rng.random((size, 3)) < 0.6
+        for w in syllables[picks].sum(axis=1):
+            words.setdefault(w, None)
+    return np.array(list(words)[:size], dtype=object)
+
+
+def _doc_tokens(i: int, n_words: int, cdf: np.ndarray, seed: int) -> np.ndarray:
+    # every document has its own stream, so a near-copy can regenerate its original
+    rng = np.random.default_rng([seed, i])
+    return np.searchsorted(cdf, rng.random(n_words))
+
+
+def _render(tokens: np.ndarray, vocab: np.ndarray, rng) -> str:
+    words = vocab[tokens]
+    sentences, start = [], 0
+    while start < len(words):
+        stop = start + int(rng.integers(8, 26))
+        s = " ".join(words[start:stop])
+        sentences.append(s[:1].upper() + s[1:] + ".")
+        start = stop
+    paragraphs, start = [], 0
+    while start < len(sentences):
+        stop = start + int(rng.integers(3, 7))
+        paragraphs.append("<p>" + " ".join(sentences[start:stop]) + "</p>")
+        start = stop
+    return "".join(paragraphs)
+
+
+def synthetic_corpus(n_docs: int, doc_words: int = 400, dup_rate: float = 0.1, edit_rate: float = 0.02,
+                     vocab_size: int = 20000, seed: int = 0) -> pd.DataFrame:
+    """
+    Returns url, html_content and dup_of for n_docs synthetic pages.
+    Words follow a Zipf-like distribution over a made-up vocabulary; lengths vary around
+    doc_words. A dup_rate fraction of pages are near-copies of an earlier page with
+    edit_rate of their words replaced; dup_of holds that page's row (-1 for originals).
+    """
+    rng = np.random.default_rng(seed)
+    vocab = _vocabulary(vocab_size, seed)
+    p = 1.0 / np.arange(1, vocab_size + 1) ** 1.1
+    cdf = np.cumsum(p / p.sum())
+    cdf[-1] = 1.0
+    lengths = np.maximum(20, rng.normal(doc_words, doc_words * 0.3, size=n_docs)).astype(int)
+    dup_of = np.full(n_docs, -1, dtype=np.int64)
+    is_dup = rng.random(n_docs) < dup_rate
+    is_dup[0] = False
+    # each copy points at a random original that comes before it, never at another copy
+    originals, copies = np.flatnonzero(~is_dup), np.flatnonzero(is_dup)
+    n_before = np.searchsorted(originals, copies)
+    dup_of[copies] = originals[(rng.random(len(copies)) * n_before).astype(np.int64)]
+    pages = []
+    for i in range(n_docs):
+        src = dup_of[i] if dup_of[i] >= 0 else i
+        tokens = _doc_tokens(src, lengths[src], cdf, seed)
+        if src != i:
+            edits = rng.random(len(tokens)) < edit_rate
+            tokens[edits] = np.searchsorted(cdf, rng.random(edits.sum()))
+        title = " ".join(vocab[tokens[:6]]).title()
+        # layout randomness comes from the source document, so copies keep its sentence breaks
+        body = _render(tokens, vocab, np.random.default_rng([seed, src, 1]))
+        pages.append(PAGE_TEMPLATE.format(title=title, paragraphs=body))
+    return pd.DataFrame({"url": [f"https://bench.example/{i}" for i in range(n_docs)],
+                         "html_content": pages, "dup_of": dup_of})
+
+
+def measure(fn, *args, memory: bool = True, **kwargs):
+    """
+    Returns (result, seconds, peak_mb). Timing runs untraced; with memory=True the
+    call is repeated under tracemalloc for the peak (numpy buffers are traced too).
+    """
+    gc.collect()
+    t = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - t
+    peak_mb = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        result = fn(*args, **kwargs)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, seconds, peak_mb
+
+
+def _record(results: list, n_docs: int, stage: str, seconds: float, peak_mb, method=None, **extra):
+    entry = {"n_docs": n_docs, "stage": stage, "method": method, "seconds": round(seconds, 4),
+             "peak_mb": None if peak_mb is None else round(peak_mb, 2),
+             "docs_per_sec": round(n_docs / seconds, 1) if seconds > 0 else None}
+    entry.update(extra)
+    results.append(entry)
+    label = f"{stage}[{method}]" if method else stage
+    mem = f"{entry['peak_mb']:.1f} MB" if peak_mb is not None else "-"
+    print(f"{n_docs:>8} {label:<22} {seconds:>9.3f} s {mem:>12}", flush=True)
+
+
+def _duplicate_recall(found: List[dict], corpus: pd.DataFrame) -> Optional[float]:
+    truth = corpus.loc[corpus["dup_of"] >= 0]
+    if truth.empty:
+        return None
+    urls = corpus["url"].to_numpy()
+    expected = {tuple(sorted((urls[a], urls[b]))) for a, b in zip(truth["dup_of"], truth.index)}
+    got = {tuple(sorted((d["url1"], d["url2"]))) for d in found}
+    return round(len(expected & got) / len(expected), 4)
+
+
+def scaling_exponents(results: list) -> dict:
+    """Log-log slope of seconds vs n_docs per stage/method: ~1 is linear, ~2 quadratic."""
+    out = {}
+    frame = pd.DataFrame([r for r in results if not r.get("skipped")])
+    if frame.empty:
+        return out
+    for (stage, method), g in frame.groupby(["stage", frame["method"].fillna("")]):
+        g = g[g["seconds"] > 0]
+        if g["n_docs"].nunique() >= 2:
+            slope = np.polyfit(np.log(g["n_docs"]), np.log(g["seconds"]), 1)[0]
+            out[f"{stage}[{method}]" if method else stage] = round(float(slope), 3)
+    return out
+
+
+def run_benchmarks(sizes=(1000, 10000, 100000), doc_words: int = 400, dup_rate: float = 0.1,
+                   methods=DUPLICATE_METHODS, exact_max: int = 10000, sim_threshold: float = 0.9,
+                   memory: bool = True, workers: int = 1, backend: str = "html.parser",
+                   model_path: Optional[Path] = None, seed: int = 0) -> dict:
+    """
+    Benchmarks each stage at each corpus size. The exact duplicate search builds an
+    n x n matrix, so it is skipped above exact_max documents.
+    """
+    model = scorer.load_model(Path(model_path)) if model_path else None
+    results = []
+    for n in sizes:
+        t = time.perf_counter()
+        corpus = synthetic_corpus(n, doc_words=doc_words, dup_rate=dup_rate, seed=seed)
+        _record(results, n, "generate", time.perf_counter() - t, None)
+        parsed, sec, mb = measure(parser.parse_dataframe, corpus.drop(columns="dup_of"), backend=backend,
+                                  workers=workers, memory=memory)
+        _record(results, n, "parse", sec, mb, backend=backend, workers=workers)
+        (feat_df, _, X), sec, mb = measure(features.compute_features, parsed, workers=workers, memory=memory)
+        _record(results, n, "features", sec, mb, vocabulary=int(X.shape[1]), nnz=int(X.nnz))
+        _, sec, mb = measure(scorer.score_dataframe, feat_df, model=model, memory=memory)
+        _record(results, n, "score", sec, mb, model=str(model_path) if model is not None else None)
+        urls = feat_df["url"].tolist()
+        for method in methods:
+            if method == "exact" and n > exact_max:
+                results.append({"n_docs": n, "stage": "duplicates", "method": method,
+                                "skipped": f"n_docs > exact_max ({exact_max})"})
+                continue
+            found, sec, mb = measure(features.find_duplicates, X, urls, sim_threshold=sim_threshold,
+                                     method=method, memory=memory)
+            _record(results, n, "duplicates", sec, mb, method=method, pairs_found=len(found),
+                    pairs_compared=n * (n - 1) // 2 if method != "minhash" else None,
+                    recall=_duplicate_recall(found, corpus))
+        del corpus, parsed, feat_df, X
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "params": {"sizes": list(sizes), "doc_words": doc_words, "dup_rate": dup_rate,
+                       "methods": list(methods), "exact_max": exact_max, "sim_threshold": sim_threshold,
+                       "memory": memory, "workers": workers, "backend": backend, "seed": seed},
+        },
+        "results": results,
+        "scaling": scaling_exponents(results),
+    }
+
+
+def compare(baseline: dict, current: dict) -> pd.DataFrame:
+    """Per (n_docs, stage, method) seconds and peak memory of current relative to baseline."""
+    keys = ["n_docs", "stage", "method"]
+    cols = keys + ["seconds", "peak_mb"]
+    a = pd.DataFrame([r for r in baseline["results"] if not r.get("skipped")]).reindex(columns=cols)
+    b = pd.DataFrame([r for r in current["results"] if not r.get("skipped")]).reindex(columns=cols)
+    for df in (a, b):
+        df["method"] = df["method"].fillna("")
+    out = a.merge(b, on=keys, suffixes=("_base", "_new"))
+    out["time_ratio"] = (out["seconds_new"] / out["seconds_base"]).round(3)
+    out["mem_ratio"] = (out["peak_mb_new"] / out["peak_mb_base"]).round(3)
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Benchmark parse/features/score/duplicates on a synthetic corpus.")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--doc-words", type=int, default=400)
+    ap.add_argument("--dup-rate", type=float, default=0.1)
+    ap.add_argument("--methods", nargs="+", default=list(DUPLICATE_METHODS), choices=DUPLICATE_METHODS)
+    ap.add_argument("--exact-max", type=int, default=10000, help="largest corpus for the n x n exact search")
+    ap.add_argument("--sim-threshold", type=float, default=0.9)
+    ap.add_argument("--no-memory", action="store_true", help="skip the traced re-run for peak memory")
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--backend", default="html.parser")
+    ap.add_argument("--model", help="model file to score with (default: rules only)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="earlier results JSON to compare this run against")
+    args = ap.parse_args()
+
+    report = run_benchmarks(args.sizes, doc_words=args.doc_words, dup_rate=args.dup_rate, methods=args.methods,
+                            exact_max=args.exact_max, sim_threshold=args.sim_threshold, memory=not args.no_memory,
+                            workers=args.workers, backend=args.backend, model_path=args.model, seed=args.seed)
+    Path(args.out).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report["scaling"], indent=2))
+    if args.compare:
+        print(compare(json.loads(Path(args.compare).read_text()), report).to_string(index=False))
@@ -0,0 +1,235 @@
+from pathlib import Path
+from collections import Counter
+from urllib.parse import urlparse
+import hashlib
+import re
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Optional
+
+from utils import metrics, store
+
+# Cross-page boilerplate: text blocks (nav menus, footers, cookie banners) that repeat on
+# most pages of a site. Blocks are hashed per domain and counted at most once per page;
+# a block found on at least min_share of a domain's pages, and on at least min_pages
+# pages, is dropped from the body text. The table holds only hashes, (domain, block hash)
+# -> page count plus each counted url's block hashes, persists as a directory of two
+# Parquet files and is updated incrementally: a page seen again with other blocks moves
+# its counts, and pages that left the corpus can be forgotten.
+TABLE = "boilerplate"
+BLOCK_COLUMNS = ["domain", "block_hash", "count"]
+PAGE_COLUMNS = ["domain", "url_hash", "block_hashes"]
+# a template repeats on far more pages than a cluster of duplicate articles has members,
+# so copies of one article on a small site are never taken for boilerplate
+MIN_PAGES = 50
+
+
+def domain_of(url: str) -> str:
+    host = urlparse(url).hostname if isinstance(url, str) else None
+    host = host or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def _hash64(text: str) -> int:
+    # stable across processes, unlike hash()
+    digest = hashlib.blake2b(text.encode("utf-8", "ignore"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def _cut(text: str, part: str) -> str:
+    # a child block's text sits in its container's between whitespace, never mid-word
+    return " ".join(re.sub(rf"(?<!\S){re.escape(part)}(?!\S)", " ", text, count=1).split())
+
+
+def block_hash(text: str) -> int:
+    """64-bit case- and whitespace-insensitive hash of a text block."""
+    return _hash64(" ".join(text.lower().split()))
+
+
+class BlockTable:
+    """
+    Per-domain block frequencies. A block is boilerplate once it appeared on at least
+    min_pages pages of its domain and on at least min_share of them.
+    """
+
+    def __init__(self, min_share: float = 0.5, min_pages: int = MIN_PAGES):
+        self.min_share = min_share
+        self.min_pages = min_pages
+        self.pages = Counter()
+        self.counts = Counter()
+        self.seen = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, url: str, blocks: Iterable[str]) -> bool:
+        """
+        Counts the page's distinct blocks; False (nothing counted) if the url was already
+        seen with the same blocks. A url seen with other blocks replaces its old counts.
+        """
+        key = _hash64(url if isinstance(url, str) else "")
+        hashes = tuple(sorted({block_hash(b) for b in blocks}))
+        if key in self.seen:
+            if self.seen[key][1] == hashes:
+                return False
+            self._forget(key)
+        domain = domain_of(url)
+        self.seen[key] = (domain, hashes)
+        self.pages[domain] += 1
+        for h in hashes:
+            self.counts[domain, h] += 1
+        return True
+
+    def _forget(self, key: int):
+        domain, hashes = self.seen.pop(key)
+        self.pages[domain] -= 1
+        if self.pages[domain] <= 0:
+            del self.pages[domain]
+        for h in hashes:
+            self.counts[domain, h] -= 1
+            if self.counts[domain, h] <= 0:
+                del self.counts[domain, h]
+
+    def remove(self, url: str) -> bool:
+        """Uncounts a page that left the corpus; False if it was never counted."""
+        key = _hash64(url if isinstance(url, str) else "")
+        if key not in self.seen:
+            return False
+        self._forget(key)
+        return True
+
+    def retain(self, urls: Iterable[str]) -> int:
+        """Uncounts every page not in urls (the whole current corpus); returns how many."""
+        keep = {_hash64(u if isinstance(u, str) else "") for u in urls}
+        gone = [key for key in self.seen if key not in keep]
+        for key in gone:
+            self._forget(key)
+        return len(gone)
+
+    def update(self, urls: Iterable[str], block_lists: Iterable[Iterable[str]]) -> "BlockTable":
+        for url, blocks in zip(urls, block_lists):
+            self.add(url, blocks)
+        return self
+
+    def is_boilerplate(self, domain: str, h: int) -> bool:
+        count = self.counts.get((domain, h), 0)
+        return count >= self.min_pages and count >= self.min_share * self.pages.get(domain, 0)
+
+    def strip(self, url: str, blocks: Iterable[str], parents: Optional[Iterable[int]] = None) -> List[str]:
+        """
+        The page's blocks without its domain's boilerplate, in order. With `parents` (the
+        enclosing block of each, from parser.extract_block_tree) the text of a dropped block
+        is also cut out of the kept blocks that contain it; without, only whole blocks go.
+        The page's main (longest) block is never dropped or cut down to nothing.
+        """
+        blocks = list(blocks)
+        domain = domain_of(url)
+        if not blocks or self.pages.get(domain, 0) < self.min_pages:
+            return blocks
+        drop = [self.is_boilerplate(domain, block_hash(b)) for b in blocks]
+        main = max(range(len(blocks)), key=lambda k: len(blocks[k]))
+        drop[main] = False
+        texts = list(blocks)
+        if parents is not None:
+            parents = list(parents)
+            # longest first, so a dropped block is cut before any shorter one inside it
+            for k in sorted((k for k, d in enumerate(drop) if d), key=lambda k: len(blocks[k]), reverse=True):
+                # up to the nearest dropped ancestor, whose own cut covers the rest
+                up = parents[k]
+                while up >= 0 and not drop[up]:
+                    texts[up] = _cut(texts[up], blocks[k])
+                    up = parents[up]
+        texts[main] = texts[main] or blocks[main]
+        return [t for t, d in zip(texts, drop) if not d and t]
+
+    def strip_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Rebuilds body_text and word_count of a parser.parse_dataframe(..., blocks=True)
+        frame from its non-boilerplate blocks and drops the blocks columns.
+        """
+        with metrics.span("strip_boilerplate", docs=len(df)) as sp:
+            parents = df["block_parents"] if "block_parents" in df.columns else [None] * len(df)
+            kept = [self.strip(u, b, p) for u, b, p in zip(df["url"], df["blocks"], parents)]
+            out = df.drop(columns=["blocks", "block_parents"], errors="ignore").assign(body_text=[" ".join(b) for b in kept])
+            out["body_text"] = out["body_text"].astype(str)
+            out["word_count"] = out["body_text"].str.split().str.len()
+            dropped = int(df["blocks"].map(len).sum() - sum(map(len, kept)))
+            chars = int(df["body_text"].str.len().sum() - out["body_text"].str.len().sum())
+            sp.update(blocks_dropped=dropped, chars_dropped=chars)
+        metrics.incr("boilerplate_blocks_dropped_total", dropped)
+        metrics.incr("boilerplate_chars_dropped_total", chars)
+        return out
+
+    def save(self, path: Path):
+        # blocks seen only once are kept too: they may still repeat on pages crawled later
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        keys = list(self.counts)
+        store.write_dataset(pd.DataFrame({"domain": pd.Series([d for d, _ in keys], dtype=object),
+                                          "block_hash": np.array([h for _, h in keys], dtype=np.int64),
+                                          "count": np.fromiter(self.counts.values(), dtype=np.int64, count=len(keys))},
+                                         columns=BLOCK_COLUMNS), path / "blocks.parquet")
+        store.write_dataset(pd.DataFrame({"domain": pd.Series([d for d, _ in self.seen.values()], dtype=object),
+                                          "url_hash": np.fromiter(self.seen, dtype=np.int64, count=len(self.seen)),
+                                          "block_hashes": pd.Series([list(h) for _, h in self.seen.values()],
+                                                                    dtype=object)},
+                                         columns=PAGE_COLUMNS), path / "pages.parquet")
+
+    @classmethod
+    def load(cls, path: Path, **params) -> "BlockTable":
+        """
+        Loads a saved table; an empty one if there is none at path, or if it predates the
+        per-page block hashes (its pages are then counted afresh as they are seen).
+        """
+        table = cls(**params)
+        path = Path(path)
+        if (path / "pages.parquet").exists():
+            pages = store.read_dataset(path / "pages.parquet")
+            if "block_hashes" not in pages.columns:
+                return table
+            blocks = store.read_dataset(path / "blocks.parquet")
+            table.counts.update(dict(zip(zip(blocks["domain"], blocks["block_hash"].tolist()),
+                                         blocks["count"].tolist())))
+            table.seen = {key: (domain, tuple(int(h) for h in hashes)) for key, domain, hashes
+                          in zip(pages["url_hash"].tolist(), pages["domain"], pages["block_hashes"])}
+            table.pages.update(pages["domain"].tolist())
+        return table
+
+
+def strip_boilerplate(df: pd.DataFrame, table: BlockTable = None, update: bool = True) -> pd.DataFrame:
+    """
+    Strips a parsed frame with a 'blocks' column, counting its pages into `table`
+    first (a fresh table if None), so a batch can detect its own site templates.
+    """
+    table = table if table is not None else BlockTable()
+    if update:
+        table.update(df["url"], df["blocks"])
+    return table.strip_frame(df)
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils import parser
+
+    ap = argparse.ArgumentParser(description="Count repeated text blocks per domain and report the boilerplate share.")
+    ap.add_argument("input", help="crawl export (.csv or .parquet) with url and html_content")
+    ap.add_argument("--table", default=TABLE, help="block table to update (created if missing)")
+    ap.add_argument("--chunksize", type=int, default=1000)
+    ap.add_argument("--min-share", type=float, default=0.5)
+    ap.add_argument("--min-pages", type=int, default=MIN_PAGES)
+    args = ap.parse_args()
+
+    table = BlockTable.load(args.table, min_share=args.min_share, min_pages=args.min_pages)
+    # only (domain, block hash, length) per block is kept for the report, not the text
+    seen = []
+    for chunk in parser.read_crawl(args.input, chunksize=args.chunksize, columns=["url", "html_content"]):
+        # the backend the index parses with, so block hashes match what strip() sees there
+        parsed = parser.parse_dataframe(chunk, blocks=True)
+        table.update(parsed["url"], parsed["blocks"])
+        seen.extend((domain_of(u), [(block_hash(b), len(b)) for b in blocks])
+                    for u, blocks in zip(parsed["url"], parsed["blocks"]))
+    table.save(args.table)
+    before = sum(n for _, blocks in seen for _, n in blocks)
+    dropped = sum(n for domain, blocks in seen for h, n in blocks if table.is_boilerplate(domain, h))
+    print(f"{len(seen)} pages, {len(table.pages)} domains, {len(table)} blocks in {args.table}; "
+          f"boilerplate is {dropped / max(before, 1):.1%} of the block text")
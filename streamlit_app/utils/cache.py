@@ -0,0 +1,139 @@
+from pathlib import Path
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+# On-disk cache of fetched pages: raw html stored content-addressed (by sha256),
+# plus the extracted title and text blocks so repeat analyses skip both the fetch and
+# the parse. Blocks are kept unstripped: site boilerplate is dropped on every read with
+# the caller's current block table, which keeps changing as more pages are counted.
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha TEXT PRIMARY KEY,
+    html BLOB NOT NULL,
+    title TEXT NOT NULL,
+    blocks TEXT NOT NULL,
+    parents TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    sha TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_accessed ON pages(accessed_at);
+"""
+# seconds a connection waits for another process's write lock before "database is locked"
+BUSY_TIMEOUT = 30.0
+
+
+class PageCache:
+    """
+    SQLite-backed url -> (html, title, text blocks) cache.
+    Entries younger than `ttl` seconds are served as-is; older ones keep their
+    ETag/Last-Modified so the caller can revalidate with a conditional request.
+    Total stored html is kept under `max_bytes` by evicting least recently used pages.
+    Several processes can share the file, each with its own PageCache: the database is in
+    WAL mode, so readers do not block the writer, and writers wait up to `timeout` seconds.
+    """
+
+    def __init__(self, path: Path, ttl: float = 24 * 3600, max_bytes: int = 512 * 2**20,
+                 timeout: float = BUSY_TIMEOUT):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # written by an older version; it is only a cache, so start over
+            self._db.executescript(f"DROP TABLE IF EXISTS pages; DROP TABLE IF EXISTS blobs; "
+                                   f"PRAGMA user_version = {SCHEMA_VERSION};")
+        self._db.executescript(SCHEMA)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "revalidated": self.revalidated,
+                    "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """
+        Returns the cached entry (with a `fresh` flag) or None; a fresh entry counts as a
+        hit. The html itself is left on disk, see html().
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT p.sha, p.etag, p.last_modified, p.fetched_at, b.title, b.blocks, b.parents "
+                "FROM pages p JOIN blobs b ON b.sha = p.sha WHERE p.url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._db.commit()
+            sha, etag, last_modified, fetched_at, title, blocks, parents = row
+            fresh = time.time() - fetched_at < self.ttl
+            if fresh:
+                self.hits += 1
+        return {"url": url, "sha": sha, "etag": etag, "last_modified": last_modified, "title": title,
+                "blocks": json.loads(blocks), "parents": json.loads(parents), "fresh": fresh}
+
+    def html(self, url: str) -> Optional[str]:
+        """The cached html of url (decompressed on demand), or None."""
+        with self._lock:
+            row = self._db.execute("SELECT b.html FROM pages p JOIN blobs b ON b.sha = p.sha WHERE p.url = ?",
+                                   (url,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def put(self, url: str, html: str, title: str, blocks, parents, etag=None, last_modified=None):
+        """
+        Stores a page fetched after a miss (counted as one) with its
+        parser.extract_block_tree output, not boilerplate-stripped.
+        """
+        raw = html.encode("utf-8")
+        sha = hashlib.sha256(raw).hexdigest()
+        now = time.time()
+        with self._lock:
+            self.misses += 1
+            self._db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                             (sha, zlib.compress(raw), title, json.dumps(list(blocks)),
+                              json.dumps([int(p) for p in parents]), len(raw)))
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                             (url, sha, etag, last_modified, now, now))
+            self._evict()
+            self._db.commit()
+
+    def touch(self, url: str):
+        """Marks an entry as freshly revalidated after a 304 Not Modified (a hit)."""
+        with self._lock:
+            self.hits += 1
+            self.revalidated += 1
+            now = time.time()
+            self._db.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT url FROM pages ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM pages WHERE url = ?", row)
+            self.evictions += 1
+            self._db.execute("DELETE FROM blobs WHERE sha NOT IN (SELECT sha FROM pages)")
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def close(self):
+        self._db.close()
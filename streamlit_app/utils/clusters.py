@@ -0,0 +1,158 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from typing import Optional
+
+# Near-duplicate clusters: connected components of the duplicate-pair graph. One row
+# per page (cluster id + canonical page) instead of O(k^2) pair rows per cluster.
+CLUSTER_COLUMNS = ["url", "cluster_id", "canonical_url", "cluster_size"]
+
+
+class DuplicateClusters:
+    """
+    Connected components over doc indices, updated in place as pairs arrive.
+    labels[i] is the cluster id of doc i: the smallest doc index in its cluster, so
+    ids stay stable across updates unless two clusters merge (the larger id goes away).
+    Internally a union-find forest whose roots are those ids: a batch of pairs only
+    touches its own docs and roots, and labels are flattened when read.
+    """
+
+    def __init__(self, n_docs: int = 0):
+        self.parent = np.arange(n_docs, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def labels(self) -> np.ndarray:
+        while True:
+            up = self.parent[self.parent]
+            if np.array_equal(up, self.parent):
+                return self.parent
+            self.parent = up
+
+    @labels.setter
+    def labels(self, labels):
+        self.parent = np.asarray(labels, dtype=np.int64)
+
+    def grow(self, n_docs: int):
+        """New docs start as singletons."""
+        if n_docs > len(self.parent):
+            self.parent = np.concatenate([self.parent, np.arange(len(self.parent), n_docs, dtype=np.int64)])
+
+    def _find(self, docs: np.ndarray) -> np.ndarray:
+        roots = self.parent[docs]
+        while True:
+            up = self.parent[roots]
+            if np.array_equal(up, roots):
+                break
+            roots = up
+        # the looked-up docs now point straight at their roots
+        self.parent[docs] = roots
+        return roots
+
+    def add_pairs(self, rows, cols) -> int:
+        """Merges the clusters joined by the (rows[k], cols[k]) pairs; returns how many merges happened."""
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        if len(rows) == 0:
+            return 0
+        self.grow(int(max(rows.max(), cols.max())) + 1)
+        a, b = self._find(rows), self._find(cols)
+        cross = a != b
+        if not cross.any():
+            return 0
+        # components of the (usually tiny) graph between the touched cluster ids
+        ids = np.unique(np.concatenate([a[cross], b[cross]]))
+        m = len(ids)
+        ga, gb = np.searchsorted(ids, a[cross]), np.searchsorted(ids, b[cross])
+        graph = sparse.coo_matrix((np.ones(len(ga), dtype=np.int8), (ga, gb)), shape=(m, m))
+        n_comp, comp = connected_components(graph, directed=False)
+        root = np.full(n_comp, np.iinfo(np.int64).max)
+        np.minimum.at(root, comp, ids)
+        # only the merged roots move; their members follow through the forest
+        self.parent[ids] = root[comp]
+        return m - n_comp
+
+    @classmethod
+    def from_pairs(cls, rows, cols, n_docs: int) -> "DuplicateClusters":
+        """Batch build in one connected-components pass."""
+        clusters = cls(n_docs)
+        rows, cols = np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64)
+        if len(rows):
+            graph = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_docs, n_docs))
+            _, comp = connected_components(graph, directed=False)
+            root = np.full(comp.max() + 1, n_docs, dtype=np.int64)
+            np.minimum.at(root, comp, np.arange(n_docs))
+            clusters.labels = root[comp]
+        return clusters
+
+    def sizes(self) -> np.ndarray:
+        """Size of each doc's cluster."""
+        return np.bincount(self.labels, minlength=len(self.labels))[self.labels]
+
+    def canonical(self, priority=None) -> np.ndarray:
+        """
+        Canonical doc per doc: the cluster member with the highest priority (e.g. word
+        count or a quality score), ties to the lowest index; the cluster id without one.
+        """
+        if priority is None:
+            return self.labels.copy()
+        priority = np.asarray(priority, dtype=np.float64)
+        order = np.lexsort((np.arange(len(self.labels)), -priority, self.labels))
+        first = np.r_[True, self.labels[order][1:] != self.labels[order][:-1]]
+        best = np.empty(len(self.labels), dtype=np.int64)
+        best[self.labels[order][first]] = order[first]
+        return best[self.labels]
+
+    def frame(self, urls, priority=None) -> pd.DataFrame:
+        """One row per doc: url, cluster_id, canonical_url, cluster_size."""
+        urls = np.asarray(urls, dtype=object)
+        self.grow(len(urls))
+        return pd.DataFrame({"url": urls, "cluster_id": self.labels, "canonical_url": urls[self.canonical(priority)],
+                             "cluster_size": self.sizes()}, columns=CLUSTER_COLUMNS)
+
+    def save(self, path: Path):
+        np.save(path, self.labels)
+
+    @classmethod
+    def load(cls, path: Path) -> "DuplicateClusters":
+        clusters = cls()
+        clusters.labels = np.load(path).astype(np.int64)
+        return clusters
+
+
+def cluster_pairs(pairs: pd.DataFrame, urls, priority=None) -> pd.DataFrame:
+    """Cluster frame for a pair table with i/j columns (the duplicates.csv schema)."""
+    clusters = DuplicateClusters.from_pairs(pairs["i"].to_numpy(), pairs["j"].to_numpy(), len(urls))
+    return clusters.frame(urls, priority)
+
+
+def urls_from_pairs(pairs: pd.DataFrame, n_docs: Optional[int] = None) -> np.ndarray:
+    """Recovers the doc index -> url mapping from a pair table's url_i/url_j columns."""
+    if n_docs is None:
+        n_docs = int(max(pairs["i"].max(), pairs["j"].max())) + 1 if len(pairs) else 0
+    urls = np.full(n_docs, "", dtype=object)
+    urls[pairs["i"].to_numpy()] = pairs["url_i"].to_numpy()
+    urls[pairs["j"].to_numpy()] = pairs["url_j"].to_numpy()
+    return urls
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Collapse a duplicate-pair table into one cluster row per page.")
+    ap.add_argument("pairs", help="duplicates .csv or .parquet with i, j, url_i, url_j")
+    ap.add_argument("--out", default="clusters.csv")
+    args = ap.parse_args()
+
+    pairs = pd.read_parquet(args.pairs) if args.pairs.endswith(".parquet") else pd.read_csv(args.pairs)
+    out = cluster_pairs(pairs, urls_from_pairs(pairs))
+    # pages without any pair are singletons; the pair file alone does not list them
+    out = out[out["url"] != ""]
+    if args.out.endswith(".parquet"):
+        out.to_parquet(args.out, index=False)
+    else:
+        out.to_csv(args.out, index=False)
+    print(f"{len(pairs)} pairs -> {len(out)} pages in {out['cluster_id'].nunique()} clusters")
@@ -0,0 +1,329 @@
+from pathlib import Path
+import json
+import os
+import shutil
+import time
+import uuid
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from typing import List, Optional, Tuple
+
+from utils import metrics
+from utils.store import sparse_nbytes
+
+# Dense LSA embeddings: a TruncatedSVD of the TF-IDF matrix, every page stored as an
+# L2-normalized float32 vector, or int8 with one float32 scale per vector (scalar
+# quantization), in .npy files that are memory-mapped on load. Projections are centered
+# on the corpus mean before normalizing: the shared-vocabulary direction otherwise
+# dominates and pushes every pair towards cosine 1. Cosine top-k and
+# threshold search are blocked matrix products over that array, so scans run at BLAS
+# speed and the resident size is n_docs * n_components bytes (int8) instead of the
+# ~12 bytes per non-zero of the sparse rows. Similarities are approximate; report()
+# measures the pair and top-k recall against the exact sparse search. With the sparse
+# rows attached (with_exact), top-k lookups take RERANK_FACTOR x k dense candidates
+# and rank and report them by exact tfidf cosine, the scale the sparse index uses; only
+# the candidates' rows are read from the (memory-mapped) matrix, at query time.
+EMBEDDINGS = "embeddings"
+DTYPES = ("float32", "int8")
+BLOCK_ROWS = 65536
+RERANK_FACTOR = 10
+
+
+def _quantize(V: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    scales = np.abs(V).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(V / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+class EmbeddingStore:
+    """
+    components: (n_components, n_features) SVD basis and `mean` corpus projection, used to
+    embed new tfidf rows. vectors: (n_docs, n_components) float32, or int8 with per-row `scales`.
+    exact: optional tfidf matrix used to rerank lookups, whose row exact_rows[i] is vector i.
+    """
+
+    def __init__(self, components: np.ndarray, mean: np.ndarray, vectors: np.ndarray,
+                 scales: Optional[np.ndarray] = None, exact=None, exact_rows: Optional[np.ndarray] = None):
+        self.components = components
+        self.mean = mean
+        self.vectors = vectors
+        self.scales = scales
+        self.exact = exact
+        self.exact_rows = exact_rows
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dtype(self) -> str:
+        return str(self.vectors.dtype)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the stored vectors (and scales), what a full scan touches."""
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    @metrics.timed("svd_fit")
+    def fit(cls, X, n_components: int = 256, dtype: str = "float32", seed: int = 0) -> "EmbeddingStore":
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        n_components = max(1, min(n_components, X.shape[0] - 1, X.shape[1] - 1))
+        X = normalize(sparse.csr_matrix(X, dtype=np.float32), norm="l2")
+        svd = TruncatedSVD(n_components=n_components, algorithm="randomized", random_state=seed)
+        P = svd.fit_transform(X).astype(np.float32)
+        store = cls(svd.components_.astype(np.float32), P.mean(axis=0), np.empty((0, n_components), np.float32))
+        return store.with_vectors(X, dtype)
+
+    def embed(self, X) -> np.ndarray:
+        """Normalized float32 embeddings of tfidf rows (any row count)."""
+        X = normalize(sparse.csr_matrix(X, dtype=np.float32), norm="l2")
+        V = np.asarray(X @ self.components.T, dtype=np.float32) - self.mean
+        return normalize(V, norm="l2", copy=False)
+
+    def with_vectors(self, X, dtype: Optional[str] = None) -> "EmbeddingStore":
+        """A store over the rows of X with the same basis (no refit)."""
+        V = self.embed(X)
+        if (dtype or self.dtype) == "int8":
+            return EmbeddingStore(self.components, self.mean, *_quantize(V))
+        return EmbeddingStore(self.components, self.mean, V)
+
+    def subset(self, rows) -> "EmbeddingStore":
+        rows = np.asarray(rows, dtype=np.int64)
+        return EmbeddingStore(self.components, self.mean, np.ascontiguousarray(self.vectors[rows]),
+                              None if self.scales is None else np.ascontiguousarray(self.scales[rows]),
+                              self.exact, None if self.exact is None else self.exact_rows[rows])
+
+    def with_exact(self, X, rows=None) -> "EmbeddingStore":
+        """
+        The same store, with lookups reranked by exact cosine against rows of X: row rows[i]
+        for vector i, or X's rows in order. X is kept as it is (e.g. memory-mapped), not copied.
+        """
+        rows = np.arange(X.shape[0]) if rows is None else np.asarray(rows, dtype=np.int64)
+        if len(rows) != len(self):
+            raise ValueError(f"{len(rows)} rows for {len(self)} vectors")
+        return EmbeddingStore(self.components, self.mean, self.vectors, self.scales,
+                              sparse.csr_matrix(X, copy=False), rows)
+
+    def _block(self, start: int, stop: int) -> np.ndarray:
+        # int8 rows are decoded one block at a time, so the float copy stays block-sized
+        B = np.asarray(self.vectors[start:stop], dtype=np.float32)
+        if self.scales is not None:
+            B *= np.asarray(self.scales[start:stop])[:, None]
+        return B
+
+    def _blocks(self, block_rows: int):
+        for start in range(0, len(self), block_rows):
+            stop = min(start + block_rows, len(self))
+            yield start, self._block(start, stop)
+
+    @metrics.timed("dense_topk")
+    def topk(self, Q: np.ndarray, k: int = 3, block_rows: int = BLOCK_ROWS) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, similarities), each (n_queries, k) best first, for normalized query embeddings Q."""
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        k = min(k, len(self))
+        best_idx = np.empty((Q.shape[0], 0), dtype=np.int64)
+        best_sim = np.empty((Q.shape[0], 0), dtype=np.float32)
+        for start, B in self._blocks(block_rows):
+            S = Q @ B.T
+            kk = min(k, S.shape[1])
+            part = np.argpartition(S, -kk, axis=1)[:, -kk:]
+            best_idx = np.hstack([best_idx, part + start])
+            best_sim = np.hstack([best_sim, np.take_along_axis(S, part, axis=1)])
+            if best_idx.shape[1] > k:
+                keep = np.argpartition(best_sim, -k, axis=1)[:, -k:]
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+                best_sim = np.take_along_axis(best_sim, keep, axis=1)
+        order = np.argsort(-best_sim, axis=1)
+        return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_sim, order, axis=1)
+
+    def query(self, X, k: int = 3, fill: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """features.SimilarityIndex.query() over the dense vectors: top-k of the first tfidf row."""
+        return self.query_many(sparse.csr_matrix(X)[0], k=k, fill=fill)[0]
+
+    def query_many(self, X, k: int = 3, fill: bool = True) -> List[Tuple[np.ndarray, np.ndarray]]:
+        from utils import features
+        pad = (lambda i, s: features.fill_top_k(i, s, k, len(self))) if fill else (lambda i, s: (i, s))
+        if len(self) == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0))] * X.shape[0]
+        if self.exact is None:
+            # like the sparse index, only matches that share something with the query (centered cosine > 0)
+            idx, sims = self.topk(self.embed(X), k=k)
+            return [pad(i[s > 0].astype(np.int64), s[s > 0].astype(np.float64)) for i, s in zip(idx, sims)]
+        Q = normalize(sparse.csr_matrix(X), norm="l2")
+        candidates, _ = self.topk(self.embed(Q), k=k * RERANK_FACTOR)
+        out = []
+        for q, cand in enumerate(candidates):
+            sims = np.asarray((normalize(self.exact[self.exact_rows[cand]], norm="l2") @ Q[q].T).todense()).ravel()
+            order = np.argsort(-sims, kind="stable")[:k]
+            order = order[sims[order] > 0]
+            out.append(pad(cand[order].astype(np.int64), sims[order].astype(np.float64)))
+        return out
+
+    @metrics.timed("dense_join")
+    def threshold_join(self, sim_threshold: float = 0.9, block_rows: int = 4096):
+        """(rows, cols, sims) of all i < j with approximate cosine >= sim_threshold."""
+        rows, cols, sims = [], [], []
+        for a, A in self._blocks(block_rows):
+            for b, B in self._blocks(block_rows):
+                if b < a:
+                    continue
+                S = A @ B.T
+                hit = S >= sim_threshold
+                if a == b:
+                    # only i < j; masked rather than zeroed, so a threshold <= 0 cannot match the rest
+                    hit = np.triu(hit, k=1)
+                r, c = np.nonzero(hit)
+                rows.append(r + a)
+                cols.append(c + b)
+                sims.append(S[r, c])
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        rows, cols, sims = np.concatenate(rows), np.concatenate(cols), np.concatenate(sims).astype(np.float64)
+        order = np.lexsort((cols, rows))
+        return rows[order].astype(np.int64), cols[order].astype(np.int64), sims[order]
+
+    def save(self, out_dir: Path, **meta):
+        # arrays go to new file names and meta.json, which names them, is swapped in last:
+        # a reader holding the old arrays memory-mapped never sees them change
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        tag = uuid.uuid4().hex[:8]
+        arrays = {"components": self.components, "mean": self.mean, "vectors": self.vectors, "scales": self.scales}
+        files = {}
+        for name, array in arrays.items():
+            if array is not None:
+                files[name] = f"{name}-{tag}.npy"
+                np.save(out_dir / files[name], array)
+        meta.update(n_docs=len(self), n_components=self.vectors.shape[1], dtype=self.dtype, files=files)
+        tmp = out_dir / f"meta.{tag}.tmp"
+        tmp.write_text(json.dumps(meta, indent=2))
+        os.replace(tmp, out_dir / "meta.json")
+        for path in out_dir.glob("*.npy"):
+            if path.name not in files.values():
+                path.unlink()
+
+    @classmethod
+    def load(cls, out_dir: Path, mmap: bool = True) -> Optional["EmbeddingStore"]:
+        """Loads a saved store (vectors memory-mapped); None if there is none."""
+        out_dir = Path(out_dir)
+        if not (out_dir / "meta.json").exists():
+            return None
+        files = json.loads((out_dir / "meta.json").read_text())["files"]
+        mode = "r" if mmap else None
+        scales = np.load(out_dir / files["scales"], mmap_mode=mode) if "scales" in files else None
+        return cls(np.load(out_dir / files["components"]), np.load(out_dir / files["mean"]),
+                   np.load(out_dir / files["vectors"], mmap_mode=mode), scales)
+
+    @staticmethod
+    def remove(out_dir: Path):
+        """Deletes a saved store; meta.json goes first, so readers see it whole or not at all."""
+        out_dir = Path(out_dir)
+        (out_dir / "meta.json").unlink(missing_ok=True)
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+def rerank(X, rows, cols, sim_threshold: float, chunk: int = 100000):
+    """Exact tfidf cosine of candidate pairs; keeps those >= sim_threshold."""
+    Xn = normalize(sparse.csr_matrix(X), norm="l2")
+    sims = np.empty(len(rows))
+    for start in range(0, len(rows), chunk):
+        r, c = rows[start:start + chunk], cols[start:start + chunk]
+        sims[start:start + chunk] = np.asarray(Xn[r].multiply(Xn[c]).sum(axis=1)).ravel()
+    keep = sims >= sim_threshold
+    return rows[keep], cols[keep], sims[keep]
+
+
+def dense_join(X, store: EmbeddingStore, sim_threshold: float = 0.9, margin: Optional[float] = 0.05):
+    """
+    Duplicate pairs through the dense store. With a margin, pairs above
+    sim_threshold - margin are candidates and their exact similarity (from X) decides;
+    with margin=None the approximate similarities are returned as they are.
+    """
+    if margin is None:
+        return store.threshold_join(sim_threshold)
+    rows, cols, _ = store.threshold_join(sim_threshold - margin)
+    return rerank(X, rows, cols, sim_threshold)
+
+
+def find_duplicates_svd(tfidf_matrix, urls: List[str], sim_threshold=0.9, n_components=256, dtype="float32",
+                        margin: Optional[float] = 0.05, store: Optional[EmbeddingStore] = None):
+    """features.find_duplicates(method="svd"): dense candidate search, exact rerank unless margin=None."""
+    store = store if store is not None else EmbeddingStore.fit(tfidf_matrix, n_components=n_components, dtype=dtype)
+    rows, cols, sims = dense_join(tfidf_matrix, store, sim_threshold=sim_threshold, margin=margin)
+    return [{"url1": urls[i], "url2": urls[j], "similarity": round(float(s), 4)} for i, j, s in zip(rows, cols, sims)]
+
+
+def report(X, store: EmbeddingStore, sim_threshold: float = 0.9, k: int = 3, margin: float = 0.05,
+           n_queries: int = 1000, seed: int = 0) -> dict:
+    """
+    Memory, scan time and recall of the dense store against the exact sparse search:
+    pair recall/precision of the threshold join (raw and reranked) and top-k recall of
+    queries drawn from X's own rows (each query's own row excluded from both result lists).
+    """
+    from utils import features
+
+    out = {"n_docs": int(X.shape[0]), "n_components": int(store.vectors.shape[1]), "dtype": store.dtype,
+           "sparse_bytes": sparse_nbytes(X), "dense_bytes": int(store.nbytes)}
+    out["memory_ratio"] = out["sparse_bytes"] / max(out["dense_bytes"], 1)
+
+    t = time.perf_counter()
+    er, ec, _ = features.similarity_join(X, sim_threshold=sim_threshold)
+    out["exact_join_seconds"] = time.perf_counter() - t
+    exact = set(zip(er.tolist(), ec.tolist()))
+    for name, m in (("dense", None), ("reranked", margin)):
+        t = time.perf_counter()
+        r, c, _ = dense_join(X, store, sim_threshold=sim_threshold, margin=m)
+        out[f"{name}_join_seconds"] = time.perf_counter() - t
+        found = set(zip(r.tolist(), c.tolist()))
+        out[f"{name}_pair_recall"] = len(found & exact) / len(exact) if exact else 1.0
+        out[f"{name}_pair_precision"] = len(found & exact) / len(found) if found else 1.0
+    out["exact_pairs"] = len(exact)
+
+    rng = np.random.RandomState(seed)
+    queries = rng.choice(X.shape[0], size=min(n_queries, X.shape[0]), replace=False)
+    sparse_index = features.SimilarityIndex(X)
+    t = time.perf_counter()
+    truth = [set(sparse_index.query(X[q], k=k + 1, fill=False)[0].tolist()) - {q} for q in queries]
+    out["sparse_query_seconds"] = (time.perf_counter() - t) / len(queries)
+    t = time.perf_counter()
+    got, _ = store.topk(store.embed(X[queries]), k=k + 1)
+    out["dense_query_seconds"] = (time.perf_counter() - t) / len(queries)
+    hits = sum(len(tr & (set(g.tolist()) - {q})) for q, tr, g in zip(queries, truth, got))
+    out[f"top{k}_recall"] = hits / max(sum(len(tr) for tr in truth), 1)
+    # what the app and service get: dense candidates, exactly reranked
+    t = time.perf_counter()
+    got = [g for g, _ in store.with_exact(X).query_many(X[queries], k=k + 1, fill=False)]
+    out["reranked_query_seconds"] = (time.perf_counter() - t) / len(queries)
+    hits = sum(len(tr & (set(g.tolist()) - {q})) for q, tr, g in zip(queries, truth, got))
+    out[f"reranked_top{k}_recall"] = hits / max(sum(len(tr) for tr in truth), 1)
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    from utils import index
+
+    base_dir = Path(__file__).resolve().parent.parent
+    ap = argparse.ArgumentParser(description="Build the dense embedding store of an index and report its recall.")
+    ap.add_argument("--index", default=str(base_dir / "models" / "index"))
+    ap.add_argument("--dim", type=int, default=256, help="SVD components")
+    ap.add_argument("--dtype", default="int8", choices=DTYPES)
+    ap.add_argument("--sim-threshold", type=float, default=0.9)
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--remove", action="store_true", help="delete the store; similarity goes back to sparse rows")
+    args = ap.parse_args()
+
+    corpus = index.load_index(args.index, mmap=False)
+    if corpus is None:
+        raise SystemExit(f"No index at {args.index}; build it with python -m utils.index")
+    target = corpus.index_dir / EMBEDDINGS
+    if args.remove:
+        EmbeddingStore.remove(target)
+        raise SystemExit(0)
+    store = EmbeddingStore.fit(corpus.X, n_components=args.dim, dtype=args.dtype)
+    store.save(target, dim=args.dim)
+    stats = report(corpus.X, store, sim_threshold=args.sim_threshold, k=args.k)
+    print(json.dumps({k: round(v, 6) if isinstance(v, float) else v for k, v in stats.items()}, indent=2))
@@ -1,10 +1,15 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from joblib import Parallel, delayed
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from pathlib import Path
 from typing import Tuple, List
 
+from utils import metrics
+
 # Try to use textstat; fallback to a simple heuristic
 def _import_textstat():
     try:
@@ -15,59 +20,247 @@ def _import_textstat():
 
 TEXTSTAT = _import_textstat()
 
+# Byte tables for text_stats. For the syllable estimate every byte maps to a letter class
+# ("a" vowel, "e", "l", "b" other letter/digit) or to a space for separators.
+def _letter_class(c: int) -> str:
+    ch = chr(c).lower()
+    if c >= 128:
+        return "b"
+    if ch in "aiouy":
+        return "a"
+    if ch in "el":
+        return ch
+    return "b" if ch.isalnum() else " "
+
+_SHAPE_TABLE = bytes(ord(_letter_class(c)) for c in range(256))
+_VOWEL_TABLE = bytes(int(_letter_class(c) in "ae") for c in range(256))
+# bytes str.split() treats as whitespace; the multi-byte (non-ASCII) ones are matched separately
+_SPACE_TABLE = bytes(int(c in (0, 9, 10, 11, 12, 13, 28, 29, 30, 31, 32)) for c in range(256))
+_SENTENCE_TABLE = bytes(int(chr(c) in ".!?") for c in range(256))
+_UNICODE_SPACES = [chr(c).encode("utf-8") for c in [0x85, 0xa0, 0x1680, 0x2028, 0x2029, 0x202f, 0x205f, 0x3000,
+                                                     *range(0x2000, 0x200b)]]
+_LEAD_TABLE = bytes(int(c in {seq[0] for seq in _UNICODE_SPACES}) for c in range(256))
+
+def _flesch(words, sentences, syllables):
+    words = np.maximum(1, words)
+    score = 206.835 - 1.015 * (words / np.maximum(1, sentences)) - 84.6 * (syllables / words)
+    return np.clip(score, 0.0, 100.0)
+
 def flesch_reading_ease(text: str) -> float:
     if TEXTSTAT:
         try:
             return TEXTSTAT.flesch_reading_ease(text)
         except Exception:
             pass
-    # fallback: simple heuristic based on average sentence length
+    # fallback: Flesch formula with estimated syllables (see text_stats)
     if not text:
         return 0.0
-    sentences = max(1, text.count(".") + text.count("!") + text.count("?"))
-    words = max(1, len(text.split()))
-    # heuristic: higher value better readability
-    asl = words / sentences
-    # map typical ranges into 0-100-like value
-    score = max(0.0, min(100.0, 206.835 - 1.015 * asl - 84.6 * 1.5))
-    return score
-
-def top_keywords_from_tfidf(corpus: List[str], top_n=5) -> List[str]:
-    vec = TfidfVectorizer(stop_words="english", max_features=2000, ngram_range=(1,2))
-    X = vec.fit_transform(corpus)
+    words, sentences, syllables = _counts([text])
+    return float(_flesch(words, sentences, syllables)[0]) if words[0] else 0.0
+
+def _unicode_spaces(raw: bytes, space: np.ndarray):
+    # marks every byte of the non-ASCII whitespace characters, checked only at their lead bytes
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    lead = np.flatnonzero(np.frombuffer(raw.translate(_LEAD_TABLE), dtype=bool))
+    for seq in _UNICODE_SPACES:
+        hit = lead
+        for k in range(len(seq)):
+            hit = hit[buf[np.minimum(hit + k, len(buf) - 1)] == seq[k]]
+        for k in range(len(seq)):
+            space[hit + k] = True
+
+def _counts(texts: List[str], syllables: bool = True):
+    """
+    Words, sentences and (optionally) estimated syllables per text, from byte-table masks
+    over one NUL-joined UTF-8 buffer: words as len(text.split()), sentences as the number
+    of .!? (at least 1), syllables as vowel groups minus a silent final consonant+"e"
+    (not for words like "the"/"she"), at least one per word on average.
+    """
+    n = len(texts)
+    # five separators of padding, so the look-behinds below stay inside the buffer
+    raw = b"\x00".join([b"\x00" * 4, *(t.encode("utf-8", "ignore") for t in texts), b""])
+    if raw.count(b"\x00") != n + 5:
+        # a NUL inside a text: \x01 splits words and syllables exactly the same way
+        raw = b"\x00".join([b"\x00" * 4, *(t.replace("\x00", "\x01").encode("utf-8", "ignore") for t in texts), b""])
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    bounds = np.flatnonzero(buf == 0)[4:]
+
+    def doc(mask, offset):
+        # per-text totals of a mask whose element k is about byte k + offset
+        edges = (bounds - offset).tolist()
+        return np.fromiter((np.count_nonzero(mask[a:b]) for a, b in zip(edges[:-1], edges[1:])),
+                           dtype=np.int64, count=n)
+
+    space = np.frombuffer(raw.translate(_SPACE_TABLE), dtype=bool)
+    if not raw.isascii():
+        space = space.copy()
+        _unicode_spaces(raw, space)
+    words = doc(~space[1:] & space[:-1], 1)
+    sentences = np.maximum(1, doc(np.frombuffer(raw.translate(_SENTENCE_TABLE), dtype=bool), 0))
+    if not syllables:
+        return words, sentences, None
+    vowel = np.frombuffer(raw.translate(_VOWEL_TABLE), dtype=bool)
+    groups = doc(vowel[1:] & ~vowel[:-1], 1)
+    # an "e" ending a word after a consonant, in a word longer than "bbbe"
+    shape = np.frombuffer(raw.translate(_SHAPE_TABLE), dtype=np.uint8)
+    blank, e, other = (ord(c) for c in " eb")
+    i = np.flatnonzero((shape[:-1] == e) & (shape[1:] == blank))
+    i = i[shape[i - 1] == other]
+    short = (shape[i - 2] == blank) | ((shape[i - 2] == other) & (
+        (shape[i - 3] == blank) | ((shape[i - 3] == other) & (shape[i - 4] == blank))))
+    silent = np.bincount(np.searchsorted(bounds, i[~short]) - 1, minlength=n)
+    return words, sentences, np.maximum(words, groups - silent)
+
+def _text_stats_chunk(texts: pd.Series) -> pd.DataFrame:
+    texts = texts.fillna("").astype(str)
+    if TEXTSTAT:
+        # textstat scores each document itself, so the syllable estimate is skipped
+        words, sentences, _ = _counts(texts.tolist(), syllables=False)
+        return pd.DataFrame({"word_count": words, "sentence_count": sentences,
+                             "flesch_reading_ease": [flesch_reading_ease(t) for t in texts]}, index=texts.index)
+    words, sentences, syllables = _counts(texts.tolist())
+    flesch = np.where(words > 0, _flesch(words, sentences, syllables), 0.0)
+    return pd.DataFrame({"word_count": words, "sentence_count": sentences, "syllable_count": syllables,
+                         "flesch_reading_ease": flesch}, index=texts.index)
+
+def text_stats(texts: pd.Series, workers: int = 1, chunksize: int = 20000) -> pd.DataFrame:
+    """
+    word_count, sentence_count and flesch_reading_ease for a column of texts, from a few
+    byte-table passes over each chunk joined into one buffer; Flesch comes from textstat
+    when installed, else from syllable_count, estimated in the same passes. Chunks of
+    chunksize rows bound the buffers; with workers > 1 they go to a process pool.
+    """
+    chunks = [texts.iloc[i:i + chunksize] for i in range(0, len(texts), chunksize)] or [texts]
+    if workers <= 1 or len(chunks) == 1:
+        return pd.concat([_text_stats_chunk(c) for c in chunks])
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return pd.concat(list(pool.map(_text_stats_chunk, chunks)))
+
+def make_vectorizer(**overrides) -> TfidfVectorizer:
+    params = dict(stop_words="english", max_features=2000, ngram_range=(1,2))
+    params.update(overrides)
+    return TfidfVectorizer(**params)
+
+def save_vectorizer(vec: TfidfVectorizer, path: Path):
+    """Persists a fitted vectorizer as its vocabulary (ordered terms) + idf weights in an .npz."""
+    terms = vec.get_feature_names_out()
+    np.savez(path, terms=terms.astype(str), idf=vec.idf_,
+             ngram_range=np.array(vec.ngram_range), stop_words=np.array(str(vec.stop_words)))
+
+def load_vectorizer(path: Path) -> TfidfVectorizer:
+    """Rebuilds a ready-to-transform vectorizer from save_vectorizer output (no refit)."""
+    with np.load(path, allow_pickle=False) as f:
+        terms = f["terms"].tolist()
+        stop_words = str(f["stop_words"])
+        vec = make_vectorizer(max_features=None, ngram_range=tuple(int(n) for n in f["ngram_range"]),
+                              stop_words=None if stop_words == "None" else stop_words,
+                              vocabulary={t: i for i, t in enumerate(terms)})
+        vec.idf_ = f["idf"]
+    return vec
+
+def top_keywords_from_tfidf(corpus: List[str], top_n=5, vectorizer: TfidfVectorizer = None) -> List[str]:
+    """
+    Fits a new vectorizer on corpus, or only transforms it when a fitted `vectorizer` is given.
+    """
+    if vectorizer is None:
+        vec = make_vectorizer()
+        X = vec.fit_transform(corpus)
+    else:
+        vec = vectorizer
+        X = vec.transform(corpus)
     feature_names = vec.get_feature_names_out()
-    # For each doc, get top features
-    top_keywords = []
-    for i in range(X.shape[0]):
-        row = X[i].toarray().ravel()
-        if row.sum() == 0:
-            top_keywords.append([])
-            continue
-        idx = row.argsort()[::-1][:top_n]
-        top_keywords.append([feature_names[j] for j in idx if row[j] > 0])
+    top_keywords = top_keywords_from_matrix(X, feature_names, top_n=top_n)
     return top_keywords, vec, X
 
-def compute_features(df: pd.DataFrame, inplace=True) -> Tuple[pd.DataFrame, TfidfVectorizer, any]:
+def top_keywords_from_matrix(X, feature_names, top_n=5) -> List[List[str]]:
+    """
+    Top-n terms per row straight from the CSR arrays (no per-row densify or full argsort):
+    top_n rounds of a segmented max over each row's non-zeros.
+    Ties are broken by lower column index; all-zero rows give [].
+    """
+    X = sparse.csr_matrix(X)
+    n_rows, nnz = X.shape[0], X.nnz
+    if nnz == 0:
+        return [[] for _ in range(n_rows)]
+    lengths = np.diff(X.indptr)
+    nonempty = np.flatnonzero(lengths)
+    starts = X.indptr[:-1][nonempty]
+    seg = np.repeat(np.arange(len(nonempty)), lengths[nonempty])
+    cols = X.indices.astype(np.int64)
+    no_col = X.shape[1]
+    vals = np.where(X.data > 0, X.data, -np.inf)
+    picked = np.full((len(nonempty), top_n), -1, dtype=np.int64)
+    for k in range(top_n):
+        best = np.maximum.reduceat(vals, starts)
+        hit = (vals == best[seg]) & (vals > -np.inf)
+        first = np.minimum.reduceat(np.where(hit, cols, no_col), starts)
+        found = first < no_col
+        picked[found, k] = first[found]
+        vals[hit & (cols == first[seg])] = -np.inf
+    names = np.asarray(feature_names, dtype=object)
+    top_keywords = [[] for _ in range(n_rows)]
+    for r, cols in zip(nonempty.tolist(), picked.tolist()):
+        top_keywords[r] = [names[c] for c in cols if c >= 0]
+    return top_keywords
+
+def iter_top_keywords(X, feature_names, top_n=5, chunk_size=10000):
+    """Streaming variant of top_keywords_from_matrix: yields one list of keyword lists per row chunk."""
+    X = sparse.csr_matrix(X)
+    for start in range(0, X.shape[0], chunk_size):
+        yield top_keywords_from_matrix(X[start:start + chunk_size], feature_names, top_n=top_n)
+
+@metrics.timed("compute_features")
+def compute_features(df: pd.DataFrame, inplace=True, vectorizer: TfidfVectorizer = None,
+                     vocab_path: Path = None, workers: int = 1) -> Tuple[pd.DataFrame, TfidfVectorizer, any]:
     """
     Input: df with 'url' and 'body_text'
     Returns: features_df, tfidf_vectorizer, tfidf_matrix
+    Pass a fitted `vectorizer` (or a `vocab_path` written by save_vectorizer) to
+    transform against a shared vocabulary instead of fitting on df.
     """
+    if vectorizer is None and vocab_path is not None and Path(vocab_path).exists():
+        vectorizer = load_vectorizer(vocab_path)
     out = df.copy() if inplace else df.copy()
     out["body_text"] = out["body_text"].fillna("").astype(str)
-    out["word_count"] = out["body_text"].apply(lambda t: len(t.split()))
-    out["sentence_count"] = out["body_text"].apply(lambda t: max(1, t.count(".") + t.count("!") + t.count("?")))
-    out["flesch_reading_ease"] = out["body_text"].apply(flesch_reading_ease)
-    keywords, vec, X = top_keywords_from_tfidf(out["body_text"].tolist(), top_n=5)
+    metrics.incr("docs_total", len(out), span="compute_features")
+    with metrics.span("text_stats"):
+        stats = text_stats(out["body_text"], workers=workers)
+    out["word_count"] = stats["word_count"]
+    out["sentence_count"] = stats["sentence_count"]
+    out["flesch_reading_ease"] = stats["flesch_reading_ease"]
+    with metrics.span("tfidf_fit" if vectorizer is None else "tfidf_transform"):
+        keywords, vec, X = top_keywords_from_tfidf(out["body_text"].tolist(), top_n=5, vectorizer=vectorizer)
     out["top_keywords"] = keywords
     return out, vec, X
 
-def find_duplicates(tfidf_matrix, urls: List[str], sim_threshold=0.9):
+@metrics.timed("find_duplicates")
+def find_duplicates(tfidf_matrix, urls: List[str], sim_threshold=0.9, method="exact", **kwargs):
     """
     returns list of dicts: {"url1":..,"url2":..,"similarity":..}
+    method: "exact" (all pairs), "blocked" (chunked sparse join, see similarity_join),
+            "minhash" (LSH candidates, see utils.minhash)
+            "svd" (dense LSA candidates, exactly reranked, see utils.embeddings)
+            or "sharded" (shard blocks through a file-based work queue, see utils.sharding)
     """
     duplicates = []
     if tfidf_matrix is None or tfidf_matrix.shape[0] < 2:
         return duplicates
+    if method == "minhash":
+        from utils.minhash import find_duplicates_minhash
+        return find_duplicates_minhash(tfidf_matrix, urls, sim_threshold=sim_threshold, **kwargs)
+    if method == "svd":
+        from utils.embeddings import find_duplicates_svd
+        return find_duplicates_svd(tfidf_matrix, urls, sim_threshold=sim_threshold, **kwargs)
+    if method == "sharded":
+        from utils.sharding import find_duplicates_sharded
+        return find_duplicates_sharded(tfidf_matrix, urls, sim_threshold=sim_threshold, **kwargs)
+    if method == "blocked":
+        rows, cols, sims = similarity_join(tfidf_matrix, sim_threshold=sim_threshold, **kwargs)
+        return [{"url1": urls[i], "url2": urls[j], "similarity": round(float(sim), 4)}
+                for i, j, sim in zip(rows, cols, sims)]
+    if method != "exact":
+        raise ValueError(f"Unknown duplicate detection method: {method}")
     # compute cosine similarities; use dense if small dataset
     sims = cosine_similarity(tfidf_matrix)
     n = sims.shape[0]
@@ -77,3 +270,179 @@ def find_duplicates(tfidf_matrix, urls: List[str], sim_threshold=0.9):
             if sim >= sim_threshold:
                 duplicates.append({"url1": urls[i], "url2": urls[j], "similarity": round(sim, 4)})
     return duplicates
+
+def block_size_for_budget(n_docs: int, memory_budget_mb=256) -> int:
+    # worst case a block's product row holds n_docs entries of float64 + int32 index
+    return max(1, int(memory_budget_mb * 2**20 // (12 * max(1, n_docs))))
+
+def _similarity_block(Xn, XT, start: int, stop: int, sim_threshold: float):
+    # rows [start, stop) against rows [start, n): only the upper triangle is computed;
+    # XT is Xn transposed once up front, so each block only slices its columns
+    S = Xn[start:stop] @ XT[:, start:]
+    if sim_threshold <= 0:
+        # implicit zeros also pass the threshold, so the block has to be dense
+        S = np.asarray(S.todense())
+        r, c = np.nonzero(np.ones_like(S, dtype=bool))
+        S = sparse.coo_matrix((S[r, c], (r, c)), shape=S.shape)
+    S = S.tocoo()
+    mask = (S.data >= sim_threshold) & (S.col > S.row)
+    return S.row[mask] + start, S.col[mask] + start, S.data[mask]
+
+def similarity_join(tfidf_matrix, sim_threshold=0.9, block_size=None, memory_budget_mb=256, n_jobs=1):
+    """
+    Thresholded cosine self-join that never materializes the n x n matrix.
+    Processes row blocks of the L2-normalized matrix (in parallel threads when n_jobs != 1)
+    and returns (rows, cols, sims) arrays for i < j, sorted by (i, j).
+    Peak memory is O(block_size x n) per worker.
+    """
+    Xn = normalize(tfidf_matrix, norm="l2", copy=True).tocsr()
+    XT = Xn.T.tocsr()
+    n = Xn.shape[0]
+    if block_size is None:
+        block_size = block_size_for_budget(n, memory_budget_mb)
+    starts = range(0, n, block_size)
+    parts = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_similarity_block)(Xn, XT, s, min(s + block_size, n), sim_threshold) for s in starts
+    )
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    rows = np.concatenate([p[0] for p in parts]).astype(np.int64)
+    cols = np.concatenate([p[1] for p in parts]).astype(np.int64)
+    sims = np.concatenate([p[2] for p in parts])
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], sims[order]
+
+def cross_similarity(Xa, Xb, sim_threshold=0.9, block_size=None, memory_budget_mb=256):
+    """
+    Thresholded cosine join of every row of Xa against every row of Xb (sim_threshold > 0).
+    Returns (rows_in_a, rows_in_b, sims), processed in row blocks of Xa.
+    """
+    An = normalize(Xa, norm="l2", copy=True).tocsr()
+    Bn = normalize(Xb, norm="l2", copy=True).tocsr()
+    BT = Bn.T.tocsr()
+    if block_size is None:
+        block_size = block_size_for_budget(Bn.shape[0], memory_budget_mb)
+    rows, cols, sims = [], [], []
+    for start in range(0, An.shape[0], block_size):
+        S = (An[start:start + block_size] @ BT).tocoo()
+        mask = S.data >= sim_threshold
+        rows.append(S.row[mask].astype(np.int64) + start)
+        cols.append(S.col[mask].astype(np.int64))
+        sims.append(S.data[mask])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
+
+def fill_top_k(docs, sims, k, n_docs):
+    """
+    Pads a best-first top-k with zero-similarity documents (lowest indices first) up to
+    k, or n_docs if smaller, the way a full cosine sort always returns k rows.
+    """
+    missing = min(k, n_docs) - len(docs)
+    if missing <= 0:
+        return docs, sims
+    fill = np.setdiff1d(np.arange(min(n_docs, k + len(docs))), docs)[:missing]
+    return np.concatenate([docs, fill]).astype(np.int64), np.concatenate([sims, np.zeros(len(fill))])
+
+def _top_k(docs, sims, k):
+    top = np.argpartition(sims, -k)[-k:] if len(docs) > k else np.arange(len(docs))
+    top = top[np.argsort(sims[top], kind="stable")[::-1]]
+    return docs[top].astype(np.int64), sims[top]
+
+class SimilarityIndex:
+    """
+    Top-k cosine lookup over a fixed reference set (e.g. the High-quality pages).
+    Documents are stored as an inverted index (term -> postings of normalized weights).
+    A query adds up the postings of its heaviest terms first and stops reading once the
+    pages left behind cannot reach the top k (max-score pruning), so the long postings of
+    common, low-weight terms are often skipped. max_query_terms keeps just the heaviest
+    query terms, trading a little recall for bounded work per query.
+    """
+
+    def __init__(self, tfidf_matrix, vectorizer=None, max_query_terms=None):
+        self.vectorizer = vectorizer
+        self.max_query_terms = max_query_terms
+        self.n_docs = tfidf_matrix.shape[0]
+        X = sparse.csr_matrix(tfidf_matrix, dtype=np.float64)
+        # an empty reference set (e.g. no High pages yet) gives an index whose queries find nothing
+        self.docs = normalize(X, norm="l2", copy=True) if self.n_docs else X
+        # rows are terms, columns are documents
+        self.postings = self.docs.T.tocsr()
+        # the most any one document gets from each term, the bound max-score prunes with
+        self.term_max = self.postings.max(axis=1).toarray().ravel() if self.n_docs else np.zeros(X.shape[1])
+
+    def _query_vector(self, text_or_vector):
+        if isinstance(text_or_vector, str):
+            if self.vectorizer is None:
+                raise ValueError("SimilarityIndex built without a vectorizer cannot embed text")
+            text_or_vector = self.vectorizer.transform([text_or_vector])
+        q = normalize(sparse.csr_matrix(text_or_vector)[0], norm="l2")
+        terms, weights = q.indices, q.data
+        if self.max_query_terms and len(terms) > self.max_query_terms:
+            keep = np.argpartition(weights, -self.max_query_terms)[-self.max_query_terms:]
+            terms, weights = terms[keep], weights[keep]
+        return terms, weights
+
+    def _scores(self, terms, weights, k):
+        """
+        (docs, exact scores) of a set of pages sure to hold the top k. Postings are added
+        heaviest term first, in doubling batches; once the k-th best partial score beats
+        what the unread terms could still add, only the pages that could catch up are
+        scored exactly, if that reads less than the remaining postings would.
+        """
+        bound = weights * self.term_max[terms]
+        order = np.argsort(-bound, kind="stable")
+        terms, weights, bound = terms[order], weights[order], bound[order]
+        # rest[n]: the most the terms from n on can add to any page
+        rest = np.append(np.cumsum(bound[::-1])[::-1], 0.0)
+        lengths = np.diff(self.postings.indptr)[terms]
+        unread = np.append(np.cumsum(lengths[::-1])[::-1], 0)
+        acc = np.zeros(self.n_docs)
+        n = 0
+        while n < len(terms):
+            m = min(len(terms), max(2 * n, 8))
+            sub = self.postings[terms[n:m]]
+            acc += np.bincount(sub.indices, weights=sub.data * np.repeat(weights[n:m], np.diff(sub.indptr)),
+                               minlength=self.n_docs)
+            n = m
+            if n == len(terms) or self.n_docs <= k:
+                break
+            theta = np.partition(acc, -k)[-k]
+            if theta < rest[n]:
+                continue
+            docs = np.flatnonzero(acc + rest[n] >= theta)
+            if np.diff(self.docs.indptr)[docs].sum() < unread[n]:
+                q = sparse.csr_matrix((weights, (np.zeros(len(terms), dtype=np.int64), terms)),
+                                      shape=(1, self.postings.shape[0]))
+                return docs, (self.docs[docs] @ q.T).toarray().ravel()
+        docs = np.flatnonzero(acc)
+        return docs, acc[docs]
+
+    @metrics.timed("similarity_query")
+    def query(self, text_or_vector, k=3, fill=True):
+        """
+        Returns (doc_indices, similarities) of the k best matches, best first. With fill,
+        pages sharing no term with the query make up the k at similarity 0.
+        """
+        terms, weights = self._query_vector(text_or_vector)
+        if k <= 0 or self.n_docs == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        docs, sims = (np.empty(0, dtype=np.int64), np.empty(0)) if len(terms) == 0 else \
+            _top_k(*self._scores(terms, weights, k), k)
+        return fill_top_k(docs, sims, k, self.n_docs) if fill else (docs, sims)
+
+    @metrics.timed("similarity_query_many")
+    def query_many(self, X, k=3, fill=True) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """query() for every row of a tfidf matrix at once: one sparse product instead of a loop."""
+        if self.max_query_terms:
+            return [self.query(X[i], k=k, fill=fill) for i in range(X.shape[0])]
+        scores = (normalize(sparse.csr_matrix(X), norm="l2") @ self.postings).tocsr()
+        out = []
+        for i in range(scores.shape[0]):
+            if k <= 0:
+                out.append((np.empty(0, dtype=np.int64), np.empty(0)))
+                continue
+            row = slice(scores.indptr[i], scores.indptr[i + 1])
+            docs, sims = _top_k(scores.indices[row], scores.data[row], k)
+            out.append(fill_top_k(docs, sims, k, self.n_docs) if fill else (docs, sims))
+        return out
@@ -0,0 +1,291 @@
+from pathlib import Path
+from collections import Counter, OrderedDict
+import json
+import threading
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from typing import Iterable, Iterator, List, Optional
+
+from utils import features, parser, store
+
+# Out-of-core TF-IDF: terms are hashed into a fixed number of buckets, so no vocabulary
+# has to be built in memory. Pass 1 streams the corpus once to count document/term
+# frequencies; pass 2 applies idf and writes float32 CSR shards to disk. Keywords and
+# duplicate pairs are then computed shard by shard without the full matrix.
+SHARD_MANIFEST = "shards.json"
+STATE = "hashing.npz"
+
+
+class HashingTfidf:
+    """
+    Fixed-memory drop-in for the fitted TfidfVectorizer (transform / get_feature_names_out).
+    Memory is O(n_features) however large the corpus; after fitting, only the
+    max_features most frequent buckets are kept as columns, as TfidfVectorizer does.
+    Bucket names (for keywords) are learned from the first name_sample_docs documents.
+    """
+
+    def __init__(self, n_features: int = 2**20, max_features: Optional[int] = 2000, ngram_range=(1, 2),
+                 stop_words="english", name_sample_docs: int = 20000):
+        self.n_features = n_features
+        self.max_features = max_features
+        self.ngram_range = tuple(ngram_range)
+        self.stop_words = stop_words
+        self.name_sample_docs = name_sample_docs
+        self.df = np.zeros(n_features, dtype=np.int64)
+        self.tf = np.zeros(n_features, dtype=np.float64)
+        self.n_docs = 0
+        self.names = {}
+        self._name_counts = {}
+        self.columns_ = None
+        self.idf_ = None
+
+    def _hasher(self) -> HashingVectorizer:
+        return HashingVectorizer(n_features=self.n_features, ngram_range=self.ngram_range, stop_words=self.stop_words,
+                                 alternate_sign=False, norm=None, dtype=np.float32)
+
+    def _feature_hasher(self) -> FeatureHasher:
+        # what HashingVectorizer applies to the analyzer output
+        return FeatureHasher(n_features=self.n_features, input_type="string", alternate_sign=False, dtype=np.float32)
+
+    def _learn_names(self, token_lists: List[List[str]]):
+        counts = Counter(term for tokens in token_lists for term in tokens)
+        if not counts:
+            return
+        terms = list(counts)
+        # one term per row gives that term's bucket
+        buckets = self._feature_hasher().transform([[t] for t in terms]).tocsr().indices
+        for bucket, term in zip(buckets.tolist(), terms):
+            # colliding terms share a bucket: it is named after the most frequent one
+            seen_count, seen_term = self._name_counts.get(bucket, (0, term))
+            if seen_term == term:
+                self._name_counts[bucket] = (seen_count + counts[term], term)
+            elif counts[term] > seen_count:
+                self._name_counts[bucket] = (counts[term], term)
+            self.names[bucket] = self._name_counts[bucket][1]
+
+    def partial_fit(self, texts: Iterable[str]) -> "HashingTfidf":
+        """Pass 1 over one chunk: accumulates document and term frequencies per bucket."""
+        analyzer = self._hasher().build_analyzer()
+        # analyze once: the same token lists give the counts and the bucket names
+        token_lists = [analyzer(t) if isinstance(t, str) else [] for t in texts]
+        X = self._feature_hasher().transform(token_lists).tocsr()
+        self.df += np.bincount(X.indices, minlength=self.n_features)
+        self.tf += np.bincount(X.indices, weights=X.data, minlength=self.n_features)
+        if self.n_docs < self.name_sample_docs:
+            self._learn_names(token_lists[:self.name_sample_docs - self.n_docs])
+        self.n_docs += len(token_lists)
+        return self
+
+    def finalize(self) -> "HashingTfidf":
+        """Picks the kept columns and computes smooth idf (as TfidfVectorizer) from the counts."""
+        seen = np.flatnonzero(self.df)
+        if self.max_features and len(seen) > self.max_features:
+            # prefer buckets with a known name so keywords stay readable
+            named = np.array([b for b in seen.tolist() if b in self.names], dtype=np.int64)
+            pool = named if len(named) >= self.max_features else seen
+            top = pool[np.lexsort((pool, -self.tf[pool]))[:self.max_features]]
+            self.columns_ = np.sort(top)
+        else:
+            self.columns_ = seen
+        self._col_map = np.full(self.n_features, -1, dtype=np.int64)
+        self._col_map[self.columns_] = np.arange(len(self.columns_))
+        self.idf_ = (np.log((1 + self.n_docs) / (1 + self.df[self.columns_])) + 1).astype(np.float32)
+        return self
+
+    def fit(self, chunks: Iterable[Iterable[str]]) -> "HashingTfidf":
+        for texts in chunks:
+            self.partial_fit(texts)
+        return self.finalize()
+
+    def transform(self, texts: Iterable[str]):
+        """L2-normalized float32 tf-idf rows over the kept columns."""
+        if self.idf_ is None:
+            raise ValueError("HashingTfidf is not fitted; call fit() or partial_fit() + finalize()")
+        texts = [t if isinstance(t, str) else "" for t in texts]
+        X = self._hasher().transform(texts).tocsr()
+        cols = self._col_map[X.indices]
+        keep = cols >= 0
+        rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))[keep]
+        out = sparse.csr_matrix((X.data[keep] * self.idf_[cols[keep]], (rows, cols[keep])),
+                                shape=(X.shape[0], len(self.columns_)), dtype=np.float32)
+        out = normalize(out, norm="l2", copy=False)
+        out.sort_indices()
+        return out
+
+    def get_feature_names_out(self) -> np.ndarray:
+        return np.array([self.names.get(b, f"#{b}") for b in self.columns_.tolist()], dtype=object)
+
+    def save(self, path: Path):
+        np.savez(path, n_features=self.n_features, n_docs=self.n_docs, columns=self.columns_, idf=self.idf_,
+                 df=self.df[self.columns_], terms=self.get_feature_names_out().astype(str),
+                 ngram_range=np.array(self.ngram_range), stop_words=np.array(str(self.stop_words)))
+
+    @classmethod
+    def load(cls, path: Path) -> "HashingTfidf":
+        """Restores a fitted (transform-only) instance; the full count arrays are not kept."""
+        with np.load(path, allow_pickle=False) as f:
+            stop_words = str(f["stop_words"])
+            vec = cls(n_features=int(f["n_features"]), max_features=None,
+                      ngram_range=tuple(int(n) for n in f["ngram_range"]),
+                      stop_words=None if stop_words == "None" else stop_words)
+            vec.n_docs = int(f["n_docs"])
+            vec.columns_ = f["columns"].astype(np.int64)
+            vec.idf_ = f["idf"]
+            vec.df[vec.columns_] = f["df"]
+            vec.names = {int(b): str(t) for b, t in zip(vec.columns_, f["terms"]) if not str(t).startswith("#")}
+        vec._col_map = np.full(vec.n_features, -1, dtype=np.int64)
+        vec._col_map[vec.columns_] = np.arange(len(vec.columns_))
+        return vec
+
+
+def iter_texts(path: Path, column: str = "body_text", chunksize: int = 10000) -> Iterator[List[str]]:
+    """Streams one text column in chunks from a .csv, a .parquet file or a Parquet directory."""
+    path = Path(path)
+    if path.suffix == ".csv":
+        for chunk in parser.read_crawl(path, chunksize=chunksize, columns=[column]):
+            yield chunk[column].fillna("").astype(str).tolist()
+        return
+    import pyarrow.dataset as ds
+    for batch in ds.dataset(str(path), format="parquet").to_batches(columns=[column], batch_size=chunksize):
+        yield [t or "" for t in batch.column(0).to_pylist()]
+
+
+class ShardedMatrix:
+    """A tf-idf matrix stored as row shards (shard-NNNNN.npz) plus shards.json."""
+
+    def __init__(self, shard_dir: Path):
+        self.shard_dir = Path(shard_dir)
+        self.manifest = json.loads((self.shard_dir / SHARD_MANIFEST).read_text())
+        self.shape = tuple(self.manifest["shape"])
+        self.paths = [self.shard_dir / s["file"] for s in self.manifest["shards"]]
+        self.offsets = [s["start"] for s in self.manifest["shards"]]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        """Yields (first row, shard) one shard at a time."""
+        for start, path in zip(self.offsets, self.paths):
+            yield start, store.load_sparse(path)
+
+    def vectorizer(self) -> HashingTfidf:
+        return HashingTfidf.load(self.shard_dir / STATE)
+
+    def iter_top_keywords(self, top_n: int = 5) -> Iterator[List[List[str]]]:
+        """Per shard, the top_n keywords of each row."""
+        names = self.vectorizer().get_feature_names_out()
+        for _, X in self:
+            yield features.top_keywords_from_matrix(X, names, top_n=top_n)
+
+    def similarity_join(self, sim_threshold: float = 0.9, memory_budget_mb: int = 256, n_jobs: int = 1):
+        return shard_similarity_join(self.paths, sim_threshold=sim_threshold, memory_budget_mb=memory_budget_mb,
+                                     n_jobs=n_jobs)
+
+
+def write_shards(vec: HashingTfidf, chunks: Iterable[Iterable[str]], out_dir: Path) -> ShardedMatrix:
+    """Pass 2: transforms each chunk with a fitted vectorizer and writes it as one shard."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    shards, start = [], 0
+    for k, texts in enumerate(chunks):
+        X = vec.transform(texts)
+        name = f"shard-{k:05d}.npz"
+        store.save_sparse(X, out_dir / name)
+        shards.append({"file": name, "start": start, "rows": X.shape[0], "nnz": int(X.nnz)})
+        start += X.shape[0]
+    vec.save(out_dir / STATE)
+    manifest = {"shape": [start, len(vec.columns_)], "dtype": "float32", "shards": shards}
+    # manifest last, so a crashed run never looks complete
+    (out_dir / SHARD_MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return ShardedMatrix(out_dir)
+
+
+def vectorize_out_of_core(path: Path, out_dir: Path, column: str = "body_text", chunksize: int = 10000,
+                          **params) -> ShardedMatrix:
+    """Both passes over the text column at path; params go to HashingTfidf."""
+    vec = HashingTfidf(**params).fit(iter_texts(path, column, chunksize))
+    return write_shards(vec, iter_texts(path, column, chunksize), out_dir)
+
+
+class _ShardCache:
+    """Loaded shards, least recently used dropped first once they exceed budget_mb."""
+
+    def __init__(self, paths: List[Path], budget_mb: int):
+        self.paths = paths
+        self.budget = budget_mb * 2**20
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        self.locks = [threading.Lock() for _ in paths]
+
+    def get(self, k: int):
+        with self.locks[k]:  # one load per shard even when several blocks want it at once
+            with self.lock:
+                if k in self.loaded:
+                    self.loaded.move_to_end(k)
+                    return self.loaded[k]
+            X = store.load_sparse(self.paths[k])
+            with self.lock:
+                self.loaded[k] = X
+                size = sum(store.sparse_nbytes(Y) for Y in self.loaded.values())
+                while size > self.budget and len(self.loaded) > 1:
+                    _, old = self.loaded.popitem(last=False)
+                    size -= store.sparse_nbytes(old)
+            return X
+
+
+def shard_similarity_join(paths: List[Path], sim_threshold: float = 0.9, memory_budget_mb: int = 256,
+                          n_jobs: int = 1):
+    """
+    Thresholded cosine self-join over row shards, one block per shard pair run on n_jobs threads.
+    Shards are loaded once and kept while they fit in memory_budget_mb.
+    Returns (rows, cols, sims) with global row numbers, i < j, sorted by (i, j).
+    """
+    offsets = np.concatenate([[0], np.cumsum([store.sparse_rows(p) for p in paths])]).astype(np.int64)
+    cache = _ShardCache(list(paths), memory_budget_mb)
+
+    def block(a, b):
+        Xa = cache.get(a)
+        if a == b:
+            r, c, s = features.similarity_join(Xa, sim_threshold=sim_threshold, memory_budget_mb=memory_budget_mb)
+        else:
+            r, c, s = features.cross_similarity(Xa, cache.get(b), sim_threshold=sim_threshold,
+                                                memory_budget_mb=memory_budget_mb)
+        return r + offsets[a], c + offsets[b], s
+
+    # a-major order, so each A stays hot while the later shards stream past it
+    parts = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(block)(a, b) for a in range(len(paths)) for b in range(a, len(paths)))
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    rows, cols, sims = (np.concatenate(x) for x in zip(*parts))
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order], sims[order]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Out-of-core hashed TF-IDF: write float32 CSR shards (+ duplicates).")
+    ap.add_argument("input", help=".csv, .parquet or Parquet directory with a text column")
+    ap.add_argument("out", help="shard directory")
+    ap.add_argument("--column", default="body_text")
+    ap.add_argument("--chunksize", type=int, default=10000, help="rows per chunk / shard")
+    ap.add_argument("--n-features", type=int, default=2**20)
+    ap.add_argument("--max-features", type=int, default=2000, help="0 keeps every bucket")
+    ap.add_argument("--duplicates", type=float, help="also write duplicates.parquet at this cosine threshold")
+    ap.add_argument("--workers", type=int, default=1, help="threads for the duplicate join's shard blocks")
+    args = ap.parse_args()
+
+    sharded = vectorize_out_of_core(args.input, args.out, column=args.column, chunksize=args.chunksize,
+                                    n_features=args.n_features, max_features=args.max_features or None)
+    print(json.dumps({"shape": sharded.shape, "shards": len(sharded)}))
+    if args.duplicates is not None:
+        rows, cols, sims = sharded.similarity_join(sim_threshold=args.duplicates, n_jobs=args.workers)
+        store.write_dataset(pd.DataFrame({"i": rows, "j": cols, "similarity": np.round(sims, 4)}),
+                            Path(args.out) / "duplicates.parquet")
+        print(f"{len(rows)} duplicate pairs")
@@ -0,0 +1,432 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+import numpy as np
+from scipy import sparse
+from typing import List, Optional
+
+from utils import parser, features, scorer, store, clusters, boilerplate, embeddings
+
+# Prebuilt reference-corpus index: fitted vectorizer, TF-IDF matrix, per-URL
+# features and labels, keyed by a content hash of the source CSV, plus the
+# duplicate pairs among indexed pages (same schema as data/duplicates.csv) and
+# the near-duplicate clusters they form (one row per page). Page bodies have their
+# site boilerplate stripped; the per-domain block table and the unstripped blocks of
+# each source row are kept for later updates and rebuilds.
+# An optional dense embedding store (utils.embeddings), once built, is kept in step
+# with the tfidf rows and then serves the similar-page lookups.
+# Page features are a Parquet dataset partitioned by quality_label, with the
+# text in its own file, so readers only load the rows and columns they need.
+# Every build or update writes a new generation directory (gen-NNNNNN) and then
+# swaps in manifest.json, which names it; files are never rewritten in place, so a
+# process holding the previous generation memory-mapped keeps reading it unchanged.
+INDEX_VERSION = 7
+MANIFEST = "manifest.json"
+PAGES = "pages"
+TEXT = "text.parquet"
+VOCAB = "vocab.npz"
+DUPLICATES = "duplicates.parquet"
+CLUSTERS = "clusters.parquet"
+BLOCKS = "blocks.parquet"
+BOILERPLATE = boilerplate.TABLE
+EMBEDDINGS = embeddings.EMBEDDINGS
+TFIDF_PARTS = ("data", "indices", "indptr")
+
+
+class CorpusIndex:
+    """
+    Loaded index: `pages` dataframe aligned row-for-row with the `X` tfidf matrix.
+    Pages are read from disk on first access; subset() reads only what it needs.
+    index_dir is the generation directory the manifest named when it was loaded.
+    """
+
+    def __init__(self, index_dir: Path, vectorizer, X, manifest: dict):
+        self.index_dir = Path(index_dir)
+        self.vectorizer = vectorizer
+        self.X = X
+        self.manifest = manifest
+        self._pages = None
+
+    @property
+    def source_hash(self) -> str:
+        return self.manifest.get("source_hash", "")
+
+    @property
+    def pages(self) -> pd.DataFrame:
+        if self._pages is None:
+            self._pages = read_pages(self.index_dir).drop(columns="row")
+        return self._pages
+
+    def subset(self, label: str = "High", columns: Optional[List[str]] = None):
+        """
+        Returns (pages, X) restricted to rows with the given quality label.
+        Only the matching partition and the given columns (default: all) are read.
+        """
+        pages = read_pages(self.index_dir, columns=columns, label=label)
+        rows = pages["row"].to_numpy()
+        return pages.drop(columns="row"), self.X[rows]
+
+    def similarity_index(self, label: str = "High", columns: Optional[List[str]] = None):
+        """
+        Like subset(), but returns (pages, index) for top-k lookups among those pages:
+        the dense embedding store (exactly reranked) if one was built, else a sparse
+        features.SimilarityIndex.
+        """
+        pages = read_pages(self.index_dir, columns=columns, label=label)
+        rows = pages["row"].to_numpy()
+        if pages.empty:
+            # nothing to look up: an empty sparse index, whose queries return no matches
+            return pages.drop(columns="row"), features.SimilarityIndex(self.X[rows], self.vectorizer)
+        dense = embeddings.EmbeddingStore.load(self.index_dir / EMBEDDINGS)
+        if dense is not None and len(dense) == self.X.shape[0]:
+            # dense candidates, reported with their exact tfidf cosine like the sparse index
+            return pages.drop(columns="row"), dense.with_exact(self.X).subset(rows)
+        return pages.drop(columns="row"), features.SimilarityIndex(self.X[rows], self.vectorizer)
+
+
+def file_hash(path: Path, chunk_size=1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _text_hashes(texts: pd.Series) -> pd.Series:
+    return texts.fillna("").astype(str).map(lambda t: hashlib.sha1(t.encode("utf-8", "ignore")).hexdigest())
+
+
+def _row_hashes(df: pd.DataFrame) -> pd.Series:
+    html = df["html_content"] if "html_content" in df.columns else pd.Series("", index=df.index)
+    keys = df["url"].fillna("").astype(str) + "\x00" + html.fillna("").astype(str)
+    return keys.map(lambda k: hashlib.sha1(k.encode("utf-8", "ignore")).hexdigest())
+
+
+def _generations(root: Path) -> List[Path]:
+    return sorted(p for p in Path(root).glob("gen-*") if p.is_dir())
+
+
+def _new_generation(root: Path) -> Path:
+    # numbered past every existing directory, including those of crashed builds
+    last = max((int(p.name.split("-")[1]) for p in _generations(root)), default=0)
+    path = Path(root) / f"gen-{last + 1:06d}"
+    path.mkdir(parents=True)
+    return path
+
+
+def _current_generation(root: Path) -> Optional[Path]:
+    try:
+        data = json.loads((Path(root) / MANIFEST).read_text()).get("data")
+    except (FileNotFoundError, ValueError):
+        return None
+    return Path(root) / data if data else None
+
+
+def _publish(root: Path, generation: Path, manifest: dict):
+    """Points manifest.json at `generation` in one rename, then prunes older generations."""
+    root = Path(root)
+    previous = _current_generation(root)
+    manifest = dict(manifest, data=generation.name)
+    tmp = root / f"{MANIFEST}.{generation.name}.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2))
+    os.replace(tmp, root / MANIFEST)
+    # the generation just replaced stays, a running app may still be reading it; older
+    # ones (and leftovers of crashed builds) go. Newer ones may be builds in progress.
+    for path in _generations(root):
+        if path.name < generation.name and path != previous:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _carry_over(old: Path, new: Path, names: List[str]):
+    # files of a published generation are never modified, so hard links are safe copies
+    for name in names:
+        src = Path(old) / name
+        if src.is_dir():
+            shutil.copytree(src, Path(new) / name, copy_function=_link)
+        elif src.exists():
+            _link(src, Path(new) / name)
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _save_tfidf(X, index_dir: Path):
+    X = sparse.csr_matrix(X)
+    for name in TFIDF_PARTS:
+        np.save(index_dir / f"tfidf_{name}.npy", getattr(X, name))
+    return list(X.shape)
+
+
+def _load_tfidf(index_dir: Path, shape, mmap=True):
+    mode = "r" if mmap else None
+    data, indices, indptr = (np.load(index_dir / f"tfidf_{name}.npy", mmap_mode=mode) for name in TFIDF_PARTS)
+    return sparse.csr_matrix((data, indices, indptr), shape=tuple(shape), copy=False)
+
+
+def _refresh_embeddings(X, old_dir: Optional[Path], index_dir: Path, refit: bool):
+    # opt-in (python -m utils.embeddings); once built, the store follows the tfidf rows:
+    # refitted on a full build, re-embedded with the same basis on an incremental update
+    if old_dir is None:
+        return
+    old = embeddings.EmbeddingStore.load(old_dir / EMBEDDINGS, mmap=False)
+    if old is None:
+        return
+    target = index_dir / EMBEDDINGS
+    meta = json.loads((old_dir / EMBEDDINGS / "meta.json").read_text())
+    if refit:
+        dense = embeddings.EmbeddingStore.fit(X, n_components=meta.get("dim", meta["n_components"]), dtype=old.dtype)
+    else:
+        dense = old.with_vectors(X)
+    dense.save(target, dim=meta.get("dim", meta["n_components"]))
+
+
+def _save_pages(pages: pd.DataFrame, index_dir: Path):
+    pages = pages.reset_index(drop=True).assign(row=np.arange(len(pages)))
+    numeric, text = store.split_text(pages, key="row")
+    store.write_dataset(numeric, index_dir / PAGES, partition_cols=["quality_label"])
+    store.write_dataset(text, index_dir / TEXT)
+
+
+def read_pages(index_dir: Path, columns: Optional[List[str]] = None, label: Optional[str] = None) -> pd.DataFrame:
+    """
+    Reads indexed pages (with their `row` in X) in row order, optionally only one
+    quality_label partition. The text file is only opened when text columns are asked for.
+    """
+    index_dir = Path(index_dir)
+    filters = [("quality_label", "==", label)] if label is not None else None
+    if columns is None:
+        pages = store.read_dataset(index_dir / PAGES, filters=filters)
+        text_columns = None
+    else:
+        numeric = [c for c in columns if c not in store.TEXT_COLUMNS and c != "row"]
+        pages = store.read_dataset(index_dir / PAGES, columns=["row"] + numeric, filters=filters)
+        text_columns = [c for c in columns if c in store.TEXT_COLUMNS]
+    pages = pages.sort_values("row").reset_index(drop=True)
+    if text_columns is None or text_columns:
+        text = store.read_dataset(index_dir / TEXT, columns=text_columns and ["row"] + text_columns,
+                                  filters=[("row", "in", pages["row"].tolist())] if label is not None else None)
+        pages = pages.merge(text, on="row", how="left")
+    return pages
+
+
+def load_duplicates(index_dir: Path, columns: Optional[List[str]] = None, filters=None) -> pd.DataFrame:
+    path = Path(index_dir) / DUPLICATES
+    if not path.exists():
+        return pd.DataFrame(columns=columns or store.DUPLICATE_COLUMNS)
+    return store.read_dataset(path, columns=columns, filters=filters)
+
+
+def _save_clusters(dups: pd.DataFrame, pages: pd.DataFrame, index_dir: Path):
+    # the longest page of each cluster is its canonical representative
+    frame = clusters.cluster_pairs(dups, pages["url"].to_numpy(), priority=pages["word_count"].to_numpy())
+    store.write_dataset(frame, index_dir / CLUSTERS)
+
+
+def load_clusters(index_dir: Path, columns: Optional[List[str]] = None, filters=None) -> pd.DataFrame:
+    path = Path(index_dir) / CLUSTERS
+    if not path.exists():
+        return pd.DataFrame(columns=columns or clusters.CLUSTER_COLUMNS)
+    return store.read_dataset(path, columns=columns, filters=filters)
+
+
+def load_index(index_dir: Path, mmap=True) -> Optional[CorpusIndex]:
+    """Loads an index from disk; returns None if it is missing or from another version."""
+    index_dir = Path(index_dir)
+    manifest_path = index_dir / MANIFEST
+    if not manifest_path.exists():
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("version") != INDEX_VERSION:
+            return None
+        data_dir = index_dir / manifest["data"]
+        vec = features.load_vectorizer(data_dir / VOCAB)
+        X = _load_tfidf(data_dir, manifest["shape"], mmap=mmap)
+        return CorpusIndex(data_dir, vec, X, manifest)
+    except Exception as e:
+        print(f"Warning: failed to load index: {e}")
+        return None
+
+
+def build_index(csv_path: Path, index_dir: Path, model=None, previous: Optional[CorpusIndex] = None,
+                sim_threshold=0.9, model_hash: str = "") -> CorpusIndex:
+    """
+    Parses, featurizes and scores the corpus in csv_path and writes the index to index_dir.
+    Rows whose url+html hash is already in `previous` reuse its parsed title and blocks
+    instead of being parsed again; the other rows are counted into its boilerplate table,
+    then all rows are stripped with it.
+    model_hash identifies the model file the labels came from.
+    """
+    csv_path, root = Path(csv_path), Path(index_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    old_dir = previous.index_dir if previous is not None else _current_generation(root)
+    df = pd.read_csv(csv_path)
+    df["row_hash"] = _row_hashes(df)
+
+    reused = 0
+    table = (boilerplate.BlockTable.load(previous.index_dir / BOILERPLATE) if previous is not None
+             else boilerplate.BlockTable())
+    # the csv is the whole corpus: pages no longer in it stop counting towards templates
+    table.retain(df["url"])
+    if previous is not None and (previous.index_dir / BLOCKS).exists():
+        known = store.read_dataset(previous.index_dir / BLOCKS).drop_duplicates("row_hash").set_index("row_hash")
+        hit = df["row_hash"].isin(known.index)
+        reused = int(hit.sum())
+        parsed_new = parser.parse_dataframe(df[~hit], blocks=True)
+        parsed_old = df[hit].drop(columns=["title", "body_text"], errors="ignore").join(known, on="row_hash")
+        parsed_old["body_text"] = parsed_old["blocks"].map(" ".join)
+        parsed = pd.concat([parsed_old, parsed_new]).loc[df.index]
+    else:
+        parsed = parser.parse_dataframe(df, blocks=True)
+    # unstripped blocks are kept, so reused rows are stripped again with the table as it grows
+    raw_blocks = parsed[["row_hash", "title", "blocks", "block_parents"]].reset_index(drop=True)
+    # unchanged pages are not counted again; every row, reused or not, is stripped
+    parsed = boilerplate.strip_boilerplate(parsed, table)
+
+    parsed = parsed.drop(columns=["html_content"], errors="ignore").reset_index(drop=True)
+    feat_df, vec, X = features.compute_features(parsed)
+    pages = scorer.score_dataframe(feat_df, model=model)
+    pages["body_hash"] = _text_hashes(pages["body_text"])
+    rows, cols, sims = features.similarity_join(X, sim_threshold=sim_threshold)
+
+    index_dir = _new_generation(root)
+    manifest = {
+        "version": INDEX_VERSION,
+        "source": str(csv_path),
+        "source_hash": file_hash(csv_path),
+        "model_hash": model_hash,
+        "n_docs": int(X.shape[0]),
+        "shape": _save_tfidf(X, index_dir),
+        "reused_rows": reused,
+        "sim_threshold": sim_threshold,
+    }
+    _save_pages(pages, index_dir)
+    table.save(index_dir / BOILERPLATE)
+    store.write_dataset(raw_blocks, index_dir / BLOCKS)
+    features.save_vectorizer(vec, index_dir / VOCAB)
+    dups = store.pairs_frame(rows, cols, sims, pages["url"])
+    store.write_dataset(dups, index_dir / DUPLICATES)
+    _save_clusters(dups, pages, index_dir)
+    _refresh_embeddings(X, old_dir, index_dir, refit=True)
+    _publish(root, index_dir, manifest)
+    return load_index(root)
+
+
+def load_or_build_index(csv_path: Path, index_dir: Path, model=None,
+                        model_path: Optional[Path] = None) -> Optional[CorpusIndex]:
+    """
+    Returns the on-disk index, rebuilding it (incrementally) only if csv_path changed,
+    or if the model file at model_path differs from the one the labels came from.
+    """
+    csv_path = Path(csv_path)
+    index = load_index(index_dir)
+    if not csv_path.exists():
+        return index
+    model_hash = file_hash(model_path) if model_path and Path(model_path).exists() else ""
+    if (index is not None and index.source_hash == file_hash(csv_path)
+            and index.manifest.get("model_hash", "") == model_hash):
+        return index
+    return build_index(csv_path, index_dir, model=model, previous=index, model_hash=model_hash)
+
+
+def update_index(index_dir: Path, delta: pd.DataFrame, model=None) -> CorpusIndex:
+    """
+    Applies a crawl delta (url + html_content or body_text) to an existing index.
+    Html rows are stripped of boilerplate with the index's block table, which they also
+    update. Pages whose body-text hash is unchanged are skipped; new and changed pages are
+    featurized against the frozen vocabulary, replace/append their rows, and only
+    they are compared against the index to refresh the duplicate pairs.
+    """
+    root = Path(index_dir)
+    index = load_index(root, mmap=False)
+    if index is None:
+        raise ValueError(f"No index at {root}; build it first")
+    table = boilerplate.BlockTable.load(index.index_dir / BOILERPLATE)
+    if "html_content" in delta.columns:
+        delta = boilerplate.strip_boilerplate(parser.parse_dataframe(delta, blocks=True), table)
+    delta = delta.drop(columns=["html_content"], errors="ignore").drop_duplicates("url", keep="last")
+    delta = delta.assign(body_hash=_text_hashes(delta["body_text"])).reset_index(drop=True)
+
+    pages = index.pages
+    position = pd.Series(np.arange(len(pages)), index=pages["url"])
+    position = position[~position.index.duplicated(keep="last")]
+    old_pos = delta["url"].map(position)
+    known = old_pos.notna()
+    changed = known & (pages["body_hash"].to_numpy()[old_pos.fillna(0).astype(int)] != delta["body_hash"])
+    delta = delta[changed | ~known].reset_index(drop=True)
+    old_pos = old_pos[changed | ~known].reset_index(drop=True)
+    manifest = dict(index.manifest)
+    if delta.empty:
+        return index
+
+    feat_df, _, X_delta = features.compute_features(delta, vectorizer=index.vectorizer)
+    scored = scorer.score_dataframe(feat_df, model=model)
+    scored["body_hash"] = delta["body_hash"]
+
+    # changed pages keep their row position, new ones are appended
+    n_old = len(pages)
+    is_new = old_pos.isna().to_numpy()
+    target = old_pos.to_numpy(copy=True)
+    target[is_new] = n_old + np.arange(is_new.sum())
+    target = target.astype(np.int64)
+    source = np.arange(n_old + is_new.sum())
+    source[target] = n_old + np.arange(len(delta))
+    X = sparse.vstack([index.X, X_delta]).tocsr()[source]
+    new_pages = pd.concat([pages, scored[pages.columns.intersection(scored.columns)]], ignore_index=True)
+    new_pages = new_pages.iloc[source].reset_index(drop=True)
+
+    # drop stale pairs of changed pages, then join the delta rows against the whole index
+    threshold = manifest.get("sim_threshold", 0.9)
+    dups = load_duplicates(index.index_dir)
+    dups = dups[~(dups["i"].isin(target) | dups["j"].isin(target))]
+    rows, cols, sims = features.cross_similarity(X[target], X, sim_threshold=threshold)
+    rows = target[rows]
+    keep = rows != cols
+    a, b = np.minimum(rows, cols)[keep], np.maximum(rows, cols)[keep]
+    fresh = store.pairs_frame(a, b, sims[keep], new_pages["url"]).drop_duplicates(["i", "j"])
+    dups = pd.concat([dups, fresh], ignore_index=True).sort_values(["i", "j"]).reset_index(drop=True)
+
+    index_dir = _new_generation(root)
+    manifest.update(n_docs=int(X.shape[0]), shape=_save_tfidf(X, index_dir),
+                    updated_rows=int((~is_new).sum()), added_rows=int(is_new.sum()))
+    _carry_over(index.index_dir, index_dir, [VOCAB, BLOCKS])
+    table.save(index_dir / BOILERPLATE)
+    _save_pages(new_pages, index_dir)
+    store.write_dataset(dups, index_dir / DUPLICATES)
+    # pairs of changed pages were dropped, so clusters may split: recompute, it is O(pages + pairs)
+    _save_clusters(dups, new_pages, index_dir)
+    _refresh_embeddings(X, index.index_dir, index_dir, refit=False)
+    _publish(root, index_dir, manifest)
+    return load_index(root)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    base_dir = Path(__file__).resolve().parent.parent
+    ap = argparse.ArgumentParser(description="Build the reference-corpus index used by the app.")
+    ap.add_argument("--data", default=str(base_dir.parent / "data" / "data.csv"))
+    ap.add_argument("--out", default=str(base_dir / "models" / "index"))
+    ap.add_argument("--model", default=None, help="default: the pickle, else the exported .npz artifact")
+    ap.add_argument("--force", action="store_true", help="rebuild from scratch")
+    ap.add_argument("--update", help="CSV of new/changed pages to apply incrementally")
+    args = ap.parse_args()
+
+    # the same file the app builds with, so its model_hash check matches this build
+    model_path = Path(args.model) if args.model else scorer.default_model_path(base_dir / "models", bulk=True)
+    model = scorer.load_model(model_path)
+    if args.update:
+        index = update_index(args.out, pd.read_csv(args.update), model=model)
+    elif args.force:
+        model_hash = file_hash(model_path) if model_path else ""
+        index = build_index(args.data, args.out, model=model, model_hash=model_hash)
+    else:
+        index = load_or_build_index(args.data, args.out, model=model, model_path=model_path)
+    print(json.dumps(index.manifest, indent=2))
@@ -0,0 +1,228 @@
+from pathlib import Path
+import json
+import zipfile
+import numpy as np
+import pandas as pd
+from typing import List
+
+# Compact inference artifact for the quality model: every decision tree flattened into
+# shared node arrays inside an uncompressed .npz, memory-mapped on load and evaluated
+# with a vectorized NumPy traversal (no unpickling, no sklearn needed at predict time).
+ARTIFACT_FORMAT = "seo-quality-trees"
+ARTIFACT_VERSION = 1
+NODE_ARRAYS = ("feature", "threshold", "children", "value", "tree_root", "tree_group", "calib_a", "calib_b")
+
+
+class ModelArtifactError(ValueError):
+    pass
+
+
+def _forests(model):
+    """Returns ([(forest, calibrator list or None)], classes, method) for supported model types."""
+    name = type(model).__name__
+    if name == "CalibratedClassifierCV":
+        members = []
+        for cc in model.calibrated_classifiers_:
+            if cc.method != "sigmoid":
+                raise ModelArtifactError(f"Unsupported calibration method: {cc.method}")
+            members.append((cc.estimator, cc.calibrators))
+        return members, model.classes_, "sigmoid"
+    if name in ("RandomForestClassifier", "ExtraTreesClassifier", "DecisionTreeClassifier"):
+        return [(model, None)], model.classes_, "none"
+    raise ModelArtifactError(f"Unsupported model type for export: {name}")
+
+
+def export_model(model, path: Path, feature_columns: List[str] = None) -> dict:
+    """Flattens a (calibrated) tree ensemble into the .npz artifact at path; returns its header."""
+    members, classes, method = _forests(model)
+    if feature_columns is None:
+        feature_columns = [str(c) for c in getattr(model, "feature_names_in_", [])]
+    if not feature_columns:
+        raise ModelArtifactError("feature_columns are required when the model has no feature_names_in_")
+    n_classes = len(classes)
+    feature, threshold, children, value, tree_root, tree_group = [], [], [], [], [], []
+    calib_a = np.zeros((len(members), n_classes))
+    # classes a calibrated forest never saw get probability exp(-inf) = 0, as in sklearn
+    calib_b = np.full((len(members), n_classes), np.inf if method == "sigmoid" else 0.0)
+    offset = 0
+    for g, (forest, calibrators) in enumerate(members):
+        trees = getattr(forest, "estimators_", [forest])
+        # forest classes may be a subset of the ensemble classes
+        cols = np.searchsorted(classes, forest.classes_)
+        for est in trees:
+            t = est.tree_
+            leaf = t.children_left < 0
+            feature.append(np.where(leaf, 0, t.feature).astype(np.int32))
+            threshold.append(t.threshold.astype(np.float64))
+            # leaves point at themselves so traversal can run a fixed number of steps
+            own = np.arange(t.node_count) + offset
+            children.append(np.stack([np.where(leaf, own, t.children_left + offset),
+                                      np.where(leaf, own, t.children_right + offset)], axis=1).astype(np.int32))
+            v = t.value[:, 0, :].astype(np.float64)
+            norm = v.sum(axis=1, keepdims=True)
+            norm[norm == 0] = 1
+            full = np.zeros((t.node_count, n_classes))
+            full[:, cols] = v / norm
+            value.append(full)
+            tree_root.append(offset)
+            tree_group.append(g)
+            offset += t.node_count
+        if calibrators is not None:
+            # binary models carry one calibrator, for the positive class
+            targets = cols[1:] if n_classes == 2 else cols
+            for c, cal in zip(targets, calibrators):
+                calib_a[g, c], calib_b[g, c] = cal.a_, cal.b_
+    depth = max(int(getattr(est, "tree_").max_depth) for f, _ in members for est in getattr(f, "estimators_", [f]))
+    header = {
+        "format": ARTIFACT_FORMAT,
+        "version": ARTIFACT_VERSION,
+        "feature_columns": list(feature_columns),
+        "classes": [str(c) for c in classes],
+        "calibration": method,
+        "n_groups": len(members),
+        "n_trees": len(tree_root),
+        "n_nodes": offset,
+        "max_depth": depth,
+    }
+    np.savez(path, header=np.array(json.dumps(header)),
+             feature=np.concatenate(feature), threshold=np.concatenate(threshold),
+             children=np.concatenate(children), value=np.concatenate(value),
+             tree_root=np.array(tree_root, dtype=np.int64), tree_group=np.array(tree_group, dtype=np.int64),
+             calib_a=calib_a, calib_b=calib_b)
+    return header
+
+
+def _mmap_npz(path: Path) -> dict:
+    """Memory-maps every member of an uncompressed .npz (np.load ignores mmap_mode for archives)."""
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ModelArtifactError(f"{info.filename} is compressed; re-export with np.savez")
+            # local file header: 30 fixed bytes + name + extra field
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = (int(v) for v in np.frombuffer(f.read(4), dtype="<u2"))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran, dtype = read_header(f)
+            key = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if dtype.hasobject:
+                raise ModelArtifactError(f"{key} holds Python objects")
+            if shape == ():
+                arrays[key] = np.fromfile(f, dtype=dtype, count=1).reshape(())
+            else:
+                arrays[key] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                        order="F" if fortran else "C")
+    return arrays
+
+
+class TreeEnsemblePredictor:
+    """predict / predict_proba over the flattened arrays of an exported artifact."""
+
+    def __init__(self, header: dict, arrays: dict):
+        self.header = header
+        self.feature_columns = header["feature_columns"]
+        self.classes_ = np.array(header["classes"], dtype=object)
+        for name in NODE_ARRAYS:
+            # plain ndarray views of the memmaps: same pages, cheaper fancy indexing
+            setattr(self, name, np.asarray(arrays[name]))
+        self._child = self.children.reshape(-1)
+        self._is_leaf = self.children[:, 0] == np.arange(len(self.children))
+        self._group_starts = np.flatnonzero(np.r_[True, np.diff(self.tree_group) != 0])
+        self._group_sizes = np.diff(np.r_[self._group_starts, len(self.tree_group)])
+
+    def _features(self, X) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            missing = [c for c in self.feature_columns if c not in X.columns]
+            if missing:
+                raise KeyError(f"Missing model features: {missing}")
+            X = X[self.feature_columns]
+        # sklearn trees compare float32 inputs against float64 thresholds
+        return np.asarray(X, dtype=np.float32)
+
+    def _leaf_nodes(self, X: np.ndarray) -> np.ndarray:
+        n, n_features = X.shape
+        n_trees = len(self.tree_root)
+        flat_X = X.ravel()
+        # one entry per (row, tree); those that reached a leaf are dropped after every step,
+        # so the work follows the depth of the paths taken rather than the deepest tree
+        pos = np.arange(n * n_trees)
+        node = np.tile(self.tree_root, n)
+        row_base = np.repeat(np.arange(n, dtype=np.int64) * n_features, n_trees)
+        leaves = np.empty(n * n_trees, dtype=np.int64)
+        for _ in range(self.header["max_depth"]):
+            # written as "not <=" so NaN goes right, as in sklearn
+            go_right = ~(flat_X[row_base + self.feature[node]] <= self.threshold[node])
+            node = self._child[2 * node + go_right]
+            done = self._is_leaf[node]
+            leaves[pos[done]] = node[done]
+            pos, node, row_base = pos[~done], node[~done], row_base[~done]
+            if not len(pos):
+                break
+        leaves[pos] = node
+        return leaves.reshape(n, n_trees)
+
+    def predict_proba(self, X, batch_size: int = 512) -> np.ndarray:
+        X = self._features(X)
+        group_proba = np.empty((X.shape[0], len(self._group_starts), len(self.classes_)))
+        # row batches keep the (rows x trees) node matrix cache-sized
+        for start in range(0, X.shape[0], batch_size):
+            leaf_proba = self.value[self._leaf_nodes(X[start:start + batch_size])]  # (rows, trees, classes)
+            sums = np.add.reduceat(leaf_proba, self._group_starts, axis=1)
+            group_proba[start:start + batch_size] = sums / self._group_sizes[None, :, None]
+        if self.header["calibration"] == "sigmoid":
+            p = 1.0 / (1.0 + np.exp(self.calib_a[None] * group_proba + self.calib_b[None]))
+            if len(self.classes_) == 2:
+                p[..., 0] = 1.0 - p[..., 1]
+            else:
+                denom = p.sum(axis=2, keepdims=True)
+                p = np.divide(p, denom, out=np.full_like(p, 1 / len(self.classes_)), where=denom != 0)
+            group_proba = p
+        proba = group_proba.mean(axis=1)
+        proba[(1.0 < proba) & (proba <= 1.0 + 1e-5)] = 1.0
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def load_artifact(path: Path) -> TreeEnsemblePredictor:
+    """Loads and validates an exported artifact; raises ModelArtifactError instead of failing silently."""
+    path = Path(path)
+    if not path.exists():
+        raise ModelArtifactError(f"Model artifact not found: {path}")
+    try:
+        arrays = _mmap_npz(path)
+    except (zipfile.BadZipFile, ValueError, OSError) as e:
+        raise ModelArtifactError(f"Unreadable model artifact {path}: {e}") from e
+    if "header" not in arrays:
+        raise ModelArtifactError(f"{path} has no header")
+    header = json.loads(str(arrays["header"]))
+    if header.get("format") != ARTIFACT_FORMAT or header.get("version") != ARTIFACT_VERSION:
+        raise ModelArtifactError(f"{path}: unsupported format {header.get('format')} v{header.get('version')}")
+    missing = [name for name in NODE_ARRAYS if name not in arrays]
+    if missing:
+        raise ModelArtifactError(f"{path} is missing arrays: {missing}")
+    n_nodes = header["n_nodes"]
+    if any(len(arrays[name]) != n_nodes for name in ("feature", "threshold", "children", "value")):
+        raise ModelArtifactError(f"{path}: node arrays do not match n_nodes={n_nodes}")
+    if len(arrays["tree_root"]) != header["n_trees"] or arrays["value"].shape[1] != len(header["classes"]):
+        raise ModelArtifactError(f"{path}: tree or class counts do not match the header")
+    if np.any(np.diff(arrays["tree_group"]) < 0) or len(np.unique(arrays["tree_group"])) != header["n_groups"]:
+        raise ModelArtifactError(f"{path}: trees are not stored group by group")
+    if int(arrays["feature"].max(initial=0)) >= len(header["feature_columns"]):
+        raise ModelArtifactError(f"{path}: node features exceed feature_columns")
+    return TreeEnsemblePredictor(header, arrays)
+
+
+if __name__ == "__main__":
+    import argparse
+    import joblib
+
+    ap = argparse.ArgumentParser(description="Export the pickled quality model to a .npz inference artifact.")
+    ap.add_argument("model", help="joblib/pickle model file")
+    ap.add_argument("out", help="output .npz path")
+    ap.add_argument("--features", nargs="*", help="feature columns (default: model.feature_names_in_)")
+    args = ap.parse_args()
+    print(json.dumps(export_model(joblib.load(args.model), args.out, args.features), indent=2))
@@ -0,0 +1,187 @@
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+# Lightweight in-process instrumentation: timing spans, counters and gauges shared by
+# parser / features / scorer, exportable as Prometheus text or JSON. Environment toggles:
+#   SEO_METRICS_LOG=1               log one JSON line per finished span (logger "utils.metrics")
+#   SEO_METRICS_EXPORT=path         write the registry at exit (.prom -> Prometheus text, else JSON)
+#   SEO_PROFILE=cprofile,tracemalloc  profile outermost spans; cProfile dumps go to SEO_PROFILE_DIR
+PREFIX = "seo_"
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_timers = {}
+_collector: ContextVar = ContextVar("metrics_collector", default=None)
+_depth: ContextVar = ContextVar("metrics_depth", default=0)
+
+
+def _key(name: str, labels: dict):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _profile_modes() -> set:
+    return {m.strip() for m in os.environ.get("SEO_PROFILE", "").lower().split(",") if m.strip()}
+
+
+def incr(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = float(value)
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        t = _timers.setdefault(name, [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += seconds
+        t[2] = max(t[2], seconds)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Times the enclosed block as span `name`. Extra attrs (e.g. docs=len(df)) go to the
+    structured log and the collector; docs/bytes attrs also feed the matching counters.
+    """
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    modes = _profile_modes() if depth == 0 else set()
+    profiler, traced = None, False
+    if "cprofile" in modes:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if "tracemalloc" in modes:
+        import tracemalloc
+        # leave an already running trace (e.g. utils.bench) alone
+        traced = not tracemalloc.is_tracing()
+        if traced:
+            tracemalloc.start()
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        seconds = time.perf_counter() - start
+        _depth.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            out_dir = Path(os.environ.get("SEO_PROFILE_DIR", "profiles"))
+            out_dir.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(out_dir / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+        if traced:
+            attrs["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            gauge("peak_bytes", attrs["peak_bytes"], span=name)
+        observe(name, seconds)
+        for unit in ("docs", "bytes"):
+            if unit in attrs:
+                incr(f"{unit}_total", attrs[unit], span=name)
+        record = {"span": name, "ts": started_at, "seconds": round(seconds, 6), "depth": depth, **attrs}
+        spans = _collector.get()
+        if spans is not None:
+            spans.append(record)
+        if os.environ.get("SEO_METRICS_LOG"):
+            logger.info(json.dumps(record, default=str))
+
+
+def timed(name: str = None):
+    """Decorator form of span()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+@contextmanager
+def collect():
+    """Collects the span records finished inside the block (this thread/task only), in finish order."""
+    spans = []
+    token = _collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _collector.reset(token)
+
+
+def merge(records):
+    """Adds span records finished elsewhere (e.g. in a worker process) to the active collector."""
+    spans = _collector.get()
+    if spans is not None:
+        spans.extend(records)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {
+            "spans": {name: {"count": c, "sum_seconds": s, "max_seconds": m} for name, (c, s, m) in _timers.items()},
+            "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _counters.items()],
+            "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _gauges.items()],
+        }
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def to_prometheus() -> str:
+    """Prometheus text exposition format of the whole registry."""
+    lines = []
+    with _lock:
+        if _timers:
+            lines.append(f"# TYPE {PREFIX}span_seconds summary")
+            for name, (count, total, _) in sorted(_timers.items()):
+                lines.append(f'{PREFIX}span_seconds_count{{span="{name}"}} {count}')
+                lines.append(f'{PREFIX}span_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f"# TYPE {PREFIX}span_seconds_max gauge")
+            for name, (_, _, peak) in sorted(_timers.items()):
+                lines.append(f'{PREFIX}span_seconds_max{{span="{name}"}} {peak:.6f}')
+        for kind, registry in (("counter", _counters), ("gauge", _gauges)):
+            typed = set()
+            for (name, labels), value in sorted(registry.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                    typed.add(name)
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def export(path: Path):
+    """Writes the registry to path: Prometheus text for .prom/.txt, JSON otherwise."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix in (".prom", ".txt"):
+        path.write_text(to_prometheus())
+    else:
+        path.write_text(json.dumps(snapshot(), indent=2))
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
+
+
+if os.environ.get("SEO_METRICS_EXPORT"):
+    atexit.register(export, os.environ["SEO_METRICS_EXPORT"])
@@ -0,0 +1,116 @@
+import re
+import zlib
+import numpy as np
+from collections import defaultdict
+from sklearn.preprocessing import normalize
+from typing import List, Optional
+
+# MinHash signatures + LSH banding for sub-quadratic near-duplicate candidates.
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def shingles(text: str, k=5) -> np.ndarray:
+    """Hashes the word k-grams of text to 32-bit ids, stored as uint64 (the whole text if shorter than k words)."""
+    words = _TOKEN_RE.findall(str(text).lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    grams = {" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+def _permutations(num_perm: int, seed: int):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(token_sets: List[np.ndarray], num_perm=128, seed=1) -> np.ndarray:
+    """
+    Returns a (n_docs, num_perm) uint32 signature matrix.
+    Empty documents get MAX_HASH everywhere, and are never bucketed together.
+    """
+    a, b = _permutations(num_perm, seed)
+    sigs = np.full((len(token_sets), num_perm), MAX_HASH, dtype=np.uint64)
+    for i, toks in enumerate(token_sets):
+        if len(toks) == 0:
+            continue
+        # (num_perm, n_tokens) universal hashes, min over tokens; a, b and the tokens are
+        # kept below 2**32 so a * tok + b stays below 2**64 and never wraps before the modulo
+        toks = np.asarray(toks, dtype=np.uint64) & MAX_HASH
+        hv = (np.outer(a, toks) + b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        sigs[i] = hv.min(axis=1)
+    return sigs.astype(np.uint32)
+
+
+def lsh_candidates(sigs: np.ndarray, bands=32, max_bucket: Optional[int] = None) -> np.ndarray:
+    """
+    Splits each signature into `bands` bands and returns unique (i, j), i < j, pairs
+    that share at least one band bucket, as an (m, 2) int64 array.
+    A bucket larger than max_bucket gives only the pairs of its first member with each
+    other one (a star), so a big cluster stays connected at linear cost.
+    """
+    if sigs is None or np.ndim(sigs) != 2:
+        raise ValueError("lsh_candidates needs an (n_docs, num_perm) signature matrix")
+    n, num_perm = sigs.shape
+    if num_perm % bands:
+        raise ValueError("num_perm must be divisible by bands")
+    rows = num_perm // bands
+    empty = (sigs == np.uint32(MAX_HASH)).all(axis=1)
+    pairs = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        chunk = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        for i in range(n):
+            if not empty[i]:
+                buckets[chunk[i].tobytes()].append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if max_bucket is not None and len(members) > max_bucket:
+                pairs.update((members[0], m) for m in members[1:])
+                continue
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.array(sorted(pairs), dtype=np.int64)
+
+
+def pair_cosine(tfidf_matrix, pairs: np.ndarray) -> np.ndarray:
+    """Exact cosine similarity for each (i, j) in pairs, without building the n x n matrix."""
+    if len(pairs) == 0:
+        return np.empty(0)
+    Xn = normalize(tfidf_matrix, norm="l2", copy=True)
+    return np.asarray(Xn[pairs[:, 0]].multiply(Xn[pairs[:, 1]]).sum(axis=1)).ravel()
+
+
+def find_duplicates_minhash(tfidf_matrix, urls: List[str], sim_threshold=0.9, texts: Optional[List[str]] = None,
+                            num_perm=128, bands=32, shingle_size=5, verify=True, max_bucket=None, seed=1):
+    """
+    MinHash/LSH near-duplicate search. Shingles come from `texts` when given,
+    otherwise from the non-zero terms of each tfidf row.
+    With verify=True candidates are re-scored with exact tfidf cosine; otherwise
+    'similarity' is the MinHash Jaccard estimate. Both are filtered by sim_threshold.
+    max_bucket bounds the pairs of huge buckets (see lsh_candidates): their members are
+    then reported against one representative instead of pairwise.
+    """
+    if tfidf_matrix is None and texts is None:
+        raise ValueError("find_duplicates_minhash needs a tfidf_matrix or texts to shingle")
+    if texts is not None:
+        token_sets = [shingles(t, k=shingle_size) for t in texts]
+    else:
+        X = tfidf_matrix.tocsr()
+        token_sets = [X.indices[X.indptr[i]:X.indptr[i + 1]].astype(np.uint64) for i in range(X.shape[0])]
+    sigs = minhash_signatures(token_sets, num_perm=num_perm, seed=seed)
+    pairs = lsh_candidates(sigs, bands=bands, max_bucket=max_bucket)
+    if verify and tfidf_matrix is not None:
+        sims = pair_cosine(tfidf_matrix, pairs)
+    else:
+        sims = (sigs[pairs[:, 0]] == sigs[pairs[:, 1]]).mean(axis=1) if len(pairs) else np.empty(0)
+    keep = sims >= sim_threshold
+    return [{"url1": urls[i], "url2": urls[j], "similarity": round(float(s), 4)}
+            for (i, j), s in zip(pairs[keep], sims[keep])]
@@ -2,8 +2,40 @@ from pathlib import Path
 import pandas as pd
 from bs4 import BeautifulSoup
 import re
+import os
+import time
+import asyncio
 import requests
-from typing import Tuple
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urlparse
+from typing import List, Tuple, Iterator, Optional
+
+from utils import metrics
+
+# Optional faster HTML backends; BeautifulSoup's html.parser is always available and is
+# the default everywhere. The backends agree on well-formed pages but repair malformed
+# markup differently: html.parser nests unclosed tags, so "<p>unclosed <p>second" gives
+# "unclosed second second", where lxml and selectolax close the first <p> and give
+# "unclosed second". Text, word counts and block hashes then differ, so a corpus should
+# be parsed with one backend throughout; pass "auto" (best_backend) to opt into speed.
+def _import_optional(name):
+    try:
+        return __import__(name)
+    except Exception:
+        return None
+
+LXML = _import_optional("lxml")
+SELECTOLAX = _import_optional("selectolax.lexbor")
+
+def best_backend() -> str:
+    if SELECTOLAX:
+        return "selectolax"
+    if LXML:
+        return "lxml"
+    return "html.parser"
 
 # Basic HTML -> text extraction utility functions
 def clean_whitespace(text: str) -> str:
@@ -12,62 +44,385 @@ def clean_whitespace(text: str) -> str:
     text = re.sub(r"\s+", " ", text).strip()
     return text
 
-def extract_title_and_body_from_html(html: str) -> Tuple[str, str]:
+def _parents(nodes, key, parent_of) -> List[int]:
+    # index of each node's nearest enclosing node in `nodes`, -1 for none
+    position = {key(n): i for i, n in enumerate(nodes)}
+    parents = []
+    for n in nodes:
+        up = parent_of(n)
+        while up is not None and key(up) not in position:
+            up = parent_of(up)
+        parents.append(position[key(up)] if up is not None else -1)
+    return parents
+
+def _blocks_selectolax(html: str) -> Tuple[str, List[str], List[int]]:
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(html)
+    title_node = tree.css_first("title")
+    title = title_node.text(strip=True) if title_node else ""
+    # same fallback order as the BeautifulSoup path: <article>, <main>, every <p>
+    container = tree.css_first("article") or tree.css_first("main")
+    nodes = container.css("p, div") if container else tree.css("p")
+    parents = _parents(nodes, lambda n: n.mem_id, lambda n: n.parent)
+    return clean_whitespace(title), [n.text(separator=" ", strip=True) for n in nodes], parents
+
+def extract_block_tree(html: str, backend: str = "html.parser") -> Tuple[str, List[str], List[int]]:
+    """
+    Like extract_blocks, plus the index of each block's nearest enclosing block (-1 at the
+    top level): extracted <div>s nest, and a container's text includes its children's.
+    """
     if not html or not isinstance(html, str):
-        return "", ""
-    soup = BeautifulSoup(html, "html.parser")
-    title_tag = soup.find("title")
-    title = title_tag.get_text(strip=True) if title_tag else ""
-    # collect paragraphs and article text
-    texts = []
-    # try <article> then <main> then <p>
-    article = soup.find("article")
-    if article:
-        texts = [p.get_text(" ", strip=True) for p in article.find_all(["p", "div"])]
+        return "", [], []
+    if backend == "selectolax":
+        title, texts, parents = _blocks_selectolax(html)
     else:
-        main = soup.find("main")
-        if main:
-            texts = [p.get_text(" ", strip=True) for p in main.find_all(["p", "div"])]
+        soup = BeautifulSoup(html, backend)
+        title_tag = soup.find("title")
+        title = clean_whitespace(title_tag.get_text(strip=True) if title_tag else "")
+        # collect paragraphs and article text
+        # try <article> then <main> then <p>
+        article = soup.find("article")
+        if article:
+            nodes = article.find_all(["p", "div"])
         else:
-            texts = [p.get_text(" ", strip=True) for p in soup.find_all("p")]
-    body = " ".join(texts)
-    return clean_whitespace(title), clean_whitespace(body)
+            main = soup.find("main")
+            if main:
+                nodes = main.find_all(["p", "div"])
+            else:
+                nodes = soup.find_all("p")
+        texts = [p.get_text(" ", strip=True) for p in nodes]
+        parents = _parents(nodes, id, lambda n: n.parent)
+    blocks = [clean_whitespace(t) for t in texts]
+    # an empty block encloses nothing but empty blocks, so renumbering the rest is enough
+    keep = [k for k, b in enumerate(blocks) if b]
+    renumber = {k: i for i, k in enumerate(keep)}
+    return title, [blocks[k] for k in keep], [renumber.get(parents[k], -1) for k in keep]
 
-def parse_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+def extract_blocks(html: str, backend: str = "html.parser") -> Tuple[str, List[str]]:
     """
-    Takes a dataframe with at least 'url' and optional 'html_content'.
-    Returns a dataframe with url, title, body_text, word_count.
+    Title and the body text blocks (one per extracted <p>/<div>, in document order,
+    whitespace-normalized, empty ones dropped); the body text is their " " join.
     """
+    title, blocks, _ = extract_block_tree(html, backend)
+    return title, blocks
+
+def extract_title_and_body_from_html(html: str, backend: str = "html.parser") -> Tuple[str, str]:
+    """
+    backend: "html.parser" (default), "lxml" (BeautifulSoup with lxml) or "selectolax".
+    """
+    title, blocks = extract_blocks(html, backend)
+    return title, " ".join(blocks)
+
+def _parse_one(html, title, body, backend):
+    try:
+        if pd.notna(html) and html:
+            return extract_block_tree(html, backend=backend)
+    except Exception:
+        pass
+    # no html (or unparseable): keep whatever title/body the row already had, as one block
+    title = title if isinstance(title, str) else ""
+    body = body if isinstance(body, str) else ""
+    return (title, [body], [-1]) if body else (title, [], [])
+
+def _parse_frame(df: pd.DataFrame, backend: str = "html.parser", blocks: bool = False) -> pd.DataFrame:
     out = df.copy()
-    if "title" not in out.columns:
-        out["title"] = ""
-    if "body_text" not in out.columns:
-        out["body_text"] = ""
-    for idx, row in out.iterrows():
-        try:
-            if pd.notna(row.get("html_content")) and row.get("html_content"):
-                title, body = extract_title_and_body_from_html(row.get("html_content"))
-                out.at[idx, "title"] = title
-                out.at[idx, "body_text"] = body
-            else:
-                # leave blank; don't attempt network scraping here
-                out.at[idx, "title"] = row.get("title", "")
-                out.at[idx, "body_text"] = row.get("body_text", "")
-        except Exception:
-            out.at[idx, "title"] = out.at[idx, "title"] if out.at[idx, "title"] else ""
-            out.at[idx, "body_text"] = out.at[idx, "body_text"] if out.at[idx, "body_text"] else ""
+    n = len(out)
+    html = out["html_content"].tolist() if "html_content" in out.columns else [None] * n
+    titles = out["title"].tolist() if "title" in out.columns else [""] * n
+    bodies = out["body_text"].tolist() if "body_text" in out.columns else [""] * n
+    parsed = [_parse_one(h, t, b, backend) for h, t, b in zip(html, titles, bodies)]
+    out["title"] = [t for t, _, _ in parsed]
+    out["body_text"] = [" ".join(b) for _, b, _ in parsed]
+    if blocks:
+        # kept for utils.boilerplate, which drops the blocks repeated across a domain
+        out["blocks"] = [b for _, b, _ in parsed]
+        out["block_parents"] = [p for _, _, p in parsed]
     # compute word count
     out["body_text"] = out["body_text"].fillna("").astype(str)
-    out["word_count"] = out["body_text"].apply(lambda t: len(t.split()))
+    out["word_count"] = out["body_text"].str.split().str.len()
     return out
 
-# Minimal scraping helper for single-url analyze_url (rate limiting/delay not enforced here)
-def analyze_url(url: str, timeout=8):
+@metrics.timed("parse_dataframe")
+def parse_dataframe(df: pd.DataFrame, backend: str = "html.parser", workers: int = 1, chunksize: int = 500,
+                    blocks: bool = False) -> pd.DataFrame:
+    """
+    Takes a dataframe with at least 'url' and optional 'html_content'.
+    Returns a dataframe with url, title, body_text, word_count (and, if blocks=True, the
+    list of body text blocks per page in 'blocks' and their enclosing block in 'block_parents').
+    With workers > 1 the rows are parsed in chunks across a process pool.
+    """
+    metrics.incr("docs_total", len(df), span="parse_dataframe")
+    if workers <= 1 or len(df) <= chunksize:
+        return _parse_frame(df, backend=backend, blocks=blocks)
+    chunks = (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+    return pd.concat(list(parse_chunks(chunks, backend, workers, blocks=blocks)))
+
+def parse_chunks(chunks, backend: str = "html.parser", workers: int = 1, max_pending: Optional[int] = None,
+                 blocks: bool = False) -> Iterator[pd.DataFrame]:
+    """Parses an iterable of frames on a process pool, keeping at most max_pending in flight, in order."""
+    if workers <= 1:
+        for chunk in chunks:
+            yield _parse_frame(chunk, backend, blocks)
+        return
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(_parse_frame, chunk, backend, blocks))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def read_crawl(path, chunksize: int = 1000, columns=None) -> Iterator[pd.DataFrame]:
+    """Yields the crawl export at `path` (.csv or .parquet) in chunks of rows."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns)
+
+def iter_parsed_batches(path, chunksize: int = 1000, workers: Optional[int] = None, backend: str = "html.parser",
+                        keep_html: bool = False) -> Iterator[pd.DataFrame]:
+    """
+    Streaming parse of a crawl file: reads `path` in chunks, extracts title/body on
+    `workers` processes (default: all cores) and yields parsed record batches in input
+    order, so memory stays bounded by a few chunks whatever the file size.
+    backend="auto" picks the fastest installed backend (see best_backend).
+    """
+    backend = best_backend() if backend == "auto" else backend
+    workers = workers or os.cpu_count() or 1
+    chunks = read_crawl(path, chunksize=chunksize)
+    for batch in parse_chunks(chunks, backend, workers):
+        if not keep_html:
+            batch = batch.drop(columns=["html_content"], errors="ignore")
+        yield batch
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; SEO-Detector/1.0)"}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def make_session(pool_size: int = 16) -> requests.Session:
+    """requests.Session with a keep-alive connection pool sized for pool_size concurrent fetches."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+_SESSION = None
+
+def _shared_session() -> requests.Session:
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = make_session()
+    return _SESSION
+
+# Minimal scraping helper for single-url analyze_url (use fetch_many for rate-limited bulk fetches)
+def analyze_url(url: str, timeout=8, cache=None, boilerplate=None):
+    """
+    Fetches and parses one url. With a utils.cache.PageCache, fresh entries skip the
+    network and the parse, and stale ones are revalidated with ETag/Last-Modified.
+    With a utils.boilerplate.BlockTable, the blocks it knows as boilerplate for the
+    url's domain are left out of the body (the table itself is not updated).
+    """
     if not url:
         raise ValueError("URL empty")
-    headers = {"User-Agent": "Mozilla/5.0 (compatible; SEO-Detector/1.0)"}
-    resp = requests.get(url, headers=headers, timeout=timeout)
-    resp.raise_for_status()
-    title, body = extract_title_and_body_from_html(resp.text)
+    with metrics.span("analyze_url"):
+        title, body = _fetch_and_extract(url, timeout, cache, boilerplate)
     df = pd.DataFrame([{"url": url, "title": title, "body_text": body, "word_count": len(body.split())}])
     return df
+
+def _fetch_and_extract(url: str, timeout, cache, boilerplate=None) -> Tuple[str, str]:
+    with metrics.span("cache_lookup"):
+        entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and entry["fresh"]:
+        _cache_metrics(cache, "hit")
+        return _extracted(url, entry["title"], entry["blocks"], entry["parents"], boilerplate)
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    with metrics.span("http_get") as sp:
+        resp = _shared_session().get(url, timeout=timeout, headers=headers)
+        sp.update(status=resp.status_code, bytes=len(resp.content))
+    if entry is not None and resp.status_code == 304:
+        cache.touch(url)
+        _cache_metrics(cache, "revalidated")
+        return _extracted(url, entry["title"], entry["blocks"], entry["parents"], boilerplate)
+    resp.raise_for_status()
+    with metrics.span("parse_html", docs=1):
+        title, blocks, parents = extract_block_tree(resp.text)
+    if cache is not None:
+        cache.put(url, resp.text, title, blocks, parents, etag=resp.headers.get("ETag"),
+                  last_modified=resp.headers.get("Last-Modified"))
+        _cache_metrics(cache, "miss")
+    return _extracted(url, title, blocks, parents, boilerplate)
+
+def _extracted(url: str, title: str, blocks, parents, boilerplate=None) -> Tuple[str, str]:
+    # stripped per request, so cached pages follow the current block table
+    if boilerplate is not None:
+        blocks = boilerplate.strip(url, blocks, parents)
+    return title, " ".join(blocks)
+
+def _cache_metrics(cache, result: str):
+    metrics.incr("page_cache_requests_total", result=result)
+    metrics.gauge("page_cache_hit_rate", cache.stats()["hit_rate"])
+
+class ContentTooLarge(Exception):
+    pass
+
+class TokenBucket:
+    """Per-host throttle: `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _get_capped(session: requests.Session, url: str, timeout, max_bytes: int):
+    with session.get(url, timeout=timeout, stream=True) as resp:
+        size = int(resp.headers.get("Content-Length") or 0)
+        if max_bytes and size > max_bytes:
+            raise ContentTooLarge(f"{size} bytes > {max_bytes}")
+        body = bytearray()
+        for chunk in resp.iter_content(64 * 1024):
+            body.extend(chunk)
+            if max_bytes and len(body) > max_bytes:
+                raise ContentTooLarge(f"more than {max_bytes} bytes")
+        html = bytes(body).decode(resp.encoding or "utf-8", errors="replace")
+        return resp.status_code, html, resp.headers
+
+def _retry_delay(attempt: int, backoff: float, headers=None, max_delay: float = 60.0) -> float:
+    # Retry-After is delta-seconds or an HTTP-date; either way a server cannot hold a slot past max_delay
+    retry_after = str((headers or {}).get("Retry-After", "")).strip()
+    delay = backoff * (2 ** attempt)
+    if retry_after.isdigit():
+        delay = float(retry_after)
+    elif retry_after:
+        try:
+            delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            pass
+    return min(max(delay, 0.0), max_delay)
+
+async def afetch_many(urls, concurrency: int = 16, per_host: float = 2.0, burst: float = 2.0, timeout=8,
+                      retries: int = 3, backoff: float = 0.5, max_bytes: int = 5_000_000, session=None,
+                      max_retry_after: float = 60.0):
+    """
+    Async generator over fetch results for `urls`, in completion order.
+    Each result is a dict: url, status, html, error, attempts, elapsed.
+    concurrency bounds in-flight requests (and the pooled keep-alive connections);
+    per_host is a token-bucket rate in requests/second per hostname (0 disables it).
+    Connection errors, timeouts, 429 and 5xx are retried with exponential backoff, or
+    after the server's Retry-After (at most max_retry_after seconds). Any other failure
+    is recorded in the url's `error` and does not affect the other urls.
+    """
+    session = session or make_session(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    loop = asyncio.get_running_loop()
+    buckets = {}
+    todo = iter(urls)
+    results = asyncio.Queue(maxsize=2 * concurrency)
+
+    async def fetch(url):
+        host = urlparse(url).hostname or ""
+        bucket = buckets.setdefault(host, TokenBucket(per_host, burst))
+        start = time.monotonic()
+        result = {"url": url, "status": None, "html": "", "error": None, "attempts": 0}
+        for attempt in range(retries + 1):
+            await bucket.acquire()
+            result["attempts"] = attempt + 1
+            headers = None
+            try:
+                status, html, headers = await loop.run_in_executor(
+                    executor, _get_capped, session, url, timeout, max_bytes)
+                result.update(status=status, html=html if status < 400 else "",
+                              error=None if status < 400 else f"HTTP {status}")
+                if status not in RETRY_STATUS:
+                    break
+            except ContentTooLarge as e:
+                result.update(error=f"too large: {e}")
+                break
+            except requests.RequestException as e:
+                result.update(error=f"{type(e).__name__}: {e}")
+            except Exception as e:
+                # e.g. LookupError for a charset Python does not know; not worth retrying
+                result.update(status=None, html="", error=f"{type(e).__name__}: {e}")
+                break
+            if attempt < retries:
+                await asyncio.sleep(_retry_delay(attempt, backoff, headers, max_retry_after))
+        result["elapsed"] = time.monotonic() - start
+        metrics.observe("fetch", result["elapsed"])
+        metrics.incr("fetch_requests_total", outcome="error" if result["error"] else "ok")
+        metrics.incr("bytes_total", len(result["html"]), span="fetch")
+        return result
+
+    async def worker():
+        for url in todo:
+            await results.put(await fetch(url))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    done = asyncio.ensure_future(asyncio.gather(*workers))
+    try:
+        while not (done.done() and results.empty()):
+            getter = asyncio.ensure_future(results.get())
+            await asyncio.wait({getter, done}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+        done.result()
+    finally:
+        for w in workers:
+            w.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def fetch_many(urls, **kwargs) -> Iterator[dict]:
+    """Synchronous wrapper around afetch_many: yields fetch results as they complete."""
+    loop = asyncio.new_event_loop()
+    agen = afetch_many(urls, **kwargs)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+def analyze_many(urls, batch_size: int = 100, backend: str = "html.parser", **fetch_kwargs) -> Iterator[pd.DataFrame]:
+    """
+    Bulk counterpart of analyze_url: fetches with fetch_many and streams parsed batches of
+    url, title, body_text, word_count, status, error (failed fetches have empty text).
+    """
+    rows = []
+    for res in fetch_many(urls, **fetch_kwargs):
+        title, body = extract_title_and_body_from_html(res["html"], backend=backend) if res["html"] else ("", "")
+        rows.append({"url": res["url"], "title": title, "body_text": body, "word_count": len(body.split()),
+                     "status": res["status"], "error": res["error"]})
+        if len(rows) >= batch_size:
+            yield pd.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows)
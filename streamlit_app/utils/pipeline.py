@@ -0,0 +1,236 @@
+from pathlib import Path
+from collections import deque
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+from utils import parser, features, scorer, store, metrics, clusters, hashing, boilerplate, sharding
+
+# Headless batch pipeline: crawl file -> parsed text -> site boilerplate stripped ->
+# features + labels -> duplicate pairs, written as Parquet part files under one output
+# directory: text in parsed/, numeric features partitioned by quality_label in features/,
+# TF-IDF rows as .npz in tfidf/, the per-domain block table in boilerplate/, duplicate
+# pairs (computed as a utils.sharding job in dupjob/) and their near-duplicate clusters
+# (one row per page) at the top level. Every finished part is recorded in checkpoint.json
+# so an interrupted run can resume without redoing it.
+CHECKPOINT = "checkpoint.json"
+DUPLICATE_JOB = "dupjob"
+PART_DIRS = ("parsed", "features", "tfidf")
+
+
+def _part(n: int) -> str:
+    return f"part-{n:05d}"
+
+
+class Checkpoint:
+    def __init__(self, out_dir: Path, resume: bool):
+        self.path = Path(out_dir) / CHECKPOINT
+        self.state = json.loads(self.path.read_text()) if resume and self.path.exists() else {}
+
+    def done(self, stage: str) -> set:
+        return set(self.state.get(stage, []))
+
+    def mark(self, stage: str, item):
+        self.state.setdefault(stage, [])
+        if item not in self.state[stage]:
+            self.state[stage].append(item)
+        # write-then-rename so a crash never leaves a truncated checkpoint
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.state, indent=2))
+        os.replace(tmp, self.path)
+
+
+def parse_stage(input_path: Path, out_dir: Path, ckpt: Checkpoint, chunksize: int, workers: int, backend: str,
+                blocks: bool = False):
+    parsed_dir = Path(out_dir) / "parsed"
+    parsed_dir.mkdir(parents=True, exist_ok=True)
+    done = ckpt.done("parsed")
+    pending_ids = deque()
+
+    def todo():
+        for k, chunk in enumerate(parser.read_crawl(input_path, chunksize=chunksize)):
+            if k not in done:
+                pending_ids.append(k)
+                yield chunk
+
+    backend = parser.best_backend() if backend == "auto" else backend
+    for batch in parser.parse_chunks(todo(), backend, workers, blocks=blocks):
+        k = pending_ids.popleft()
+        batch = batch.drop(columns=["html_content"], errors="ignore")
+        batch.insert(0, "doc_id", np.arange(k * chunksize, k * chunksize + len(batch)))
+        batch.to_parquet(parsed_dir / f"{_part(k)}.parquet", index=False)
+        ckpt.mark("parsed", k)
+    return sorted(ckpt.done("parsed"))
+
+
+def boilerplate_stage(out_dir: Path, ckpt: Checkpoint, parts, table_path: Optional[Path] = None):
+    parsed_dir = Path(out_dir) / "parsed"
+    target = Path(out_dir) / boilerplate.TABLE
+    if "boilerplate" not in ckpt.done("stages") or not target.exists():
+        # every page is counted before any is stripped, so early parts see the whole crawl's templates
+        table = boilerplate.BlockTable.load(table_path) if table_path else boilerplate.BlockTable()
+        for k in parts:
+            blocks = store.read_dataset(parsed_dir / f"{_part(k)}.parquet", columns=["url", "blocks"])
+            table.update(blocks["url"], blocks["blocks"])
+        table.save(target)
+        if table_path:
+            table.save(table_path)
+        ckpt.mark("stages", "boilerplate")
+    table = boilerplate.BlockTable.load(target)
+    done = ckpt.done("stripped")
+    for k in parts:
+        if k in done:
+            continue
+        path = parsed_dir / f"{_part(k)}.parquet"
+        tmp = path.with_suffix(".tmp")
+        table.strip_frame(store.read_dataset(path)).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        ckpt.mark("stripped", k)
+
+
+def vocab_stage(out_dir: Path, ckpt: Checkpoint, parts, vocab_path: Optional[Path] = None, hashed: bool = False):
+    if hashed:
+        # fixed-memory term space: one streaming pass over the parsed text, no vocabulary in RAM
+        target = Path(out_dir) / hashing.STATE
+        if "vocab" not in ckpt.done("stages") or not target.exists():
+            chunks = (store.read_dataset(Path(out_dir) / "parsed" / f"{_part(k)}.parquet", columns=["body_text"])
+                      ["body_text"].fillna("").tolist() for k in parts)
+            hashing.HashingTfidf().fit(chunks).save(target)
+        ckpt.mark("stages", "vocab")
+        return hashing.HashingTfidf.load(target)
+    target = Path(out_dir) / "vocab.npz"
+    if vocab_path:
+        vec = features.load_vectorizer(vocab_path)
+        features.save_vectorizer(vec, target)
+    elif "vocab" not in ckpt.done("stages") or not target.exists():
+        texts = pd.concat([store.read_dataset(Path(out_dir) / "parsed" / f"{_part(k)}.parquet", columns=["body_text"])
+                           for k in parts])["body_text"]
+        vec = features.make_vectorizer().fit(texts.fillna("").astype(str))
+        features.save_vectorizer(vec, target)
+    ckpt.mark("stages", "vocab")
+    return features.load_vectorizer(target)
+
+
+def features_stage(out_dir: Path, ckpt: Checkpoint, parts, vec, model, batch_size: int):
+    feat_dir, tfidf_dir = Path(out_dir) / "features", Path(out_dir) / "tfidf"
+    feat_dir.mkdir(exist_ok=True)
+    tfidf_dir.mkdir(exist_ok=True)
+    done = ckpt.done("featurized")
+    for k in parts:
+        if k in done:
+            continue
+        parsed = pd.read_parquet(Path(out_dir) / "parsed" / f"{_part(k)}.parquet")
+        feat_df, _, X = features.compute_features(parsed, vectorizer=vec)
+        labels = scorer.score_dataframe(feat_df, model=model, batch_size=batch_size, labels_only=True)
+        numeric, _ = store.split_text(feat_df)
+        out = pd.concat([numeric, labels], axis=1)
+        store.write_dataset(out, feat_dir, partition_cols=["quality_label"], part=_part(k))
+        store.save_sparse(X, tfidf_dir / f"{_part(k)}.npz")
+        ckpt.mark("featurized", k)
+
+
+def duplicates_stage(out_dir: Path, ckpt: Checkpoint, parts, sim_threshold: float, workers: int):
+    target = Path(out_dir) / "duplicates.parquet"
+    if "duplicates" in ckpt.done("stages") and target.exists():
+        return
+    # parsed parts are row-aligned with the tfidf parts; only their key columns are read
+    meta = pd.concat([store.read_dataset(Path(out_dir) / "parsed" / f"{_part(k)}.parquet",
+                                         columns=["doc_id", "url", "word_count"]) for k in parts], ignore_index=True)
+    # every pair of tfidf parts is one block of a utils.sharding job; blocks finished
+    # before an interruption are not rerun, and other nodes may join with `sharding work`
+    job_dir = Path(out_dir) / DUPLICATE_JOB
+    shards = [Path(out_dir) / "tfidf" / f"{_part(k)}.npz" for k in parts]
+    ids = pd.DataFrame({"id": np.arange(len(meta)), "url": meta["url"]})
+    if "duplicates_planned" not in ckpt.done("stages"):
+        shutil.rmtree(job_dir, ignore_errors=True)
+    try:
+        sharding.plan(job_dir, shards, ids, sim_threshold=sim_threshold)
+    except ValueError:
+        # the job is over tfidf parts since rewritten (or another threshold): start it over
+        shutil.rmtree(job_dir)
+        sharding.plan(job_dir, shards, ids, sim_threshold=sim_threshold)
+    ckpt.mark("stages", "duplicates_planned")
+    sharding.run_local(job_dir, workers)
+    rows, cols, sims = sharding.merge_pairs(job_dir)
+    doc_ids, urls = meta["doc_id"].to_numpy(), meta["url"].to_numpy(dtype=object)
+    store.write_dataset(store.pairs_frame(rows, cols, sims, urls, ids=doc_ids), target)
+    groups = clusters.DuplicateClusters.from_pairs(rows, cols, len(meta))
+    frame = groups.frame(urls, priority=meta["word_count"].to_numpy())
+    # cluster ids are row positions; report them as doc ids like the pair table
+    frame.insert(0, "doc_id", doc_ids)
+    frame["cluster_id"] = doc_ids[frame["cluster_id"].to_numpy()]
+    store.write_dataset(frame, Path(out_dir) / "clusters.parquet")
+    ckpt.mark("stages", "duplicates")
+
+
+def run(input_path: Path, out_dir: Path, model=None, workers: int = 1, chunksize: int = 1000, resume: bool = False,
+        backend: str = "html.parser", vocab_path: Optional[Path] = None, sim_threshold: float = 0.9,
+        batch_size: int = 100000, hashed: bool = False, strip_boilerplate: bool = True,
+        boilerplate_table: Optional[Path] = None) -> dict:
+    """
+    Runs every stage over input_path and returns per-stage wall-clock timings; the
+    instrumentation registry (utils.metrics) is written to out_dir/metrics.prom.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ckpt = Checkpoint(out_dir, resume)
+    if not ckpt.state:
+        # fresh run: part files of an earlier run into out_dir (a longer crawl, other
+        # labels) would otherwise be read back alongside the new ones
+        for sub in PART_DIRS:
+            shutil.rmtree(out_dir / sub, ignore_errors=True)
+    if ckpt.state.setdefault("chunksize", chunksize) != chunksize:
+        raise ValueError(f"Checkpoint was written with chunksize={ckpt.state['chunksize']}; resume with the same value")
+    timings = {}
+    t = time.perf_counter()
+    parts = parse_stage(input_path, out_dir, ckpt, chunksize, workers, backend, blocks=strip_boilerplate)
+    timings["parse"] = time.perf_counter() - t
+    if strip_boilerplate:
+        t = time.perf_counter()
+        boilerplate_stage(out_dir, ckpt, parts, boilerplate_table)
+        timings["boilerplate"] = time.perf_counter() - t
+    t = time.perf_counter()
+    vec = vocab_stage(out_dir, ckpt, parts, vocab_path, hashed=hashed)
+    timings["vocab"] = time.perf_counter() - t
+    t = time.perf_counter()
+    features_stage(out_dir, ckpt, parts, vec, model, batch_size)
+    timings["features"] = time.perf_counter() - t
+    t = time.perf_counter()
+    duplicates_stage(out_dir, ckpt, parts, sim_threshold, workers)
+    timings["duplicates"] = time.perf_counter() - t
+    for stage, seconds in timings.items():
+        metrics.observe(f"pipeline_{stage}", seconds)
+    metrics.export(out_dir / "metrics.prom")
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    base_dir = Path(__file__).resolve().parent.parent
+    ap = argparse.ArgumentParser(description="Batch parse -> features -> score -> duplicates over a crawl file.")
+    ap.add_argument("input", help="crawl export (.csv or .parquet) with url and html_content")
+    ap.add_argument("out", help="output directory for the Parquet datasets")
+    ap.add_argument("--model", default=None, help="default: the pickle, else the exported .npz artifact")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunksize", type=int, default=1000, help="rows per input chunk / output part")
+    ap.add_argument("--resume", action="store_true", help="skip parts recorded in checkpoint.json")
+    ap.add_argument("--backend", default="html.parser",
+                    help="html.parser, lxml, selectolax or auto; malformed html parses differently per backend")
+    ap.add_argument("--vocab", help="reuse a vocabulary saved with features.save_vectorizer")
+    ap.add_argument("--sim-threshold", type=float, default=0.9)
+    ap.add_argument("--hashing", action="store_true", help="fixed-memory hashed term space (utils.hashing)")
+    ap.add_argument("--keep-boilerplate", action="store_true", help="do not strip blocks repeated across a site")
+    ap.add_argument("--boilerplate-table", help="block table of earlier crawls to seed from and update (utils.boilerplate)")
+    args = ap.parse_args()
+
+    model_path = Path(args.model) if args.model else scorer.default_model_path(base_dir / "models", bulk=True)
+    timings = run(args.input, args.out, model=scorer.load_model(model_path), workers=args.workers,
+                  chunksize=args.chunksize, resume=args.resume, backend=args.backend, vocab_path=args.vocab,
+                  sim_threshold=args.sim_threshold, hashed=args.hashing,
+                  strip_boilerplate=not args.keep_boilerplate, boilerplate_table=args.boilerplate_table)
+    print(json.dumps({stage: round(sec, 3) for stage, sec in timings.items()}, indent=2))
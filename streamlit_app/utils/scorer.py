@@ -2,8 +2,31 @@ from pathlib import Path
 import joblib
 import pandas as pd
 import numpy as np
+from typing import Optional
+
+from utils import features, metrics
+
+# models/quality_model.pkl is the trained model; quality_model.npz its export (utils.inference)
+MODEL_NAME = "quality_model"
+
+def default_model_path(models_dir: Path, bulk: bool = False) -> Optional[Path]:
+    """
+    The model file to use from models_dir, or None. The .npz artifact loads in milliseconds
+    and scores a few rows fastest; for bulk scoring (building an index, the batch pipeline)
+    the pickle goes first, as sklearn's compiled trees are several times faster on
+    thousands of rows. Falls back to whichever file exists.
+    """
+    npz, pkl = Path(models_dir) / f"{MODEL_NAME}.npz", Path(models_dir) / f"{MODEL_NAME}.pkl"
+    return next((p for p in ((pkl, npz) if bulk else (npz, pkl)) if p.exists()), None)
 
 def load_model(model_path: Path):
+    """
+    Loads a joblib/pickle model, or an exported .npz inference artifact (utils.inference).
+    Pickle failures fall back to rules; an invalid artifact raises ModelArtifactError.
+    """
+    if model_path and Path(model_path).suffix == ".npz":
+        from utils.inference import load_artifact
+        return load_artifact(model_path)
     try:
         if not model_path:
             return None
@@ -27,28 +50,67 @@ def rule_based_label(row):
         return "Low"
     return "Medium"
 
-def score_dataframe(df: pd.DataFrame, model=None) -> pd.DataFrame:
-    out = df.copy()
+def rule_based_labels(word_count, readability) -> np.ndarray:
+    """Vectorized rule_based_label over whole columns (same thresholds, same NaN handling)."""
+    wc = np.asarray(word_count, dtype=float)
+    r = np.asarray(readability, dtype=float)
+    with np.errstate(invalid="ignore"):
+        high = (wc > 1500) & (r >= 50) & (r <= 70)
+        low = (wc < 500) | (r < 30)
+    return np.select([high, low], ["High", "Low"], default="Medium").astype(object)
+
+MODEL_FEATURES = ["word_count", "sentence_count", "flesch_reading_ease"]
+
+def predict_in_batches(model, X: pd.DataFrame, batch_size: int = 100000) -> np.ndarray:
+    """model.predict over fixed-size row batches, so memory stays bounded for huge tables."""
+    if batch_size is None or len(X) <= batch_size:
+        return np.asarray(model.predict(X))
+    parts = [np.asarray(model.predict(X.iloc[i:i + batch_size])) for i in range(0, len(X), batch_size)]
+    return np.concatenate(parts)
+
+@metrics.timed("score_dataframe")
+def score_dataframe(df: pd.DataFrame, model=None, batch_size: int = 100000, labels_only=False) -> pd.DataFrame:
+    """
+    Adds quality_label_rule, quality_label_model and quality_label.
+    labels_only=True skips copying df and returns just those three columns (same index).
+    """
     # ensure required columns exist
-    if "word_count" not in out.columns or "flesch_reading_ease" not in out.columns:
-        out["word_count"] = out.get("body_text", "").apply(lambda t: len(str(t).split()))
-        out["flesch_reading_ease"] = out.get("body_text", "").apply(lambda t: 0.0)
+    if "word_count" not in df.columns or "flesch_reading_ease" not in df.columns:
+        df = df.copy()
+        df["word_count"] = df.get("body_text", "").apply(lambda t: len(str(t).split()))
+        df["flesch_reading_ease"] = df.get("body_text", "").apply(lambda t: 0.0)
+    labels = pd.DataFrame(index=df.index)
     # rule-based label
-    out["quality_label_rule"] = out.apply(rule_based_label, axis=1)
+    labels["quality_label_rule"] = rule_based_labels(df["word_count"], df["flesch_reading_ease"])
     # if model available, try to use it
     if model is not None:
         try:
             # model expects numeric features; try common names
-            X = out[["word_count", "sentence_count", "flesch_reading_ease"]].fillna(0)
-            preds = model.predict(X)
+            X = df[getattr(model, "feature_columns", None) or MODEL_FEATURES].fillna(0)
+            with metrics.span("model_predict", docs=len(X)):
+                preds = predict_in_batches(model, X, batch_size=batch_size)
             # if model outputs labels, use them. If outputs numeric, map roughly.
-            out["quality_label_model"] = preds
-            out["quality_label"] = out["quality_label_model"].fillna(out["quality_label_rule"])
+            labels["quality_label_model"] = preds
+            labels["quality_label"] = labels["quality_label_model"].fillna(labels["quality_label_rule"])
         except Exception as e:
             print(f"Model scoring failed: {e}")
-            out["quality_label_model"] = None
-            out["quality_label"] = out["quality_label_rule"]
+            labels["quality_label_model"] = None
+            labels["quality_label"] = labels["quality_label_rule"]
     else:
-        out["quality_label_model"] = None
-        out["quality_label"] = out["quality_label_rule"]
+        labels["quality_label_model"] = None
+        labels["quality_label"] = labels["quality_label_rule"]
+    if labels_only:
+        return labels
+    out = df.copy()
+    for col in labels.columns:
+        out[col] = labels[col]
     return out
+
+def warm_up(model=None, vectorizer=None):
+    """
+    Pushes one tiny document through features and scoring (against vectorizer, if given),
+    so the first real request does not pay for lazy imports and first-call setup.
+    """
+    sample = pd.DataFrame([{"url": "", "title": "", "body_text": "Warm up the pipeline. It runs once.", "word_count": 6}])
+    feat_df, _, _ = features.compute_features(sample, vectorizer=vectorizer)
+    score_dataframe(feat_df, model=model)
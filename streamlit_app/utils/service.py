@@ -0,0 +1,380 @@
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+from typing import List, Optional
+
+from utils import parser, features, scorer, index, metrics, boilerplate
+from utils.cache import PageCache
+
+# Local analysis service: one HTTP endpoint wrapping fetch -> parse -> features -> score ->
+# similar high-quality pages. Requests wait in a bounded queue; a dispatcher thread
+# gathers them into micro-batches (up to max_batch urls or max_wait seconds) and hands
+# each batch to a process pool whose workers hold the model and the (memory-mapped)
+# index, so a batch costs one vectorizer transform, one predict and one similarity
+# product. At most 2 batches per worker are in flight; beyond that the queue fills and
+# new requests get 503 instead of piling up. Endpoints:
+#   POST /analyze {"url": ...}   analysis as JSON (result, has_corpus, n_high, similar, spans)
+#   GET  /stats                  queue depth, in-flight batches, latency percentiles
+#   GET  /metrics                the same plus utils.metrics, as Prometheus text
+#   GET  /healthz
+DEFAULT_PORT = 8765
+FETCH_THREADS = 8
+LATENCY_WINDOW = 10000
+QUANTILES = (50, 90, 99)
+
+
+class Overloaded(Exception):
+    """The request queue is full; the caller should retry later."""
+
+
+class AnalysisError(Exception):
+    """The url could not be fetched or analyzed."""
+
+
+# --------------------------------------------------------------------
+# worker process side: state is loaded by the pool initializer, and reloaded before a
+# batch when the model file or the index manifest has changed since
+_state = {}
+
+
+def _stamp(path: Optional[Path]):
+    try:
+        stat = os.stat(path)
+    except (TypeError, OSError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _refresh():
+    """
+    Reloads the model and the index if their files changed, e.g. after `utils.index --update`
+    published a new generation: the one loaded before is pruned two publications later.
+    """
+    model_path, index_dir = _state["model_path"], _state["index_dir"]
+    stamp = _stamp(model_path)
+    if "model" not in _state or stamp != _state["model_stamp"]:
+        _state.update(model=scorer.load_model(Path(model_path)) if model_path else None, model_stamp=stamp)
+    stamp = _stamp(Path(index_dir) / index.MANIFEST if index_dir else None)
+    if "corpus" not in _state or stamp != _state["index_stamp"]:
+        corpus = index.load_index(index_dir) if index_dir else None
+        _state.update(corpus=corpus, high=None, sim=None, table=None, index_stamp=stamp)
+        if corpus is not None:
+            high_df, sim = corpus.similarity_index("High", columns=["url", "word_count", "flesch_reading_ease"])
+            _state.update(high=high_df, sim=sim,
+                          table=boilerplate.BlockTable.load(corpus.index_dir / index.BOILERPLATE))
+
+
+def _init_worker(index_dir: Optional[str], model_path: Optional[str], cache_path: Optional[str], top_k: int):
+    # the page cache is opened here, so every process has its own SQLite connection
+    _state.clear()
+    _state.update(index_dir=index_dir, model_path=model_path, top_k=top_k,
+                  cache=PageCache(cache_path) if cache_path else None,
+                  fetcher=ThreadPoolExecutor(FETCH_THREADS))
+    _refresh()
+    corpus = _state["corpus"]
+    scorer.warm_up(_state["model"], vectorizer=corpus.vectorizer if corpus is not None else None)
+
+
+def _fetch(url: str, timeout):
+    return parser.analyze_url(url, timeout=timeout, cache=_state["cache"], boilerplate=_state["table"])
+
+
+def _analyze_batch(urls: List[str], timeout) -> dict:
+    """url -> {"analysis": ...} or {"error": ...} for one micro-batch, plus the batch's span records."""
+    _refresh()
+    corpus, out = _state["corpus"], {}
+    with metrics.collect() as spans:
+        with metrics.span("analyze_batch", docs=len(urls)):
+            # fetches are I/O bound: overlap them on threads (sharing this collector)
+            pending = {u: _state["fetcher"].submit(contextvars.copy_context().run, _fetch, u, timeout) for u in urls}
+            frames = {}
+            for u, fut in pending.items():
+                try:
+                    frames[u] = fut.result()
+                except Exception as e:
+                    out[u] = {"error": f"{type(e).__name__}: {e}"}
+            ok = [u for u in urls if u in frames]
+            if ok:
+                df = pd.concat([frames[u] for u in ok], ignore_index=True)
+                if corpus is not None:
+                    feat_df, _, X = features.compute_features(df, vectorizer=corpus.vectorizer)
+                else:
+                    # without a corpus each page is its own vocabulary, as in the inline app path
+                    feat_df = pd.concat([features.compute_features(df.iloc[[i]])[0] for i in range(len(df))],
+                                        ignore_index=True)
+                scored = scorer.score_dataframe(feat_df, model=_state["model"])
+                high = _state["high"]
+                matches = (_state["sim"].query_many(X, k=_state["top_k"])
+                           if high is not None and not high.empty else [None] * len(ok))
+                for i, u in enumerate(ok):
+                    similar = []
+                    if matches[i] is not None:
+                        idx, sims = matches[i]
+                        similar = high.iloc[idx].assign(similarity=sims).to_dict("records")
+                    out[u] = {"analysis": {"result": scored.iloc[i].to_dict(), "has_corpus": corpus is not None,
+                                           "n_high": 0 if high is None else len(high), "similar": similar}}
+    return {"results": out, "spans": spans}
+
+
+# --------------------------------------------------------------------
+# service process side
+class AnalysisService:
+    """
+    Micro-batching front of the worker pool. submit() returns a Future of the analysis
+    dict and raises Overloaded when queue_size requests are already waiting.
+    """
+
+    def __init__(self, index_dir: Optional[Path] = None, model_path: Optional[Path] = None,
+                 cache_path: Optional[Path] = None, workers: Optional[int] = None, max_batch: int = 16,
+                 max_wait: float = 0.01, queue_size: int = 256, timeout: float = 8, top_k: int = 3):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.inflight = threading.BoundedSemaphore(2 * self.workers)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counts = {"requests": 0, "rejected": 0, "errors": 0, "batches": 0, "batched_urls": 0}
+        self.inflight_batches = 0
+        self._lock = threading.Lock()
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker,
+            initargs=(str(index_dir) if index_dir else None, str(model_path) if model_path else None,
+                      str(cache_path) if cache_path else None, top_k))
+        self._dispatcher = threading.Thread(target=self._dispatch, name="service-dispatch", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, url: str) -> Future:
+        fut = Future()
+        try:
+            self.queue.put_nowait((url, fut, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self.counts["rejected"] += 1
+            metrics.incr("service_requests_total", outcome="rejected")
+            raise Overloaded(f"{self.queue.maxsize} requests already queued")
+        return fut
+
+    def analyze(self, url: str, timeout: Optional[float] = None) -> dict:
+        return self.submit(url).result(timeout=timeout)
+
+    def _dispatch(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            batch = [job]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if job is None:
+                    self.queue.put(None)
+                    break
+                batch.append(job)
+            # blocks while every worker has 2 batches queued: the request queue absorbs the rest
+            self.inflight.acquire()
+            urls = list(dict.fromkeys(url for url, _, _ in batch))
+            with self._lock:
+                self.inflight_batches += 1
+                self.counts["batches"] += 1
+                self.counts["batched_urls"] += len(urls)
+            metrics.incr("service_batches_total")
+            metrics.incr("service_batched_urls_total", len(urls))
+            try:
+                done = self.pool.submit(_analyze_batch, urls, self.timeout)
+            except Exception as e:
+                self._release()
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            done.add_done_callback(lambda f, batch=batch: self._finish(batch, f))
+
+    def _release(self):
+        with self._lock:
+            self.inflight_batches -= 1
+        self.inflight.release()
+
+    def _finish(self, batch, done: Future):
+        self._release()
+        try:
+            payload = done.result()
+            results, spans = payload["results"], payload["spans"]
+        except Exception as e:
+            results, spans = {url: {"error": f"{type(e).__name__}: {e}"} for url, _, _ in batch}, []
+        now = time.perf_counter()
+        for url, fut, queued_at in batch:
+            res = results.get(url, {"error": "missing from batch result"})
+            latency = now - queued_at
+            with self._lock:
+                self.latencies.append(latency)
+                self.counts["requests"] += 1
+                self.counts["errors"] += "error" in res
+            metrics.observe("service_request", latency)
+            metrics.incr("service_requests_total", outcome="error" if "error" in res else "ok")
+            if "error" in res:
+                fut.set_exception(AnalysisError(res["error"]))
+            else:
+                fut.set_result({**res["analysis"], "spans": spans, "service_seconds": latency})
+
+    def stats(self) -> dict:
+        with self._lock:
+            lat = np.array(self.latencies)
+            counts = dict(self.counts)
+            inflight = self.inflight_batches
+        out = {"queue_depth": self.queue.qsize(), "queue_size": self.queue.maxsize,
+               "inflight_batches": inflight, "workers": self.workers, **counts,
+               "mean_batch": counts["batched_urls"] / counts["batches"] if counts["batches"] else 0.0}
+        for q in QUANTILES:
+            out[f"p{q}_seconds"] = float(np.percentile(lat, q)) if len(lat) else None
+        return out
+
+    def export_metrics(self) -> str:
+        stats = self.stats()
+        metrics.gauge("service_queue_depth", stats["queue_depth"])
+        metrics.gauge("service_inflight_batches", stats["inflight_batches"])
+        for q in QUANTILES:
+            if stats[f"p{q}_seconds"] is not None:
+                metrics.gauge("service_latency_seconds", stats[f"p{q}_seconds"], quantile=f"{q / 100:g}")
+        return metrics.to_prometheus()
+
+    def close(self):
+        self.queue.put(None)
+        self._dispatcher.join(timeout=5)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _jsonable(obj):
+    # numpy scalars/arrays and the odd pandas value inside result dicts
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+def make_handler(service: AnalysisService, request_timeout: float = 60):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body, content_type="application/json", headers=None):
+            data = body if isinstance(body, bytes) else json.dumps(body, default=_jsonable).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/healthz":
+                self._send(200, {"ok": True})
+            elif self.path == "/stats":
+                self._send(200, service.stats())
+            elif self.path == "/metrics":
+                self._send(200, service.export_metrics().encode(), content_type="text/plain; version=0.0.4")
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/analyze":
+                return self._send(404, {"error": "not found"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                url = str(payload.get("url", "")).strip()
+            except (ValueError, AttributeError):
+                return self._send(400, {"error": "expected a JSON object with a url"})
+            if not url:
+                return self._send(400, {"error": "URL empty"})
+            try:
+                self._send(200, service.analyze(url, timeout=request_timeout))
+            except Overloaded as e:
+                self._send(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            except AnalysisError as e:
+                self._send(502, {"error": str(e)})
+            except TimeoutError:
+                self._send(504, {"error": f"no result within {request_timeout}s"})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve(service: AnalysisService, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.daemon_threads = True
+    return server
+
+
+# --------------------------------------------------------------------
+# client side (used by the Streamlit app)
+_CLIENT = None
+
+
+def request_analysis(service_url: str, url: str, timeout: float = 60) -> dict:
+    """
+    Analysis of `url` from a running service, in the shape of the app's inline analyze():
+    `similar` as a dataframe. The worker's span records are added to the active collector.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = requests.Session()
+    with metrics.span("service_request"):
+        resp = _CLIENT.post(service_url.rstrip("/") + "/analyze", json={"url": url}, timeout=timeout)
+    body = resp.json() if resp.headers.get("Content-Type", "").startswith("application/json") else {}
+    if resp.status_code != 200:
+        raise RuntimeError(f"analysis service: HTTP {resp.status_code} {body.get('error', '')}".strip())
+    metrics.merge(body.pop("spans", []))
+    body["similar"] = pd.DataFrame(body["similar"])
+    return body
+
+
+if __name__ == "__main__":
+    import argparse
+
+    base_dir = Path(__file__).resolve().parent.parent
+    ap = argparse.ArgumentParser(description="Serve batched url analysis over HTTP for the Streamlit app.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--data", default=str(base_dir.parent / "data" / "data.csv"))
+    ap.add_argument("--index", default=str(base_dir / "models" / "index"))
+    ap.add_argument("--model", default=None, help="default: the .npz artifact if exported, else the pickle")
+    ap.add_argument("--page-cache", default=str(base_dir / "models" / "page_cache.sqlite"))
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--max-batch", type=int, default=16)
+    ap.add_argument("--max-wait-ms", type=float, default=10)
+    ap.add_argument("--queue-size", type=int, default=256)
+    args = ap.parse_args()
+
+    model_path = Path(args.model) if args.model else scorer.default_model_path(base_dir / "models")
+    # build (or refresh) the index once here, scoring the corpus in bulk; workers only map it
+    if Path(args.data).exists():
+        bulk_path = Path(args.model) if args.model else scorer.default_model_path(base_dir / "models", bulk=True)
+        index.load_or_build_index(args.data, args.index, model=scorer.load_model(bulk_path), model_path=bulk_path)
+    service = AnalysisService(args.index if index.load_index(args.index) else None, model_path, args.page_cache,
+                              workers=args.workers, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000,
+                              queue_size=args.queue_size)
+    server = serve(service, args.host, args.port)
+    print(f"serving on http://{args.host}:{args.port} with {service.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,363 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from typing import List, Optional
+
+from utils import features, store, metrics
+
+# Sharded duplicate detection over a shared filesystem. A job directory lists the row
+# shards of the tf-idf matrix (job.json) and holds one task file per shard block (a, b),
+# a <= b. Any number of worker processes, on one machine or on several that mount the
+# same directory, claim tasks by renaming them from tasks/todo/ to tasks/running/ (atomic
+# on POSIX filesystems), write the block's pairs to results/ and move the task to
+# tasks/done/. Claims are heartbeated and name their host:pid; claims of dead processes
+# on the local host, and claims older than the lease (a crashed worker elsewhere), are
+# put back in todo/, finished blocks never run again. A job is tied to the content of
+# its shards, not just their paths. merge() deduplicates and sorts every block's pairs
+# into the duplicates.csv schema. Layout:
+#   job.json  ids.parquet  tasks/{todo,running,done}/block-AAAAA-BBBBB  results/block-AAAAA-BBBBB.parquet
+JOB = "job.json"
+IDS = "ids.parquet"
+LEASE_SECONDS = 600
+POLL_SECONDS = 1.0
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _task(a: int, b: int) -> str:
+    return f"block-{a:05d}-{b:05d}"
+
+
+def _blocks(name: str):
+    _, a, b = name.split("-")
+    return int(a), int(b)
+
+
+def _fingerprint(X) -> str:
+    X = sparse.csr_matrix(X)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.asarray(X.shape, dtype=np.int64).tobytes())
+    for name in ("indptr", "indices", "data"):
+        h.update(np.ascontiguousarray(getattr(X, name)).tobytes())
+    return h.hexdigest()
+
+
+def _ids_fingerprint(ids: pd.DataFrame) -> str:
+    values = pd.util.hash_pandas_object(ids[["id", "url"]].reset_index(drop=True), index=False).to_numpy()
+    return hashlib.blake2b(values.tobytes(), digest_size=16).hexdigest()
+
+
+def plan(job_dir: Path, shard_paths: List[Path], ids: pd.DataFrame, sim_threshold: float = 0.9,
+         memory_budget_mb: int = 256, fingerprints: Optional[List[str]] = None) -> dict:
+    """
+    Creates a job over the given .npz row shards, or returns the job already in job_dir if
+    it is over the same shard contents, ids and threshold (and raises if it is not).
+    ids has one row per matrix row in shard order, with the `id` reported as i/j (row
+    number, doc_id...) and its `url`. fingerprints, if the caller has them, saves reading
+    the shards.
+    """
+    job_dir = Path(job_dir)
+    shard_paths = [str(Path(p).resolve()) for p in shard_paths]
+    if fingerprints is None:
+        fingerprints = [_fingerprint(store.load_sparse(p)) for p in shard_paths]
+    expected = {"shards": shard_paths, "fingerprints": list(fingerprints), "ids": _ids_fingerprint(ids),
+                "sim_threshold": sim_threshold}
+    if (job_dir / JOB).exists():
+        job = json.loads((job_dir / JOB).read_text())
+        if all(job.get(key) == value for key, value in expected.items()):
+            return job
+        raise ValueError(f"{job_dir} already holds a job over other shards, ids or threshold; use a new directory")
+    for sub in ("tasks/todo", "tasks/running", "tasks/done", "results"):
+        (job_dir / sub).mkdir(parents=True, exist_ok=True)
+    rows = [store.sparse_rows(p) for p in shard_paths]
+    if sum(rows) != len(ids):
+        raise ValueError(f"{len(ids)} ids for {sum(rows)} matrix rows")
+    store.write_dataset(ids[["id", "url"]].reset_index(drop=True), job_dir / IDS)
+    for a in range(len(shard_paths)):
+        for b in range(a, len(shard_paths)):
+            (job_dir / "tasks" / "todo" / _task(a, b)).touch()
+    job = dict(expected, rows=rows, offsets=np.cumsum([0] + rows[:-1]).tolist(), memory_budget_mb=memory_budget_mb)
+    # job.json last: a half-planned directory is never picked up by workers
+    (job_dir / JOB).write_text(json.dumps(job, indent=2))
+    return job
+
+
+def partition(X, urls, job_dir: Path, shard_rows: int = 20000, ids=None, **params) -> dict:
+    """
+    Splits an in-memory matrix into float32 row shards under job_dir/shards and plans the
+    job; an existing job in job_dir is resumed only if it was planned over the same matrix.
+    """
+    job_dir = Path(job_dir)
+    X = sparse.csr_matrix(X, dtype=np.float32)
+    shards = [X[start:start + shard_rows] for start in range(0, X.shape[0], shard_rows)]
+    paths = [job_dir / "shards" / f"shard-{k:05d}.npz" for k in range(len(shards))]
+    ids = pd.DataFrame({"id": np.arange(X.shape[0]) if ids is None else ids, "url": urls})
+    fingerprints = [_fingerprint(shard) for shard in shards]
+    if not (job_dir / JOB).exists():
+        # no job yet (or a partition that crashed before planning): (re)write every shard
+        (job_dir / "shards").mkdir(parents=True, exist_ok=True)
+        for shard, path in zip(shards, paths):
+            store.save_sparse(shard, path)
+    return plan(job_dir, paths, ids, fingerprints=fingerprints, **params)
+
+
+def _dead_locally(worker: str) -> bool:
+    # claims read host:pid:nonce; only processes of this host can be checked
+    host, _, rest = worker.partition(":")
+    pid = rest.split(":", 1)[0]
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def requeue_stale(job_dir: Path, lease: float = LEASE_SECONDS) -> int:
+    """
+    Moves claims back to todo/ whose heartbeat is older than lease seconds, or whose
+    worker was a process of this host that no longer exists.
+    """
+    running = Path(job_dir) / "tasks" / "running"
+    moved = 0
+    now = time.time()
+    for path in running.iterdir():
+        try:
+            if now - path.stat().st_mtime > lease or _dead_locally(path.read_text()):
+                # drop the old owner, whose death would otherwise requeue the next claim too
+                os.truncate(path, 0)
+                os.rename(path, Path(job_dir) / "tasks" / "todo" / path.name)
+                moved += 1
+        except FileNotFoundError:
+            # finished or requeued by someone else in the meantime
+            pass
+    return moved
+
+
+def _claim(job_dir: Path, worker: str) -> Optional[str]:
+    todo, running = Path(job_dir) / "tasks" / "todo", Path(job_dir) / "tasks" / "running"
+    for name in sorted(os.listdir(todo)):
+        try:
+            # a rename keeps the file's mtime, which requeue_stale would read as a lease
+            # that expired long ago: start the lease first, so the claim is fresh on arrival
+            os.utime(todo / name)
+            os.rename(todo / name, running / name)
+        except FileNotFoundError:
+            continue  # another worker won this one
+        (running / name).write_text(worker)
+        return name
+    return None
+
+
+def _heartbeat(path: Path, stop: threading.Event, every: float):
+    while not stop.wait(every):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+def _run_block(job: dict, a: int, b: int, cache: dict):
+    # consecutive claims usually share shard a; keep the last two shards loaded
+    def load(k):
+        if k not in cache:
+            if len(cache) >= 2:
+                cache.pop(next(iter(cache)))
+            cache[k] = store.load_sparse(job["shards"][k])
+        return cache[k]
+
+    threshold, budget = job["sim_threshold"], job["memory_budget_mb"]
+    Xa = load(a)
+    if a == b:
+        r, c, s = features.similarity_join(Xa, sim_threshold=threshold, memory_budget_mb=budget)
+    else:
+        r, c, s = features.cross_similarity(Xa, load(b), sim_threshold=threshold, memory_budget_mb=budget)
+    return r + job["offsets"][a], c + job["offsets"][b], s
+
+
+def work(job_dir: Path, worker: Optional[str] = None, lease: float = LEASE_SECONDS,
+         max_tasks: Optional[int] = None) -> int:
+    """Claims and runs tasks until none are left (or max_tasks ran); returns how many ran."""
+    job_dir = Path(job_dir)
+    job = json.loads((job_dir / JOB).read_text())
+    worker = worker or _worker_id()
+    cache, ran = {}, 0
+    while max_tasks is None or ran < max_tasks:
+        requeue_stale(job_dir, lease)
+        name = _claim(job_dir, worker)
+        if name is None:
+            return ran
+        claimed = job_dir / "tasks" / "running" / name
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(claimed, stop, lease / 3), daemon=True)
+        beat.start()
+        try:
+            a, b = _blocks(name)
+            with metrics.span("shard_block", docs=job["rows"][a] + (job["rows"][b] if a != b else 0)):
+                rows, cols, sims = _run_block(job, a, b, cache)
+            target = job_dir / "results" / f"{name}.parquet"
+            tmp = target.with_suffix(f".{uuid.uuid4().hex[:6]}.tmp")
+            store.write_dataset(pd.DataFrame({"i": rows.astype(np.int64), "j": cols.astype(np.int64),
+                                              "similarity": sims.astype(np.float64)}), tmp)
+            os.replace(tmp, target)
+        finally:
+            stop.set()
+            beat.join()
+        try:
+            os.rename(claimed, job_dir / "tasks" / "done" / name)
+        except FileNotFoundError:
+            # the lease ran out and the block was requeued; its result is identical
+            pass
+        ran += 1
+    return ran
+
+
+def status(job_dir: Path) -> dict:
+    tasks = Path(job_dir) / "tasks"
+    return {state: len(os.listdir(tasks / state)) for state in ("todo", "running", "done")}
+
+
+def run_local(job_dir: Path, workers: int = 1, lease: float = LEASE_SECONDS, poll: float = POLL_SECONDS) -> int:
+    """
+    Runs the job's remaining tasks on a local process pool (other nodes may join in) and
+    returns once every block is done, waiting out claims that other workers still hold.
+    """
+    ran = 0
+    while True:
+        if workers <= 1:
+            ran += work(job_dir, lease=lease)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                ran += sum(pool.map(work, [job_dir] * workers, [None] * workers, [lease] * workers))
+        # claims left in running/ belong to live workers elsewhere: they either finish or
+        # stop heartbeating and come back to todo/ once their lease runs out
+        while True:
+            requeue_stale(job_dir, lease)
+            left = status(job_dir)
+            if left["todo"] or not left["running"]:
+                break
+            time.sleep(poll)
+        if not left["todo"]:
+            return ran
+
+
+def merge_pairs(job_dir: Path):
+    """(rows, cols, sims) of every finished block as global row positions, deduplicated and sorted by (i, j)."""
+    job_dir = Path(job_dir)
+    left = status(job_dir)
+    if left["todo"] or left["running"]:
+        raise RuntimeError(f"job not finished: {left}")
+    results = sorted((job_dir / "results").glob("block-*.parquet"))
+    if not results:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    pairs = pd.concat([store.read_dataset(p) for p in results], ignore_index=True)
+    # a block run twice (requeued after its lease ran out) lands in the same file, but
+    # results copied in from another job directory may still overlap
+    pairs = pairs.drop_duplicates(["i", "j"]).sort_values(["i", "j"])
+    return pairs["i"].to_numpy(), pairs["j"].to_numpy(), pairs["similarity"].to_numpy()
+
+
+def merge(job_dir: Path, out: Optional[Path] = None) -> pd.DataFrame:
+    """
+    The merged pairs in the duplicates.csv schema (i/j are the job's ids), written to
+    out (.csv or .parquet) when given.
+    """
+    rows, cols, sims = merge_pairs(job_dir)
+    ids = store.read_dataset(Path(job_dir) / IDS)
+    dups = store.pairs_frame(rows, cols, sims, ids["url"].to_numpy(dtype=object), ids=ids["id"].to_numpy())
+    if out is not None:
+        out = Path(out)
+        if out.suffix == ".parquet":
+            store.write_dataset(dups, out)
+        else:
+            dups.to_csv(out, index=False)
+    return dups
+
+
+def plan_pipeline(out_dir: Path, job_dir: Optional[Path] = None, **params) -> Path:
+    """A job over a utils.pipeline output: its tfidf parts as shards, doc ids as i/j."""
+    out_dir = Path(out_dir)
+    job_dir = Path(job_dir) if job_dir else out_dir / "dupjob"
+    parts = sorted((out_dir / "tfidf").glob("part-*.npz"))
+    ids = pd.concat([store.read_dataset(out_dir / "parsed" / f"{p.stem}.parquet", columns=["doc_id", "url"])
+                     for p in parts], ignore_index=True).rename(columns={"doc_id": "id"})
+    plan(job_dir, parts, ids, **params)
+    return job_dir
+
+
+def find_duplicates_sharded(tfidf_matrix, urls: List[str], sim_threshold=0.9, job_dir: Optional[Path] = None,
+                            shard_rows: int = 20000, workers: int = 1):
+    """features.find_duplicates(method="sharded"): partition, run on a local pool, merge."""
+    with tempfile.TemporaryDirectory() as tmp:
+        job = Path(job_dir) if job_dir else Path(tmp)
+        partition(tfidf_matrix, list(urls), job, shard_rows=shard_rows, sim_threshold=sim_threshold)
+        run_local(job, workers)
+        dups = merge(job)
+    return [{"url1": u1, "url2": u2, "similarity": float(s)}
+            for u1, u2, s in zip(dups["url_i"], dups["url_j"], dups["similarity"])]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Sharded duplicate detection through a file-based work queue.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("plan", help="create a job directory")
+    p.add_argument("job")
+    src = p.add_mutually_exclusive_group(required=True)
+    src.add_argument("--pipeline", help="utils.pipeline output directory (tfidf/ + parsed/)")
+    src.add_argument("--shards", help="utils.hashing shard directory (i/j are row numbers)")
+    p.add_argument("--urls", help="with --shards: .csv/.parquet whose url column is row-aligned with the shards")
+    p.add_argument("--sim-threshold", type=float, default=0.9)
+    p.add_argument("--memory-budget-mb", type=int, default=256)
+    w = sub.add_parser("work", help="claim and run tasks until none are left (run on any node)")
+    w.add_argument("job")
+    w.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    w.add_argument("--lease", type=float, default=LEASE_SECONDS, help="seconds before a silent claim is requeued")
+    s = sub.add_parser("status")
+    s.add_argument("job")
+    m = sub.add_parser("merge", help="write the deduplicated, sorted pairs")
+    m.add_argument("job")
+    m.add_argument("--out", default="duplicates.csv")
+    args = ap.parse_args()
+
+    if args.cmd == "plan":
+        params = {"sim_threshold": args.sim_threshold, "memory_budget_mb": args.memory_budget_mb}
+        if args.pipeline:
+            plan_pipeline(args.pipeline, args.job, **params)
+        else:
+            from utils import hashing
+            sharded = hashing.ShardedMatrix(args.shards)
+            if args.urls:
+                urls = pd.read_parquet(args.urls, columns=["url"]) if args.urls.endswith(".parquet") else \
+                    pd.read_csv(args.urls, usecols=["url"])
+                urls = urls["url"].to_numpy(dtype=object)
+            else:
+                urls = np.full(sharded.shape[0], "", dtype=object)
+            plan(args.job, sharded.paths, pd.DataFrame({"id": np.arange(sharded.shape[0]), "url": urls}), **params)
+        print(json.dumps(status(args.job)))
+    elif args.cmd == "work":
+        print(f"ran {run_local(args.job, args.workers, args.lease)} blocks; {json.dumps(status(args.job))}")
+    elif args.cmd == "status":
+        print(json.dumps(status(args.job)))
+    else:
+        left = status(args.job)
+        if left["todo"] or left["running"]:
+            ap.exit(1, f"job not finished: {json.dumps(left)}\n")
+        dups = merge(args.job, args.out)
+        print(f"{len(dups)} pairs -> {args.out}")
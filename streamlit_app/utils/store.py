@@ -0,0 +1,136 @@
+from pathlib import Path
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from scipy import sparse
+from typing import List, Optional
+
+# Columnar storage: numeric features and free text live in separate Parquet datasets
+# (optionally hive-partitioned, e.g. by quality_label) so readers can project columns
+# and push filters down instead of parsing every body text; sparse matrices go to .npz.
+TEXT_COLUMNS = ("text", "title", "body_text", "html_content")
+# near-duplicate pairs, as written by the index, the pipeline and utils.sharding
+DUPLICATE_COLUMNS = ["i", "j", "similarity", "url_i", "url_j"]
+ROW_GROUP_SIZE = 64 * 1024
+
+
+def split_text(df: pd.DataFrame, key: str = "url"):
+    """Splits df into (features, text) frames that share the key column."""
+    text_cols = [c for c in df.columns if c in TEXT_COLUMNS]
+    return df.drop(columns=text_cols), df[[key] + text_cols]
+
+
+def _clear(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+def write_dataset(df: pd.DataFrame, path: Path, partition_cols: Optional[List[str]] = None,
+                  part: Optional[str] = None):
+    """
+    Writes df as one Parquet file, or as a hive-partitioned directory (key=value/...)
+    when partition_cols is given. Without `part` whatever was at path is replaced;
+    with it, files named after `part` replace that part's earlier files, in every
+    partition, and are added next to those of the other parts.
+    """
+    path = Path(path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if part is None:
+        _clear(path)
+    elif partition_cols and path.is_dir():
+        # a rewritten part may land in other partitions than before (e.g. relabelled rows)
+        for old in path.glob(f"**/{part}-*.parquet"):
+            old.unlink()
+    if partition_cols:
+        ds.write_dataset(table, path, format="parquet", partitioning=partition_cols, partitioning_flavor="hive",
+                         basename_template=f"{part or 'part'}-{{i}}.parquet", max_rows_per_group=ROW_GROUP_SIZE,
+                         existing_data_behavior="overwrite_or_ignore")
+    else:
+        target = path / f"{part}.parquet" if part is not None else path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(table, target, row_group_size=ROW_GROUP_SIZE)
+
+
+def read_dataset(path: Path, columns: Optional[List[str]] = None, filters=None) -> pd.DataFrame:
+    """
+    Reads a Parquet file or (partitioned) directory, loading only `columns` and only the
+    partitions / row groups that can match `filters`, given in pyarrow's DNF form,
+    e.g. [("quality_label", "==", "High")].
+    """
+    dataset = ds.dataset(str(path), format="parquet", partitioning="hive")
+    expr = pq.filters_to_expression(filters) if filters else None
+    table = dataset.to_table(columns=columns, filter=expr)
+    df = table.to_pandas()
+    for field in table.schema:
+        # list columns (e.g. top_keywords) come back as Python lists, as they were written
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            df[field.name] = table.column(field.name).to_pylist()
+    return df
+
+
+def save_sparse(X, path: Path):
+    sparse.save_npz(path, sparse.csr_matrix(X), compressed=False)
+
+
+def load_sparse(path: Path):
+    return sparse.load_npz(path).tocsr()
+
+
+def sparse_rows(path: Path) -> int:
+    """Row count of a matrix saved with save_sparse, without loading its arrays."""
+    with np.load(path) as npz:
+        return int(npz["shape"][0])
+
+
+def sparse_nbytes(X) -> int:
+    X = sparse.csr_matrix(X)
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+
+def pairs_frame(rows, cols, sims, urls, ids=None) -> pd.DataFrame:
+    """Pairs of matrix rows as a DUPLICATE_COLUMNS table; i and j are ids[row], or the rows themselves."""
+    urls = np.asarray(urls, dtype=object)
+    i, j = (rows, cols) if ids is None else (np.asarray(ids)[rows], np.asarray(ids)[cols])
+    return pd.DataFrame({"i": i, "j": j, "similarity": np.round(sims, 4),
+                         "url_i": urls[rows], "url_j": urls[cols]}, columns=DUPLICATE_COLUMNS)
+
+
+def convert_csv(features_csv: Optional[Path], duplicates_csv: Optional[Path], out_dir: Path) -> dict:
+    """
+    Converts the CSV exports (data/features.csv, data/duplicates.csv) to Parquet:
+    numeric columns to out_dir/features (partitioned by quality_label when present,
+    else features.parquet), text to text.parquet, pairs to duplicates.parquet.
+    Returns the written paths.
+    """
+    out_dir = Path(out_dir)
+    written = {}
+    if features_csv:
+        df = pd.read_csv(features_csv)
+        numeric, text = split_text(df)
+        partition = ["quality_label"] if "quality_label" in numeric.columns else None
+        target = out_dir / ("features" if partition else "features.parquet")
+        write_dataset(numeric, target, partition_cols=partition)
+        write_dataset(text, out_dir / "text.parquet")
+        written.update(features=str(target), text=str(out_dir / "text.parquet"))
+    if duplicates_csv:
+        write_dataset(pd.read_csv(duplicates_csv), out_dir / "duplicates.parquet")
+        written["duplicates"] = str(out_dir / "duplicates.parquet")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    data_dir = Path(__file__).resolve().parent.parent.parent / "data"
+    ap = argparse.ArgumentParser(description="Convert the CSV feature/duplicate exports to Parquet.")
+    ap.add_argument("--features", default=str(data_dir / "features.csv"))
+    ap.add_argument("--duplicates", default=str(data_dir / "duplicates.csv"))
+    ap.add_argument("--out", default=str(data_dir / "parquet"))
+    args = ap.parse_args()
+    print(json.dumps(convert_csv(args.features, args.duplicates, args.out), indent=2))